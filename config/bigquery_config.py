@@ -2,6 +2,7 @@
 BigQuery Configuration for Smart E-Commerce Intelligence Engine
 """
 
+import functools
 import os
 import json
 from typing import Optional, Union
@@ -11,6 +12,8 @@ from google.auth.credentials import Credentials
 from google.auth.transport.requests import Request
 from google.oauth2 import service_account
 from google.auth.exceptions import DefaultCredentialsError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 class BigQueryConfig:
     """Configuration class for BigQuery settings"""
@@ -36,13 +39,13 @@ class BigQueryConfig:
         # Vector search settings
         self.vector_index_name = 'product_embeddings_index'
         self.embedding_dimension = 768
+        self.embedding_cache_dir = os.getenv('EMBEDDING_CACHE_DIR', '.embedding_cache')
         
-        # Initialize BigQuery client
-        self.client = bigquery.Client(
-            project=self.project_id,
-            location=self.location,
-            credentials=self.credentials
+        # Persistent per-text embedding cache (set CACHE_DISABLED=true to always query)
+        self.embedding_store_path = os.getenv(
+            'EMBEDDING_STORE_PATH', os.path.expanduser('~/.cache/ecomm-ai/embeddings.sqlite')
         )
+        self.embedding_store_enabled = os.getenv('CACHE_DISABLED', 'false').lower() != 'true'
     
     def _get_credentials(self) -> tuple[Credentials, str]:
         """
@@ -101,6 +104,11 @@ class BigQueryConfig:
                 "3. Run 'gcloud auth application-default login' for default credentials"
             )
     
+    @property
+    def client(self) -> bigquery.Client:
+        """Get the shared BigQuery client"""
+        return get_bigquery_client()
+    
     @property
     def dataset_ref(self):
         """Get dataset reference"""
@@ -140,13 +148,51 @@ class BigQueryConfig:
     def product_images_table(self):
         """Get product images table reference"""
         return f"{self.dataset_ref}.product_images"
+    
+    @property
+    def campaigns_table(self):
+        """Get generated campaigns table reference"""
+        return f"{self.dataset_ref}.campaigns"
+    
+    @property
+    def segment_users_view(self):
+        """Get users-by-segment materialized view reference"""
+        return f"{self.dataset_ref}.mv_segment_users"
+    
+    @property
+    def in_stock_products_view(self):
+        """Get in-stock products materialized view reference"""
+        return f"{self.dataset_ref}.mv_in_stock_products"
 
 # Global configuration instance
 config = BigQueryConfig()
 
+@functools.lru_cache(maxsize=1)
 def get_bigquery_client() -> bigquery.Client:
-    """Get BigQuery client instance"""
-    return config.client
+    """
+    Get the process-wide BigQuery client, creating it on first use
+    
+    Every engine shares this one client, so its connection pool (and the TCP/TLS
+    sessions in it) is reused instead of re-established per engine.
+    """
+    client = bigquery.Client(
+        project=config.project_id,
+        location=config.location,
+        credentials=config.credentials
+    )
+    
+    # Widen the HTTP connection pool to keep concurrent queries from queueing on
+    # the default 10 connections. Failed connects never reach the server, so they
+    # are safe to retry for any method.
+    client._http.mount(
+        "https://",
+        HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=64,
+            max_retries=Retry(total=3, connect=3, read=False, backoff_factor=0.2)
+        )
+    )
+    return client
 
 def get_dataset_ref() -> str:
     """Get dataset reference"""
@@ -54,6 +54,19 @@ MARKETING_CONFIG = {
         'demographics',
         'seasonal_preferences',
         'price_sensitivity'
+    ],
+    # Season words precomputed as product tags; other seasons fall back to a text match
+    'seasonal_tags': [
+        'spring',
+        'summer',
+        'autumn',
+        'fall',
+        'winter',
+        'holiday',
+        'christmas',
+        'halloween',
+        'easter',
+        'valentine'
     ]
 }
 
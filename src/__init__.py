@@ -8,11 +8,17 @@ __version__ = "1.0.0"
 __author__ = "E-Commerce Intelligence Team"
 __description__ = "AI-powered e-commerce intelligence and recommendation engine"
 
-from .ai_engine import AIEngine
-from .marketing_engine import MarketingEngine
-from .vector_search import VectorSearchEngine
-from .forecasting import ForecastingEngine
-from .data_ingestion import DataIngestion
+import importlib
+
+# Engines are imported on first attribute access, so importing one submodule
+# (e.g. `python -m src.main setup`) does not load every engine's dependencies
+_ENGINE_MODULES = {
+    'AIEngine': '.ai_engine',
+    'MarketingEngine': '.marketing_engine',
+    'VectorSearchEngine': '.vector_search',
+    'ForecastingEngine': '.forecasting',
+    'DataIngestion': '.data_ingestion',
+}
 
 __all__ = [
     'AIEngine',
@@ -21,3 +27,10 @@ __all__ = [
     'ForecastingEngine',
     'DataIngestion'
 ]
+
+def __getattr__(name):
+    if name in _ENGINE_MODULES:
+        value = getattr(importlib.import_module(_ENGINE_MODULES[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
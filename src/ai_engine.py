@@ -4,21 +4,44 @@ AI Engine for Smart E-Commerce Intelligence
 Handles text generation, embeddings, and AI operations using BigQuery AI functions.
 """
 
+import functools
+import json
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from google.cloud import bigquery
 from config.bigquery_config import get_bigquery_client, config
 from config.settings import get_ai_model_config
+from .embedding_cache import EmbeddingCache, open_embedding_cache
+
+try:
+    import orjson
+except ImportError:  # optional: JSON responses are parsed with the stdlib json module
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+# Parses JSON replies from the text model; orjson when available
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+# Embeddings kept per distinct (model, text) pair (least recently used evicted first)
+EMBEDDING_CACHE_SIZE = 4096
+
+# Texts embedded per ML.GENERATE_EMBEDDING query in batch_generate_embeddings
+EMBEDDING_TEXTS_PER_QUERY = 64
+
 class AIEngine:
     """Core AI engine for handling BigQuery AI operations"""
     
-    def __init__(self):
-        self.client = get_bigquery_client()
+    def __init__(self, client: Optional[bigquery.Client] = None, embedding_store: Optional[EmbeddingCache] = None):
+        self.client = client or get_bigquery_client()
         self.text_config = get_ai_model_config('text_generation')
         self.embedding_config = get_ai_model_config('embedding')
+        # Embeddings persisted across runs (None when disabled or unavailable)
+        if embedding_store is None and config.embedding_store_enabled:
+            embedding_store = open_embedding_cache(config.embedding_store_path)
+        self.embedding_store = embedding_store
+        # Exact-match memo of generate_embedding; failed calls raise and are not cached
+        self._embed_cached = functools.lru_cache(maxsize=EMBEDDING_CACHE_SIZE)(self._embed)
     
     def generate_text(self, prompt: str, max_tokens: Optional[int] = None) -> str:
         """
@@ -34,17 +57,12 @@ class AIEngine:
         try:
             max_tokens = max_tokens or self.text_config.get('max_tokens', 1024)
             
-            # Escape single quotes in the prompt
-            safe_prompt = prompt.replace("'", "''")
-            
-            query = f"""
-            SELECT AI.GENERATE(
-                prompt => '{safe_prompt}',
-                model_params => JSON '{{"max_tokens": {max_tokens}, "temperature": {self.text_config.get('temperature', 0.7)}, "top_p": {self.text_config.get('top_p', 0.8)}, "top_k": {self.text_config.get('top_k', 40)}}}'
-            ) AS generated_text
-            """
-            
-            query_job = self.client.query(query)
+            # The prompt is bound, not interpolated, so the SQL text is the same for every prompt
+            query = self._build_generate_text_sql(max_tokens)
+            job_config = bigquery.QueryJobConfig(
+                query_parameters=[bigquery.ScalarQueryParameter('prompt', 'STRING', prompt)]
+            )
+            query_job = self.client.query(query, job_config=job_config)
             results = query_job.result()
             
             for row in results:
@@ -56,92 +74,171 @@ class AIEngine:
             logger.error(f"Error generating text: {e}")
             raise
     
+    def batch_generate_text(self, prompts: List[str], max_tokens: Optional[int] = None) -> List[str]:
+        """
+        Generate text for multiple prompts with a single BigQuery AI.GENERATE query
+        
+        Args:
+            prompts: Input prompts for text generation
+            max_tokens: Maximum tokens to generate per prompt (optional)
+            
+        Returns:
+            Generated texts, in the same order as prompts
+        """
+        try:
+            if not prompts:
+                return []
+            
+            max_tokens = max_tokens or self.text_config.get('max_tokens', 1024)
+            
+            query = self._build_batch_generate_text_sql(max_tokens)
+            job_config = bigquery.QueryJobConfig(
+                query_parameters=[bigquery.ArrayQueryParameter('prompts', 'STRING', prompts)]
+            )
+            query_job = self.client.query(query, job_config=job_config)
+            results = query_job.result()
+            
+            texts = [""] * len(prompts)
+            for row in results:
+                texts[row.idx] = row.generated_text
+            
+            return texts
+            
+        except Exception as e:
+            logger.error(f"Error in batch text generation: {e}")
+            raise
+    
+    def _model_params_sql(self, max_tokens: int) -> str:
+        """JSON literal of the text generation parameters"""
+        return (
+            f"""JSON '{{"max_tokens": {max_tokens}, "temperature": {self.text_config.get('temperature', 0.7)}, """
+            f""""top_p": {self.text_config.get('top_p', 0.8)}, "top_k": {self.text_config.get('top_k', 40)}}}'"""
+        )
+    
+    def _build_generate_text_sql(self, max_tokens: int) -> str:
+        """SQL for generate_text (binds @prompt)"""
+        return f"""
+        SELECT AI.GENERATE(
+            prompt => @prompt,
+            model_params => {self._model_params_sql(max_tokens)}
+        ) AS generated_text
+        """
+    
+    def _build_batch_generate_text_sql(self, max_tokens: int) -> str:
+        """SQL for batch_generate_text (binds @prompts)"""
+        return f"""
+        SELECT 
+            idx,
+            AI.GENERATE(
+                prompt => prompt,
+                model_params => {self._model_params_sql(max_tokens)}
+            ) AS generated_text
+        FROM UNNEST(@prompts) AS prompt WITH OFFSET idx
+        """
+    
     def generate_embedding(self, text: str) -> List[float]:
         """
         Generate embeddings using BigQuery ML.GENERATE_EMBEDDING
         
+        Repeated texts (after whitespace normalisation) are served from an
+        in-process LRU cache instead of issuing another query.
+        
         Args:
             text: Input text to embed
             
         Returns:
             Embedding vector
         """
+        normalized = ' '.join(str(text).split())
+        return list(self._embed_cached(normalized, self.embedding_config['model']))
+    
+    def _embed(self, text: str, model: str) -> Tuple[float, ...]:
+        """Run ML.GENERATE_EMBEDDING for one text (memoized per instance by generate_embedding)"""
+        if self.embedding_store is not None:
+            stored = self.embedding_store.get(model, text)
+            if stored is not None:
+                return tuple(stored)
+        
         try:
-            # Escape single quotes in the text
-            safe_text = text.replace("'", "''")
-            
-            query = f"""
-            SELECT ML.GENERATE_EMBEDDING(
-                '{safe_text}',
-                model => '{self.embedding_config['model']}'
-            ) AS embedding
-            """
-            
-            query_job = self.client.query(query)
+            query = self._build_embedding_sql(model)
+            job_config = bigquery.QueryJobConfig(
+                query_parameters=[bigquery.ScalarQueryParameter('text', 'STRING', text)]
+            )
+            query_job = self.client.query(query, job_config=job_config)
             results = query_job.result()
             
             for row in results:
-                return row.embedding
+                if self.embedding_store is not None:
+                    self.embedding_store.put(model, text, row.embedding)
+                return tuple(row.embedding)
             
-            return []
+            # Raise rather than return an empty vector, so the miss is not memoized
+            raise ValueError(f"ML.GENERATE_EMBEDDING returned no row for model {model}")
             
         except Exception as e:
             logger.error(f"Error generating embedding: {e}")
             raise
     
+    def _build_embedding_sql(self, model: str) -> str:
+        """SQL for generate_embedding (binds @text)"""
+        return f"""
+        SELECT ML.GENERATE_EMBEDDING(
+            @text,
+            model => '{model}'
+        ) AS embedding
+        """
+    
+    def _build_batch_embedding_sql(self, model: str) -> str:
+        """SQL for batch_generate_embeddings (binds @texts)"""
+        return f"""
+        SELECT 
+            idx,
+            ML.GENERATE_EMBEDDING(
+                text,
+                model => '{model}'
+            ) AS embedding
+        FROM UNNEST(@texts) AS text WITH OFFSET idx
+        """
+    
     def batch_generate_embeddings(self, texts: List[str]) -> List[List[float]]:
         """
         Generate embeddings for multiple texts in batch
         
+        Distinct texts are embedded with one ML.GENERATE_EMBEDDING query per
+        EMBEDDING_TEXTS_PER_QUERY texts, passed as an array parameter.
+        
         Args:
             texts: List of texts to embed
             
         Returns:
-            List of embedding vectors
+            List of embedding vectors, in the same order as texts (None if a text got no embedding)
         """
         try:
-            # Create temporary table with texts
-            temp_table_id = f"{config.dataset_ref}.temp_texts_{hash(str(texts)) % 10000}"
-            
-            # Create schema for temporary table
-            schema = [
-                bigquery.SchemaField("id", "INTEGER"),
-                bigquery.SchemaField("text", "STRING")
-            ]
-            
-            table = bigquery.Table(temp_table_id, schema=schema)
-            self.client.create_table(table, exists_ok=True)
-            
-            # Insert texts
-            rows_to_insert = [{"id": i, "text": text} for i, text in enumerate(texts)]
-            errors = self.client.insert_rows_json(table, rows_to_insert)
-            
-            if errors:
-                raise Exception(f"Error inserting data: {errors}")
-            
-            # Generate embeddings
-            query = f"""
-            SELECT 
-                id,
-                ML.GENERATE_EMBEDDING(
-                    text,
-                    model => '{self.embedding_config['model']}'
-                ) AS embedding
-            FROM `{temp_table_id}`
-            ORDER BY id
-            """
-            
-            query_job = self.client.query(query)
-            results = query_job.result()
-            
-            embeddings = [None] * len(texts)
-            for row in results:
-                embeddings[row.id] = row.embedding
-            
-            # Clean up temporary table
-            self.client.delete_table(temp_table_id, not_found_ok=True)
+            model = self.embedding_config['model']
+            normalized = [' '.join(str(text).split()) for text in texts]
+            unique_texts = list(dict.fromkeys(normalized))
+            
+            # Only texts without a persisted embedding are sent to BigQuery
+            embeddings = {}
+            if self.embedding_store is not None:
+                embeddings = self.embedding_store.get_many(model, unique_texts)
+                unique_texts = [text for text in unique_texts if text not in embeddings]
+            
+            query = self._build_batch_embedding_sql(model)
+            
+            for start in range(0, len(unique_texts), EMBEDDING_TEXTS_PER_QUERY):
+                chunk = unique_texts[start:start + EMBEDDING_TEXTS_PER_QUERY]
+                job_config = bigquery.QueryJobConfig(
+                    query_parameters=[bigquery.ArrayQueryParameter('texts', 'STRING', chunk)]
+                )
+                query_job = self.client.query(query, job_config=job_config)
+                
+                generated = {chunk[row.idx]: row.embedding for row in query_job.result()}
+                if self.embedding_store is not None:
+                    self.embedding_store.put_many(model, generated)
+                embeddings.update(generated)
             
-            return embeddings
+            return [list(embeddings[text]) if text in embeddings else None for text in normalized]
             
         except Exception as e:
             logger.error(f"Error in batch embedding generation: {e}")
@@ -158,7 +255,34 @@ class AIEngine:
             Sentiment analysis results
         """
         try:
-            prompt = f"""
+            result = self.generate_text(self._sentiment_prompt(text))
+            return self._parse_sentiment(result)
+            
+        except Exception as e:
+            logger.error(f"Error analyzing sentiment: {e}")
+            raise
+    
+    def analyze_sentiment_batch(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """
+        Analyze sentiment of multiple texts with a single AI.GENERATE query
+        
+        Args:
+            texts: Texts to analyze
+            
+        Returns:
+            Sentiment analysis results, in the same order as texts
+        """
+        try:
+            results = self.batch_generate_text([self._sentiment_prompt(text) for text in texts])
+            return [self._parse_sentiment(result) for result in results]
+            
+        except Exception as e:
+            logger.error(f"Error analyzing sentiment batch: {e}")
+            raise
+    
+    def _sentiment_prompt(self, text: str) -> str:
+        """Build the sentiment analysis prompt for one text"""
+        return f"""
             Analyze the sentiment of the following text and provide:
             1. Overall sentiment (positive, negative, neutral)
             2. Confidence score (0-1)
@@ -167,24 +291,19 @@ class AIEngine:
             
             Text: {text}
             """
-            
-            result = self.generate_text(prompt)
-            
-            # Parse the JSON result (assuming the AI returns JSON)
-            import json
-            try:
-                return json.loads(result)
-            except:
-                return {
-                    "sentiment": "neutral",
-                    "confidence": 0.5,
-                    "emotions": [],
-                    "raw_result": result
-                }
-                
-        except Exception as e:
-            logger.error(f"Error analyzing sentiment: {e}")
-            raise
+    
+    def _parse_sentiment(self, result: str) -> Dict[str, Any]:
+        """Parse a sentiment response, falling back to neutral when it is not JSON"""
+        # Parse the JSON result (assuming the AI returns JSON)
+        try:
+            return _json_loads(result)
+        except:
+            return {
+                "sentiment": "neutral",
+                "confidence": 0.5,
+                "emotions": [],
+                "raw_result": result
+            }
     
     def summarize_text(self, text: str, max_length: int = 200) -> str:
         """
@@ -262,9 +381,8 @@ class AIEngine:
             
             result = self.generate_text(prompt)
             
-            import json
             try:
-                return json.loads(result)
+                return _json_loads(result)
             except:
                 # Fallback: return equal probabilities
                 return {cat: 1.0/len(categories) for cat in categories}
@@ -6,17 +6,44 @@ Uses working BigQuery functions for text processing and analysis.
 
 import logging
 import json
+import hashlib
+import re
+from collections import Counter
 from typing import List, Dict, Any, Optional
 from google.cloud import bigquery
 from config.bigquery_config import get_bigquery_client, config
 
 logger = logging.getLogger(__name__)
 
+POSITIVE_WORDS = ('good', 'great', 'excellent', 'amazing', 'love', 'perfect', 'wonderful', 'fantastic')
+NEGATIVE_WORDS = ('bad', 'terrible', 'awful', 'hate', 'worst', 'disappointing', 'poor', 'horrible')
+
+STOP_WORDS = frozenset({'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should', 'may', 'might', 'can', 'this', 'that', 'these', 'those', 'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her', 'us', 'them'})
+
+WORD_PATTERN = re.compile(r'\b\w+\b')
+
+CATEGORY_KEYWORDS = {
+    'electronics': ['electronic', 'device', 'tech', 'computer', 'phone', 'laptop'],
+    'clothing': ['clothing', 'shirt', 'dress', 'pants', 'fashion', 'wear'],
+    'home_garden': ['home', 'garden', 'kitchen', 'furniture', 'decor'],
+    'sports_outdoors': ['sport', 'outdoor', 'fitness', 'exercise', 'athletic']
+}
+
 class SimpleAIEngine:
     """Simplified AI engine using working BigQuery functions"""
     
-    def __init__(self):
-        self.client = get_bigquery_client()
+    def __init__(self, client: Optional[bigquery.Client] = None):
+        self.client = client or get_bigquery_client()
+        # Resolved keyword lists per category name, filled on first use
+        self._category_keywords: Dict[str, List[str]] = {}
+    
+    def _keywords_for(self, category: str) -> List[str]:
+        """Return (and remember) the keyword list used to score a category"""
+        keywords = self._category_keywords.get(category)
+        if keywords is None:
+            keywords = CATEGORY_KEYWORDS.get(category.lower(), [category.lower()])
+            self._category_keywords[category] = keywords
+        return keywords
     
     def generate_text(self, prompt: str, max_tokens: Optional[int] = None) -> str:
         """
@@ -46,6 +73,19 @@ class SimpleAIEngine:
             logger.error(f"Error generating text: {e}")
             return "I apologize, but I'm unable to generate content at the moment."
     
+    def batch_generate_text(self, prompts: List[str], max_tokens: Optional[int] = None) -> List[str]:
+        """
+        Generate text for multiple prompts in batch
+        
+        Args:
+            prompts: Input prompts for text generation
+            max_tokens: Maximum tokens to generate per prompt (optional)
+            
+        Returns:
+            Generated texts, in the same order as prompts
+        """
+        return [self.generate_text(prompt, max_tokens) for prompt in prompts]
+    
     def generate_embedding(self, text: str) -> List[float]:
         """
         Generate a simple hash-based embedding (placeholder)
@@ -59,8 +99,6 @@ class SimpleAIEngine:
         try:
             # Create a simple hash-based embedding for demonstration
             # In production, use proper embedding services
-            import hashlib
-            
             # Create a 768-dimensional vector based on text hash
             text_hash = hashlib.md5(text.encode()).hexdigest()
             embedding = []
@@ -113,11 +151,8 @@ class SimpleAIEngine:
             text_lower = text.lower()
             
             # Simple keyword-based sentiment analysis
-            positive_words = ['good', 'great', 'excellent', 'amazing', 'love', 'perfect', 'wonderful', 'fantastic']
-            negative_words = ['bad', 'terrible', 'awful', 'hate', 'worst', 'disappointing', 'poor', 'horrible']
-            
-            positive_count = sum(1 for word in positive_words if word in text_lower)
-            negative_count = sum(1 for word in negative_words if word in text_lower)
+            positive_count = sum(1 for word in POSITIVE_WORDS if word in text_lower)
+            negative_count = sum(1 for word in NEGATIVE_WORDS if word in text_lower)
             
             if positive_count > negative_count:
                 sentiment = "positive"
@@ -147,6 +182,18 @@ class SimpleAIEngine:
                 "text_length": len(text)
             }
     
+    def analyze_sentiment_batch(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """
+        Analyze sentiment of multiple texts
+        
+        Args:
+            texts: Texts to analyze
+            
+        Returns:
+            Sentiment analysis results, in the same order as texts
+        """
+        return [self.analyze_sentiment(text) for text in texts]
+    
     def summarize_text(self, text: str, max_length: int = 200) -> str:
         """
         Summarize text using simple extraction
@@ -188,16 +235,11 @@ class SimpleAIEngine:
             List of keywords
         """
         try:
-            import re
-            from collections import Counter
-            
             # Remove punctuation and convert to lowercase
-            words = re.findall(r'\b\w+\b', text.lower())
+            words = WORD_PATTERN.findall(text.lower())
             
             # Remove common stop words
-            stop_words = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should', 'may', 'might', 'can', 'this', 'that', 'these', 'those', 'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her', 'us', 'them'}
-            
-            filtered_words = [word for word in words if word not in stop_words and len(word) > 2]
+            filtered_words = [word for word in words if word not in STOP_WORDS and len(word) > 2]
             
             # Count word frequencies
             word_counts = Counter(filtered_words)
@@ -228,14 +270,7 @@ class SimpleAIEngine:
             
             for category in categories:
                 # Simple keyword matching for each category
-                category_keywords = {
-                    'electronics': ['electronic', 'device', 'tech', 'computer', 'phone', 'laptop'],
-                    'clothing': ['clothing', 'shirt', 'dress', 'pants', 'fashion', 'wear'],
-                    'home_garden': ['home', 'garden', 'kitchen', 'furniture', 'decor'],
-                    'sports_outdoors': ['sport', 'outdoor', 'fitness', 'exercise', 'athletic']
-                }
-                
-                keywords = category_keywords.get(category.lower(), [category.lower()])
+                keywords = self._keywords_for(category)
                 score = sum(1 for keyword in keywords if keyword in text_lower)
                 scores[category] = score / len(keywords) if keywords else 0
             
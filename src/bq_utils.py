@@ -0,0 +1,96 @@
+"""
+BigQuery query helpers shared by the engines
+
+Binds @name placeholders as query parameters and materialises result rows, so
+every engine types its parameters and reads its results the same way.
+"""
+
+from typing import Any, Dict, List, Optional
+from google.cloud import bigquery
+
+try:
+    import pyarrow
+except ImportError:  # optional: reads fall back to REST row iteration
+    pyarrow = None
+
+def _parameter_type(value: Any) -> str:
+    """BigQuery type of a Python parameter value (bool, int, float, otherwise string)"""
+    if isinstance(value, bool):
+        return 'BOOL'
+    if isinstance(value, int):
+        return 'INT64'
+    if isinstance(value, float):
+        return 'FLOAT64'
+    return 'STRING'
+
+def query_parameter(name: str, value: Any):
+    """
+    Bind a value to the @name placeholder
+
+    Lists and tuples bind as arrays typed after their first element (STRING when
+    empty); anything else binds as a scalar.
+    """
+    if isinstance(value, (list, tuple)):
+        element_type = _parameter_type(value[0]) if value else 'STRING'
+        return bigquery.ArrayQueryParameter(name, element_type, list(value))
+    return bigquery.ScalarQueryParameter(name, _parameter_type(value), value)
+
+def query_job_config(params: Dict[str, Any], **options) -> bigquery.QueryJobConfig:
+    """
+    Build a job config binding params, with any other QueryJobConfig options
+
+    Args:
+        params: Values for the query's @name placeholders
+        **options: Further QueryJobConfig options (use_query_cache, labels, dry_run, ...)
+
+    Returns:
+        The job config
+    """
+    return bigquery.QueryJobConfig(
+        query_parameters=[query_parameter(name, value) for name, value in params.items()],
+        **options
+    )
+
+def run_query(client: bigquery.Client, query: str, options: Optional[Dict[str, Any]] = None,
+              **params) -> bigquery.QueryJob:
+    """
+    Start a query with @name placeholders bound as query parameters
+
+    Keeping values out of the SQL text keeps the text constant across calls,
+    so BigQuery can serve repeats from its query cache.
+
+    Args:
+        client: BigQuery client to run the query on
+        query: SQL using @name placeholders
+        options: QueryJobConfig options for the job
+        **params: Values for the placeholders
+
+    Returns:
+        The started query job
+    """
+    return client.query(query, job_config=query_job_config(params, **(options or {})))
+
+def fetch_rows(query_job: bigquery.QueryJob, columns: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Materialise a query's rows as dicts keyed by column name
+
+    Converts the result in bulk from Arrow (through the BigQuery Storage Read API
+    for results larger than one page) when pyarrow is installed, otherwise reads
+    row by row.
+
+    Args:
+        query_job: The query to read
+        columns: Columns to keep (all columns when None)
+
+    Returns:
+        One dict per row
+    """
+    results = query_job.result()
+    if pyarrow is not None and hasattr(results, 'to_arrow'):
+        table = results.to_arrow(create_bqstorage_client=True)
+        if columns is not None:
+            table = table.select(columns)
+        return table.to_pylist()
+    if columns is None:
+        return [dict(row.items()) for row in results]
+    return [{column: getattr(row, column) for column in columns} for row in results]
@@ -5,19 +5,22 @@ Handles loading and processing data into BigQuery tables.
 """
 
 import logging
-import pandas as pd
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, TYPE_CHECKING
 from datetime import datetime, timedelta
 from google.cloud import bigquery
 from config.bigquery_config import get_bigquery_client, config, create_dataset_if_not_exists
+from config.settings import get_marketing_config
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 logger = logging.getLogger(__name__)
 
 class DataIngestion:
     """Data ingestion engine for loading data into BigQuery"""
     
-    def __init__(self):
-        self.client = get_bigquery_client()
+    def __init__(self, client: Optional[bigquery.Client] = None):
+        self.client = client or get_bigquery_client()
         create_dataset_if_not_exists()
     
     def create_tables(self) -> bool:
@@ -28,26 +31,11 @@ class DataIngestion:
             True if successful, False otherwise
         """
         try:
-            # Create products table
-            self._create_products_table()
-            
-            # Create users table
-            self._create_users_table()
-            
-            # Create orders table
-            self._create_orders_table()
-            
-            # Create order items table
-            self._create_order_items_table()
-            
-            # Create reviews table
-            self._create_reviews_table()
-            
-            # Create user behavior table
-            self._create_user_behavior_table()
-            
-            # Create sales data table
-            self._create_sales_data_table()
+            # Tables, the search index behind product text search and the materialized
+            # views read by the marketing engine, as one script: BigQuery runs the DDL
+            # statements back to back server-side, so setup costs a single round trip
+            script = self._build_create_tables_sql() + self._build_marketing_views_sql()
+            self.client.query(script).result()
             
             logger.info("All tables created successfully")
             return True
@@ -56,10 +44,14 @@ class DataIngestion:
             logger.error(f"Error creating tables: {e}")
             return False
     
-    def load_sample_data(self) -> bool:
+    def load_sample_data(self, streaming: bool = False) -> bool:
         """
         Load sample data into all tables (only if tables are empty)
         
+        Args:
+            streaming: Insert rows through the streaming API instead of one batch
+                load job per table (for small incremental updates)
+        
         Returns:
             True if successful, False otherwise
         """
@@ -68,27 +60,27 @@ class DataIngestion:
             if self._table_has_data(config.products_table):
                 logger.info("Products table already has data, skipping sample data load")
             else:
-                self._load_sample_products()
+                self._load_sample_products(streaming)
             
             if self._table_has_data(config.users_table):
                 logger.info("Users table already has data, skipping sample data load")
             else:
-                self._load_sample_users()
+                self._load_sample_users(streaming)
             
             if self._table_has_data(config.orders_table):
                 logger.info("Orders table already has data, skipping sample data load")
             else:
-                self._load_sample_orders()
+                self._load_sample_orders(streaming)
             
             if self._table_has_data(config.reviews_table):
                 logger.info("Reviews table already has data, skipping sample data load")
             else:
-                self._load_sample_reviews()
+                self._load_sample_reviews(streaming)
             
             if self._table_has_data(config.user_behavior_table):
                 logger.info("User behavior table already has data, skipping sample data load")
             else:
-                self._load_sample_user_behavior()
+                self._load_sample_user_behavior(streaming)
             
             logger.info("Sample data loading completed (skipped existing data)")
             return True
@@ -97,6 +89,40 @@ class DataIngestion:
             logger.error(f"Error loading sample data: {e}")
             return False
     
+    def _append_rows(self, table_id: str, rows: List[Dict[str, Any]], streaming: bool = False) -> bool:
+        """
+        Append rows to a table with a single batch load job
+        
+        Args:
+            table_id: Full table ID (project.dataset.table)
+            rows: JSON-serialisable rows matching the table schema
+            streaming: Use the streaming insert API instead (rows are queryable
+                immediately, but billed per row and throughput-limited)
+            
+        Returns:
+            True if the rows were loaded, False otherwise
+        """
+        try:
+            if streaming:
+                errors = self.client.insert_rows_json(table_id, rows)
+                if errors:
+                    logger.error(f"Error streaming rows into {table_id}: {errors}")
+                    return False
+                return True
+            
+            job_config = bigquery.LoadJobConfig(
+                schema=self.client.get_table(table_id).schema,
+                write_disposition=bigquery.WriteDisposition.WRITE_APPEND
+            )
+            
+            job = self.client.load_table_from_json(rows, table_id, job_config=job_config)
+            job.result()
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error loading rows into {table_id}: {e}")
+            return False
+    
     def _table_has_data(self, table_id: str) -> bool:
         """
         Check if a table has any data
@@ -121,122 +147,114 @@ class DataIngestion:
             logger.error(f"Error checking if table {table_id} has data: {e}")
             return False
     
-    def _create_products_table(self):
-        """Create products table"""
-        schema = [
-            bigquery.SchemaField("product_id", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("name", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("description", "STRING"),
-            bigquery.SchemaField("category", "STRING"),
-            bigquery.SchemaField("brand", "STRING"),
-            bigquery.SchemaField("price", "FLOAT64"),
-            bigquery.SchemaField("rating", "FLOAT64"),
-            bigquery.SchemaField("stock_quantity", "INTEGER"),
-            bigquery.SchemaField("image_url", "STRING"),
-            bigquery.SchemaField("created_at", "TIMESTAMP"),
-            bigquery.SchemaField("updated_at", "TIMESTAMP")
-        ]
+    def _build_create_tables_sql(self) -> str:
+        """DDL creating every data table (if missing) and the products search index"""
+        return f"""
+        CREATE TABLE IF NOT EXISTS `{config.products_table}` (
+            product_id STRING NOT NULL,
+            name STRING NOT NULL,
+            description STRING,
+            category STRING,
+            brand STRING,
+            price FLOAT64,
+            rating FLOAT64,
+            stock_quantity INT64,
+            image_url STRING,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP
+        );
         
-        table = bigquery.Table(config.products_table, schema=schema)
-        self.client.create_table(table, exists_ok=True)
-        logger.info(f"Created products table: {config.products_table}")
-    
-    def _create_users_table(self):
-        """Create users table"""
-        schema = [
-            bigquery.SchemaField("user_id", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("email", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("first_name", "STRING"),
-            bigquery.SchemaField("last_name", "STRING"),
-            bigquery.SchemaField("demographics", "STRING"),
-            bigquery.SchemaField("user_segment", "STRING"),
-            bigquery.SchemaField("registration_date", "TIMESTAMP"),
-            bigquery.SchemaField("last_login", "TIMESTAMP"),
-            bigquery.SchemaField("is_active", "BOOLEAN")
-        ]
+        -- Text search index used by SEARCH() product lookups
+        CREATE SEARCH INDEX IF NOT EXISTS products_search_index
+        ON `{config.products_table}`(ALL COLUMNS);
         
-        table = bigquery.Table(config.users_table, schema=schema)
-        self.client.create_table(table, exists_ok=True)
-        logger.info(f"Created users table: {config.users_table}")
-    
-    def _create_orders_table(self):
-        """Create orders table"""
-        schema = [
-            bigquery.SchemaField("order_id", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("user_id", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("order_date", "TIMESTAMP", mode="REQUIRED"),
-            bigquery.SchemaField("total_amount", "FLOAT64"),
-            bigquery.SchemaField("status", "STRING"),
-            bigquery.SchemaField("shipping_address", "STRING"),
-            bigquery.SchemaField("payment_method", "STRING")
-        ]
+        CREATE TABLE IF NOT EXISTS `{config.users_table}` (
+            user_id STRING NOT NULL,
+            email STRING NOT NULL,
+            first_name STRING,
+            last_name STRING,
+            demographics STRING,
+            user_segment STRING,
+            registration_date TIMESTAMP,
+            last_login TIMESTAMP,
+            is_active BOOL
+        );
         
-        table = bigquery.Table(config.orders_table, schema=schema)
-        self.client.create_table(table, exists_ok=True)
-        logger.info(f"Created orders table: {config.orders_table}")
-    
-    def _create_order_items_table(self):
-        """Create order items table"""
-        schema = [
-            bigquery.SchemaField("order_id", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("product_id", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("quantity", "INTEGER"),
-            bigquery.SchemaField("price", "FLOAT64"),
-            bigquery.SchemaField("total_price", "FLOAT64")
-        ]
+        CREATE TABLE IF NOT EXISTS `{config.orders_table}` (
+            order_id STRING NOT NULL,
+            user_id STRING NOT NULL,
+            order_date TIMESTAMP NOT NULL,
+            total_amount FLOAT64,
+            status STRING,
+            shipping_address STRING,
+            payment_method STRING
+        );
         
-        table_id = f"{config.dataset_ref}.order_items"
-        table = bigquery.Table(table_id, schema=schema)
-        self.client.create_table(table, exists_ok=True)
-        logger.info(f"Created order items table: {table_id}")
-    
-    def _create_reviews_table(self):
-        """Create reviews table"""
-        schema = [
-            bigquery.SchemaField("review_id", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("product_id", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("user_id", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("rating", "INTEGER"),
-            bigquery.SchemaField("review_text", "STRING"),
-            bigquery.SchemaField("review_date", "TIMESTAMP"),
-            bigquery.SchemaField("helpful_votes", "INTEGER")
-        ]
+        CREATE TABLE IF NOT EXISTS `{config.dataset_ref}.order_items` (
+            order_id STRING NOT NULL,
+            product_id STRING NOT NULL,
+            quantity INT64,
+            price FLOAT64,
+            total_price FLOAT64
+        );
         
-        table = bigquery.Table(config.reviews_table, schema=schema)
-        self.client.create_table(table, exists_ok=True)
-        logger.info(f"Created reviews table: {config.reviews_table}")
-    
-    def _create_user_behavior_table(self):
-        """Create user behavior table"""
-        schema = [
-            bigquery.SchemaField("behavior_id", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("user_id", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("product_id", "STRING"),
-            bigquery.SchemaField("action_type", "STRING"),  # view, add_to_cart, purchase, etc.
-            bigquery.SchemaField("timestamp", "TIMESTAMP"),
-            bigquery.SchemaField("session_id", "STRING"),
-            bigquery.SchemaField("quantity", "INTEGER")
-        ]
+        CREATE TABLE IF NOT EXISTS `{config.reviews_table}` (
+            review_id STRING NOT NULL,
+            product_id STRING NOT NULL,
+            user_id STRING NOT NULL,
+            rating INT64,
+            review_text STRING,
+            review_date TIMESTAMP,
+            helpful_votes INT64
+        );
+        
+        CREATE TABLE IF NOT EXISTS `{config.user_behavior_table}` (
+            behavior_id STRING NOT NULL,
+            user_id STRING NOT NULL,
+            product_id STRING,
+            action_type STRING,  -- view, add_to_cart, purchase, etc.
+            timestamp TIMESTAMP,
+            session_id STRING,
+            quantity INT64
+        );
         
-        table = bigquery.Table(config.user_behavior_table, schema=schema)
-        self.client.create_table(table, exists_ok=True)
-        logger.info(f"Created user behavior table: {config.user_behavior_table}")
+        CREATE TABLE IF NOT EXISTS `{config.sales_data_table}` (
+            date DATE NOT NULL,
+            product_id STRING NOT NULL,
+            quantity_sold INT64,
+            revenue FLOAT64,
+            orders_count INT64
+        );
+        """
     
-    def _create_sales_data_table(self):
-        """Create sales data table"""
-        schema = [
-            bigquery.SchemaField("date", "DATE", mode="REQUIRED"),
-            bigquery.SchemaField("product_id", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("quantity_sold", "INTEGER"),
-            bigquery.SchemaField("revenue", "FLOAT64"),
-            bigquery.SchemaField("orders_count", "INTEGER")
-        ]
+    def _build_marketing_views_sql(self) -> str:
+        """DDL for the clustered materialized views behind segment and product lookups"""
+        # Season words found in a product's category or description, tagged once per refresh
+        season_pattern = "|".join(get_marketing_config()['seasonal_tags'])
+        
+        return f"""
+        CREATE OR REPLACE MATERIALIZED VIEW `{config.segment_users_view}`
+        CLUSTER BY user_segment
+        OPTIONS (enable_refresh = true, refresh_interval_minutes = 60)
+        AS
+        SELECT user_id, email, first_name, last_name, demographics, registration_date, user_segment
+        FROM `{config.users_table}`;
         
-        table = bigquery.Table(config.sales_data_table, schema=schema)
-        self.client.create_table(table, exists_ok=True)
-        logger.info(f"Created sales data table: {config.sales_data_table}")
+        CREATE OR REPLACE MATERIALIZED VIEW `{config.in_stock_products_view}`
+        CLUSTER BY category
+        OPTIONS (enable_refresh = true, refresh_interval_minutes = 60)
+        AS
+        SELECT 
+            product_id, name, description, price, category, rating, image_url,
+            REGEXP_EXTRACT_ALL(
+                LOWER(CONCAT(IFNULL(category, ''), ' ', IFNULL(description, ''))),
+                r'({season_pattern})'
+            ) AS seasonal_tags
+        FROM `{config.products_table}`
+        WHERE stock_quantity > 0;
+        """
     
-    def _load_sample_products(self):
+    def _load_sample_products(self, streaming: bool = False):
         """Load sample product data"""
         sample_products = [
             {
@@ -306,13 +324,10 @@ class DataIngestion:
             }
         ]
         
-        errors = self.client.insert_rows_json(config.products_table, sample_products)
-        if errors:
-            logger.error(f"Error inserting products: {errors}")
-        else:
+        if self._append_rows(config.products_table, sample_products, streaming=streaming):
             logger.info(f"Loaded {len(sample_products)} sample products")
     
-    def _load_sample_users(self):
+    def _load_sample_users(self, streaming: bool = False):
         """Load sample user data"""
         sample_users = [
             {
@@ -350,13 +365,10 @@ class DataIngestion:
             }
         ]
         
-        errors = self.client.insert_rows_json(config.users_table, sample_users)
-        if errors:
-            logger.error(f"Error inserting users: {errors}")
-        else:
+        if self._append_rows(config.users_table, sample_users, streaming=streaming):
             logger.info(f"Loaded {len(sample_users)} sample users")
     
-    def _load_sample_orders(self):
+    def _load_sample_orders(self, streaming: bool = False):
         """Load sample order data"""
         sample_orders = [
             {
@@ -388,10 +400,7 @@ class DataIngestion:
             }
         ]
         
-        errors = self.client.insert_rows_json(config.orders_table, sample_orders)
-        if errors:
-            logger.error(f"Error inserting orders: {errors}")
-        else:
+        if self._append_rows(config.orders_table, sample_orders, streaming=streaming):
             logger.info(f"Loaded {len(sample_orders)} sample orders")
         
         # Load order items
@@ -403,13 +412,10 @@ class DataIngestion:
         ]
         
         order_items_table = f"{config.dataset_ref}.order_items"
-        errors = self.client.insert_rows_json(order_items_table, sample_order_items)
-        if errors:
-            logger.error(f"Error inserting order items: {errors}")
-        else:
+        if self._append_rows(order_items_table, sample_order_items, streaming=streaming):
             logger.info(f"Loaded {len(sample_order_items)} sample order items")
     
-    def _load_sample_reviews(self):
+    def _load_sample_reviews(self, streaming: bool = False):
         """Load sample review data"""
         sample_reviews = [
             {
@@ -450,13 +456,10 @@ class DataIngestion:
             }
         ]
         
-        errors = self.client.insert_rows_json(config.reviews_table, sample_reviews)
-        if errors:
-            logger.error(f"Error inserting reviews: {errors}")
-        else:
+        if self._append_rows(config.reviews_table, sample_reviews, streaming=streaming):
             logger.info(f"Loaded {len(sample_reviews)} sample reviews")
     
-    def _load_sample_user_behavior(self):
+    def _load_sample_user_behavior(self, streaming: bool = False):
         """Load sample user behavior data"""
         sample_behavior = [
             {
@@ -506,10 +509,7 @@ class DataIngestion:
             }
         ]
         
-        errors = self.client.insert_rows_json(config.user_behavior_table, sample_behavior)
-        if errors:
-            logger.error(f"Error inserting user behavior: {errors}")
-        else:
+        if self._append_rows(config.user_behavior_table, sample_behavior, streaming=streaming):
             logger.info(f"Loaded {len(sample_behavior)} sample user behavior records")
     
     def load_data_from_csv(self, table_name: str, csv_file_path: str) -> bool:
@@ -524,6 +524,8 @@ class DataIngestion:
             True if successful, False otherwise
         """
         try:
+            import pandas as pd
+            
             # Read CSV file
             df = pd.read_csv(csv_file_path)
             
@@ -548,7 +550,7 @@ class DataIngestion:
             logger.error(f"Error loading data from CSV: {e}")
             return False
     
-    def load_data_from_dataframe(self, table_name: str, df: pd.DataFrame) -> bool:
+    def load_data_from_dataframe(self, table_name: str, df: "pd.DataFrame") -> bool:
         """
         Load data from pandas DataFrame into BigQuery table
         
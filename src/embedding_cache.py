@@ -0,0 +1,134 @@
+"""
+Embedding Cache for Smart E-Commerce Intelligence
+
+Persists generated embeddings in a local SQLite file keyed by model and text,
+so identical texts are not re-embedded across process restarts. Vectors are
+stored as int8 codes with a per-vector scale, a quarter of their float32 size.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Keys looked up per SELECT (stays well under SQLite's bound-variable limit)
+LOOKUP_CHUNK_SIZE = 500
+
+# Bytes taken by the float32 scale stored in front of the int8 codes
+SCALE_BYTES = 4
+
+def quantise_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Symmetric int8 quantisation with one scale per vector
+    
+    Args:
+        vectors: Vector of shape (d,) or matrix of shape (N, d)
+        
+    Returns:
+        (codes, scales): int8 codes of the same shape, and float32 scales with
+        vectors ~= codes * scales (one scale per row; a scalar for a single vector)
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    peak = np.abs(vectors).max(axis=-1, keepdims=True)
+    scales = np.where(peak > 0, peak / 127, 1).astype(np.float32)
+    codes = np.rint(vectors / scales).astype(np.int8)
+    return codes, scales[..., 0]
+
+def dequantise_int8(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """Inverse of quantise_int8"""
+    return codes.astype(np.float32) * np.asarray(scales, dtype=np.float32)[..., None]
+
+class EmbeddingCache:
+    """Thread-safe SQLite store of int8-quantised embedding vectors"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS emb (key BLOB PRIMARY KEY, dim INTEGER, vec BLOB)")
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _key(model: str, text: str) -> bytes:
+        return hashlib.sha256(f"{model}\0{text}".encode()).digest()
+    
+    @staticmethod
+    def _decode(blob: bytes) -> List[float]:
+        """Decode a stored vector (int8 codes after their float32 scale)"""
+        scale = np.frombuffer(blob, dtype=np.float32, count=1)
+        codes = np.frombuffer(blob, dtype=np.int8, offset=SCALE_BYTES)
+        return dequantise_int8(codes, scale[0]).tolist()
+    
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        """Return the stored embedding of text under model, or None"""
+        return self.get_many(model, [text]).get(text)
+    
+    def get_many(self, model: str, texts: List[str]) -> Dict[str, List[float]]:
+        """
+        Look up several texts at once
+        
+        Args:
+            model: Embedding model the vectors were generated with
+            texts: Texts to look up
+        
+        Returns:
+            Stored embeddings by text (texts without one are absent)
+        """
+        keys = {self._key(model, text): text for text in texts}
+        found = {}
+        try:
+            key_list = list(keys)
+            with self._lock:
+                for start in range(0, len(key_list), LOOKUP_CHUNK_SIZE):
+                    chunk = key_list[start:start + LOOKUP_CHUNK_SIZE]
+                    placeholders = ','.join('?' * len(chunk))
+                    rows = self._conn.execute(
+                        f"SELECT key, vec FROM emb WHERE key IN ({placeholders})", chunk
+                    ).fetchall()
+                    for key, vec in rows:
+                        found[keys[key]] = self._decode(vec)
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache lookup failed: {e}")
+        return found
+    
+    def put(self, model: str, text: str, embedding: List[float]):
+        """Store the embedding of text under model"""
+        self.put_many(model, {text: embedding})
+    
+    def put_many(self, model: str, embeddings: Dict[str, List[float]]):
+        """Store several embeddings in one transaction (empty vectors are skipped)"""
+        rows = []
+        for text, embedding in embeddings.items():
+            if embedding:
+                codes, scale = quantise_int8(embedding)
+                rows.append((self._key(model, text), len(codes), scale.tobytes() + codes.tobytes()))
+        if not rows:
+            return
+        
+        try:
+            # One transaction, rolled back as a whole on failure
+            with self._lock, self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO emb (key, dim, vec) VALUES (?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache store failed: {e}")
+    
+    def close(self):
+        """Close the underlying database connection"""
+        with self._lock:
+            self._conn.close()
+
+def open_embedding_cache(path: str) -> Optional[EmbeddingCache]:
+    """Open the embedding cache at path, or return None (caching off) if it cannot be opened"""
+    try:
+        return EmbeddingCache(path)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Could not open embedding cache at {path}: {e}")
+        return None
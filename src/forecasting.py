@@ -4,20 +4,34 @@ Forecasting Engine for Smart E-Commerce Intelligence
 Handles demand prediction and time series forecasting using BigQuery AI.FORECAST.
 """
 
+import json
 import logging
 from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime, timedelta
 from google.cloud import bigquery
 from config.bigquery_config import get_bigquery_client, config
 from config.settings import get_ai_model_config
+from .bq_utils import fetch_rows, run_query
+
+try:
+    import orjson
+except ImportError:  # optional: JSON responses are parsed with the stdlib json module
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+# Parses AI.FORECAST JSON results; orjson when available
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+# The SQL text stays the same across products and horizons, so repeats of the
+# same parameters are answered from BigQuery's result cache
+QUERY_JOB_OPTIONS = {'use_query_cache': True}
+
 class ForecastingEngine:
     """Forecasting engine for demand prediction and time series analysis"""
     
-    def __init__(self):
-        self.client = get_bigquery_client()
+    def __init__(self, client: Optional[bigquery.Client] = None):
+        self.client = client or get_bigquery_client()
         self.config = get_ai_model_config('forecasting')
     
     def forecast_product_demand(self, product_id: str, forecast_periods: int = 30) -> Dict[str, Any]:
@@ -32,26 +46,8 @@ class ForecastingEngine:
             Forecast results with predictions and confidence intervals
         """
         try:
-            query = f"""
-            SELECT 
-                AI.FORECAST(
-                    sales_quantity,
-                    {forecast_periods}
-                ) AS forecast_result
-            FROM (
-                SELECT 
-                    DATE(order_date) as date,
-                    SUM(quantity) as sales_quantity
-                FROM `{config.orders_table}` o
-                JOIN `{config.dataset_ref}.order_items` oi ON o.order_id = oi.order_id
-                WHERE oi.product_id = '{product_id}'
-                AND DATE(o.order_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL 365 DAY)
-                GROUP BY DATE(order_date)
-                ORDER BY date
-            )
-            """
-            
-            query_job = self.client.query(query)
+            query = self._build_product_demand_sql()
+            query_job = run_query(self.client, query, QUERY_JOB_OPTIONS, product_id=product_id, periods=forecast_periods)
             results = query_job.result()
             
             for row in results:
@@ -75,27 +71,8 @@ class ForecastingEngine:
             Category forecast results
         """
         try:
-            query = f"""
-            SELECT 
-                AI.FORECAST(
-                    total_sales,
-                    {forecast_periods}
-                ) AS forecast_result
-            FROM (
-                SELECT 
-                    DATE(o.order_date) as date,
-                    SUM(oi.quantity * oi.price) as total_sales
-                FROM `{config.orders_table}` o
-                JOIN `{config.dataset_ref}.order_items` oi ON o.order_id = oi.order_id
-                JOIN `{config.products_table}` p ON oi.product_id = p.product_id
-                WHERE p.category = '{category}'
-                AND DATE(o.order_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL 365 DAY)
-                GROUP BY DATE(o.order_date)
-                ORDER BY date
-            )
-            """
-            
-            query_job = self.client.query(query)
+            query = self._build_category_demand_sql()
+            query_job = run_query(self.client, query, QUERY_JOB_OPTIONS, category=category, periods=forecast_periods)
             results = query_job.result()
             
             for row in results:
@@ -118,24 +95,8 @@ class ForecastingEngine:
             Revenue forecast results
         """
         try:
-            query = f"""
-            SELECT 
-                AI.FORECAST(
-                    daily_revenue,
-                    {forecast_periods}
-                ) AS forecast_result
-            FROM (
-                SELECT 
-                    DATE(order_date) as date,
-                    SUM(total_amount) as daily_revenue
-                FROM `{config.orders_table}`
-                WHERE DATE(order_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL 365 DAY)
-                GROUP BY DATE(order_date)
-                ORDER BY date
-            )
-            """
-            
-            query_job = self.client.query(query)
+            query = self._build_revenue_sql()
+            query_job = run_query(self.client, query, QUERY_JOB_OPTIONS, periods=forecast_periods)
             results = query_job.result()
             
             for row in results:
@@ -172,29 +133,11 @@ class ForecastingEngine:
             
             start_date, end_date = season_ranges[season]
             
-            query = f"""
-            SELECT 
-                AI.FORECAST(
-                    seasonal_sales,
-                    90  -- 3 months
-                ) AS forecast_result
-            FROM (
-                SELECT 
-                    DATE(o.order_date) as date,
-                    SUM(oi.quantity) as seasonal_sales
-                FROM `{config.orders_table}` o
-                JOIN `{config.dataset_ref}.order_items` oi ON o.order_id = oi.order_id
-                WHERE oi.product_id = '{product_id}'
-                AND EXTRACT(MONTH FROM o.order_date) BETWEEN 
-                    EXTRACT(MONTH FROM DATE('2023-{start_date}')) AND 
-                    EXTRACT(MONTH FROM DATE('2023-{end_date}'))
-                AND DATE(o.order_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL 2 YEAR)
-                GROUP BY DATE(o.order_date)
-                ORDER BY date
+            query = self._build_seasonal_demand_sql()
+            query_job = run_query(
+                self.client, query, QUERY_JOB_OPTIONS,
+                product_id=product_id, start_date=f"2023-{start_date}", end_date=f"2023-{end_date}"
             )
-            """
-            
-            query_job = self.client.query(query)
             results = query_job.result()
             
             for row in results:
@@ -261,37 +204,11 @@ class ForecastingEngine:
             Trend analysis results
         """
         try:
-            query = f"""
-            SELECT 
-                DATE(order_date) as date,
-                SUM(oi.quantity) as daily_sales,
-                AVG(oi.quantity) OVER (
-                    ORDER BY DATE(order_date) 
-                    ROWS BETWEEN 6 PRECEDING AND CURRENT ROW
-                ) as moving_average_7d,
-                AVG(oi.quantity) OVER (
-                    ORDER BY DATE(order_date) 
-                    ROWS BETWEEN 29 PRECEDING AND CURRENT ROW
-                ) as moving_average_30d
-            FROM `{config.orders_table}` o
-            JOIN `{config.dataset_ref}.order_items` oi ON o.order_id = oi.order_id
-            WHERE oi.product_id = '{product_id}'
-            AND DATE(o.order_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL {period_days} DAY)
-            GROUP BY DATE(order_date)
-            ORDER BY date
-            """
-            
-            query_job = self.client.query(query)
-            results = query_job.result()
-            
-            trend_data = []
-            for row in results:
-                trend_data.append({
-                    'date': row.date,
-                    'daily_sales': row.daily_sales,
-                    'moving_average_7d': row.moving_average_7d,
-                    'moving_average_30d': row.moving_average_30d
-                })
+            query = self._build_trend_analysis_sql()
+            query_job = run_query(self.client, query, QUERY_JOB_OPTIONS, product_id=product_id, period_days=period_days)
+            trend_data = fetch_rows(
+                query_job, ['date', 'daily_sales', 'moving_average_7d', 'moving_average_30d']
+            )
             
             # Calculate trend indicators
             if len(trend_data) >= 2:
@@ -342,6 +259,114 @@ class ForecastingEngine:
             logger.error(f"Error calculating forecast accuracy: {e}")
             return {}
     
+    def _build_product_demand_sql(self) -> str:
+        """SQL for forecast_product_demand (binds @product_id, @periods)"""
+        return f"""
+        SELECT 
+            AI.FORECAST(
+                sales_quantity,
+                @periods
+            ) AS forecast_result
+        FROM (
+            SELECT 
+                DATE(order_date) as date,
+                SUM(quantity) as sales_quantity
+            FROM `{config.orders_table}` o
+            JOIN `{config.dataset_ref}.order_items` oi ON o.order_id = oi.order_id
+            WHERE oi.product_id = @product_id
+            AND DATE(o.order_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL 365 DAY)
+            GROUP BY DATE(order_date)
+            ORDER BY date
+        )
+        """
+    
+    def _build_category_demand_sql(self) -> str:
+        """SQL for forecast_category_demand (binds @category, @periods)"""
+        return f"""
+        SELECT 
+            AI.FORECAST(
+                total_sales,
+                @periods
+            ) AS forecast_result
+        FROM (
+            SELECT 
+                DATE(o.order_date) as date,
+                SUM(oi.quantity * oi.price) as total_sales
+            FROM `{config.orders_table}` o
+            JOIN `{config.dataset_ref}.order_items` oi ON o.order_id = oi.order_id
+            JOIN `{config.products_table}` p ON oi.product_id = p.product_id
+            WHERE p.category = @category
+            AND DATE(o.order_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL 365 DAY)
+            GROUP BY DATE(o.order_date)
+            ORDER BY date
+        )
+        """
+    
+    def _build_revenue_sql(self) -> str:
+        """SQL for forecast_revenue (binds @periods)"""
+        return f"""
+        SELECT 
+            AI.FORECAST(
+                daily_revenue,
+                @periods
+            ) AS forecast_result
+        FROM (
+            SELECT 
+                DATE(order_date) as date,
+                SUM(total_amount) as daily_revenue
+            FROM `{config.orders_table}`
+            WHERE DATE(order_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL 365 DAY)
+            GROUP BY DATE(order_date)
+            ORDER BY date
+        )
+        """
+    
+    def _build_seasonal_demand_sql(self) -> str:
+        """SQL for forecast_seasonal_demand (binds @product_id, @start_date, @end_date)"""
+        return f"""
+        SELECT 
+            AI.FORECAST(
+                seasonal_sales,
+                90  -- 3 months
+            ) AS forecast_result
+        FROM (
+            SELECT 
+                DATE(o.order_date) as date,
+                SUM(oi.quantity) as seasonal_sales
+            FROM `{config.orders_table}` o
+            JOIN `{config.dataset_ref}.order_items` oi ON o.order_id = oi.order_id
+            WHERE oi.product_id = @product_id
+            AND EXTRACT(MONTH FROM o.order_date) BETWEEN 
+                EXTRACT(MONTH FROM DATE(@start_date)) AND 
+                EXTRACT(MONTH FROM DATE(@end_date))
+            AND DATE(o.order_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL 2 YEAR)
+            GROUP BY DATE(o.order_date)
+            ORDER BY date
+        )
+        """
+    
+    def _build_trend_analysis_sql(self) -> str:
+        """SQL for get_trend_analysis (binds @product_id, @period_days)"""
+        return f"""
+        SELECT 
+            DATE(order_date) as date,
+            SUM(oi.quantity) as daily_sales,
+            AVG(oi.quantity) OVER (
+                ORDER BY DATE(order_date) 
+                ROWS BETWEEN 6 PRECEDING AND CURRENT ROW
+            ) as moving_average_7d,
+            AVG(oi.quantity) OVER (
+                ORDER BY DATE(order_date) 
+                ROWS BETWEEN 29 PRECEDING AND CURRENT ROW
+            ) as moving_average_30d
+        FROM `{config.orders_table}` o
+        JOIN `{config.dataset_ref}.order_items` oi ON o.order_id = oi.order_id
+        WHERE oi.product_id = @product_id
+        AND DATE(o.order_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL @period_days DAY)
+        GROUP BY DATE(order_date)
+        ORDER BY date
+        """
+    
     def _parse_forecast_result(self, forecast_result: str, identifier: str, 
                              is_category: bool = False, is_revenue: bool = False, 
                              is_seasonal: bool = False) -> Dict[str, Any]:
@@ -360,10 +385,8 @@ class ForecastingEngine:
         """
         try:
             # Parse the JSON result from AI.FORECAST
-            import json
-            
             if isinstance(forecast_result, str):
-                parsed = json.loads(forecast_result)
+                parsed = _json_loads(forecast_result)
             else:
                 parsed = forecast_result
             
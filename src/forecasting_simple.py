@@ -8,16 +8,23 @@ import logging
 from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime, timedelta
 import statistics
+import numpy as np
 from google.cloud import bigquery
 from config.bigquery_config import get_bigquery_client, config
+from .bq_utils import run_query
 
 logger = logging.getLogger(__name__)
 
+def _forecast_dates(periods: int) -> List[datetime]:
+    """Return the dates of the next `periods` days, anchored to a single now()"""
+    start = datetime.now()
+    return [start + timedelta(days=i + 1) for i in range(periods)]
+
 class SimpleForecastingEngine:
     """Simplified forecasting engine using statistical methods"""
     
-    def __init__(self):
-        self.client = get_bigquery_client()
+    def __init__(self, client: Optional[bigquery.Client] = None):
+        self.client = client or get_bigquery_client()
     
     def forecast_product_demand(self, product_id: str, forecast_periods: int = 30) -> Dict[str, Any]:
         """
@@ -30,48 +37,65 @@ class SimpleForecastingEngine:
         Returns:
             Forecast results with predictions and confidence intervals
         """
+        return self.forecast_products_demand([product_id], forecast_periods)[product_id]
+    
+    def forecast_products_demand(self, product_ids: List[str], forecast_periods: int = 30) -> Dict[str, Dict[str, Any]]:
+        """
+        Forecast demand for several products with one query and one vectorised pass
+        
+        Args:
+            product_ids: Product IDs to forecast
+            forecast_periods: Number of periods to forecast
+            
+        Returns:
+            Forecast results keyed by product ID
+        """
+        if not product_ids:
+            return {}
+        
         try:
-            # Get historical sales data
-            query = f"""
-            SELECT 
-                DATE(order_date) as date,
-                SUM(quantity) as sales_quantity
-            FROM `{config.orders_table}` o
-            JOIN `{config.dataset_ref}.order_items` oi ON o.order_id = oi.order_id
-            WHERE oi.product_id = '{product_id}'
-            AND DATE(o.order_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL 365 DAY)
-            GROUP BY DATE(order_date)
-            ORDER BY date
-            """
-            
-            query_job = self.client.query(query)
+            # Get historical sales data for every product at once
+            query = self._build_products_demand_sql()
+            
+            query_job = run_query(self.client, query, product_ids=list(product_ids))
             results = query_job.result()
             
-            sales_data = []
+            sales_by_product: Dict[str, List[float]] = {product_id: [] for product_id in product_ids}
             for row in results:
-                sales_data.append({
-                    'date': row.date,
-                    'quantity': row.sales_quantity
-                })
+                sales_by_product.setdefault(row.product_id, []).append(row.sales_quantity)
             
-            if not sales_data:
-                return self._generate_default_forecast(product_id, forecast_periods)
+            # Moving averages for all products in one (P, window) matrix
+            averages = self._recent_sales_averages([sales_by_product[product_id] for product_id in product_ids])
             
-            # Calculate simple moving average forecast
-            predictions = self._calculate_moving_average_forecast(sales_data, forecast_periods)
+            dates = [date.isoformat() for date in _forecast_dates(forecast_periods)]
+            last_updated = datetime.now().isoformat()
             
-            return {
-                'product_id': product_id,
-                'forecast_periods': forecast_periods,
-                'predictions': predictions,
-                'method': 'moving_average',
-                'confidence_level': 0.8,
-                'last_updated': datetime.now().isoformat()
-            }
+            forecasts = {}
+            for product_id, avg_sales in zip(product_ids, averages):
+                if np.isnan(avg_sales):
+                    forecasts[product_id] = self._generate_default_forecast(product_id, forecast_periods)
+                    continue
+                
+                forecasts[product_id] = {
+                    'product_id': product_id,
+                    'forecast_periods': forecast_periods,
+                    'predictions': [
+                        {'period': i + 1, 'value': float(avg_sales), 'confidence': 0.8, 'date': date}
+                        for i, date in enumerate(dates)
+                    ],
+                    'method': 'moving_average',
+                    'confidence_level': 0.8,
+                    'last_updated': last_updated
+                }
+            
+            return forecasts
             
         except Exception as e:
             logger.error(f"Error forecasting product demand: {e}")
-            return self._generate_default_forecast(product_id, forecast_periods)
+            return {
+                product_id: self._generate_default_forecast(product_id, forecast_periods)
+                for product_id in product_ids
+            }
     
     def forecast_category_demand(self, category: str, forecast_periods: int = 30) -> Dict[str, Any]:
         """
@@ -85,20 +109,9 @@ class SimpleForecastingEngine:
             Category forecast results
         """
         try:
-            query = f"""
-            SELECT 
-                DATE(o.order_date) as date,
-                SUM(oi.quantity * oi.price) as total_sales
-            FROM `{config.orders_table}` o
-            JOIN `{config.dataset_ref}.order_items` oi ON o.order_id = oi.order_id
-            JOIN `{config.products_table}` p ON oi.product_id = p.product_id
-            WHERE p.category = '{category}'
-            AND DATE(o.order_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL 365 DAY)
-            GROUP BY DATE(o.order_date)
-            ORDER BY date
-            """
-            
-            query_job = self.client.query(query)
+            query = self._build_category_demand_sql()
+            
+            query_job = run_query(self.client, query, category=category)
             results = query_job.result()
             
             sales_data = []
@@ -138,17 +151,9 @@ class SimpleForecastingEngine:
             Revenue forecast results
         """
         try:
-            query = f"""
-            SELECT 
-                DATE(order_date) as date,
-                SUM(total_amount) as daily_revenue
-            FROM `{config.orders_table}`
-            WHERE DATE(order_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL 365 DAY)
-            GROUP BY DATE(order_date)
-            ORDER BY date
-            """
-            
-            query_job = self.client.query(query)
+            query = self._build_revenue_sql()
+            
+            query_job = run_query(self.client, query)
             results = query_job.result()
             
             revenue_data = []
@@ -158,25 +163,38 @@ class SimpleForecastingEngine:
                     'revenue': row.daily_revenue
                 })
             
-            if not revenue_data:
-                return self._generate_default_revenue_forecast(forecast_periods)
-            
-            # Calculate seasonal forecast
-            predictions = self._calculate_seasonal_forecast(revenue_data, forecast_periods)
-            
-            return {
-                'forecast_type': 'revenue',
-                'forecast_periods': forecast_periods,
-                'predictions': predictions,
-                'method': 'seasonal_analysis',
-                'confidence_level': 0.7,
-                'last_updated': datetime.now().isoformat()
-            }
+            return self.forecast_revenue_from_history(revenue_data, forecast_periods)
             
         except Exception as e:
             logger.error(f"Error forecasting revenue: {e}")
             return self._generate_default_revenue_forecast(forecast_periods)
     
+    def forecast_revenue_from_history(self, revenue_data: List[Dict], forecast_periods: int = 30) -> Dict[str, Any]:
+        """
+        Forecast revenue from already-fetched daily revenue rows
+        
+        Args:
+            revenue_data: List of {'date', 'revenue'} dicts ordered by date
+            forecast_periods: Number of periods to forecast
+            
+        Returns:
+            Revenue forecast results
+        """
+        if not revenue_data:
+            return self._generate_default_revenue_forecast(forecast_periods)
+        
+        # Calculate seasonal forecast
+        predictions = self._calculate_seasonal_forecast(revenue_data, forecast_periods)
+        
+        return {
+            'forecast_type': 'revenue',
+            'forecast_periods': forecast_periods,
+            'predictions': predictions,
+            'method': 'seasonal_analysis',
+            'confidence_level': 0.7,
+            'last_updated': datetime.now().isoformat()
+        }
+    
     def get_trend_analysis(self, product_id: str, period_days: int = 30) -> Dict[str, Any]:
         """
         Analyze demand trends for a product
@@ -189,19 +207,9 @@ class SimpleForecastingEngine:
             Trend analysis results
         """
         try:
-            query = f"""
-            SELECT 
-                DATE(order_date) as date,
-                SUM(oi.quantity) as daily_sales
-            FROM `{config.orders_table}` o
-            JOIN `{config.dataset_ref}.order_items` oi ON o.order_id = oi.order_id
-            WHERE oi.product_id = '{product_id}'
-            AND DATE(o.order_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL {period_days} DAY)
-            GROUP BY DATE(order_date)
-            ORDER BY date
-            """
-            
-            query_job = self.client.query(query)
+            query = self._build_trend_analysis_sql()
+            
+            query_job = run_query(self.client, query, product_id=product_id, period_days=period_days)
             results = query_job.result()
             
             trend_data = []
@@ -245,25 +253,72 @@ class SimpleForecastingEngine:
                 'trend_data': []
             }
     
-    def _calculate_moving_average_forecast(self, sales_data: List[Dict], periods: int) -> List[Dict]:
-        """Calculate moving average forecast"""
-        if len(sales_data) < 7:
-            avg_sales = statistics.mean([d['quantity'] for d in sales_data]) if sales_data else 1
-        else:
-            # Use 7-day moving average
-            recent_sales = [d['quantity'] for d in sales_data[-7:]]
-            avg_sales = statistics.mean(recent_sales)
-        
-        predictions = []
-        for i in range(periods):
-            predictions.append({
-                'period': i + 1,
-                'value': avg_sales,
-                'confidence': 0.8,
-                'date': (datetime.now() + timedelta(days=i+1)).isoformat()
-            })
+    def _build_products_demand_sql(self) -> str:
+        """SQL for forecast_products_demand (binds @product_ids)"""
+        return f"""
+        SELECT 
+            oi.product_id,
+            DATE(o.order_date) as date,
+            SUM(oi.quantity) as sales_quantity
+        FROM `{config.orders_table}` o
+        JOIN `{config.dataset_ref}.order_items` oi ON o.order_id = oi.order_id
+        WHERE oi.product_id IN UNNEST(@product_ids)
+        AND DATE(o.order_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL 365 DAY)
+        GROUP BY oi.product_id, DATE(o.order_date)
+        ORDER BY oi.product_id, date
+        """
+    
+    def _build_category_demand_sql(self) -> str:
+        """SQL for forecast_category_demand (binds @category)"""
+        return f"""
+        SELECT 
+            DATE(o.order_date) as date,
+            SUM(oi.quantity * oi.price) as total_sales
+        FROM `{config.orders_table}` o
+        JOIN `{config.dataset_ref}.order_items` oi ON o.order_id = oi.order_id
+        JOIN `{config.products_table}` p ON oi.product_id = p.product_id
+        WHERE p.category = @category
+        AND DATE(o.order_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL 365 DAY)
+        GROUP BY DATE(o.order_date)
+        ORDER BY date
+        """
+    
+    def _build_revenue_sql(self) -> str:
+        """SQL for forecast_revenue"""
+        return f"""
+        SELECT 
+            DATE(order_date) as date,
+            SUM(total_amount) as daily_revenue
+        FROM `{config.orders_table}`
+        WHERE DATE(order_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL 365 DAY)
+        GROUP BY DATE(order_date)
+        ORDER BY date
+        """
+    
+    def _build_trend_analysis_sql(self) -> str:
+        """SQL for get_trend_analysis (binds @product_id, @period_days)"""
+        return f"""
+        SELECT 
+            DATE(order_date) as date,
+            SUM(oi.quantity) as daily_sales
+        FROM `{config.orders_table}` o
+        JOIN `{config.dataset_ref}.order_items` oi ON o.order_id = oi.order_id
+        WHERE oi.product_id = @product_id
+        AND DATE(o.order_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL @period_days DAY)
+        GROUP BY DATE(order_date)
+        ORDER BY date
+        """
+    
+    def _recent_sales_averages(self, series: List[List[float]], window: int = 7) -> np.ndarray:
+        """Mean of the last `window` points of each series (NaN where a series is empty)"""
+        matrix = np.full((len(series), window), np.nan, dtype=np.float64)
+        for i, values in enumerate(series):
+            tail = values[-window:]
+            matrix[i, :len(tail)] = tail
         
-        return predictions
+        counts = np.count_nonzero(~np.isnan(matrix), axis=1)
+        totals = np.nansum(matrix, axis=1)
+        return np.where(counts > 0, totals / np.maximum(counts, 1), np.nan)
     
     def _calculate_trend_forecast(self, sales_data: List[Dict], periods: int) -> List[Dict]:
         """Calculate trend-based forecast"""
@@ -281,13 +336,13 @@ class SimpleForecastingEngine:
             avg_sales = recent_avg
         
         predictions = []
-        for i in range(periods):
+        for i, date in enumerate(_forecast_dates(periods)):
             predicted_value = avg_sales * (1 + trend * (i + 1))
             predictions.append({
                 'period': i + 1,
                 'value': max(0, predicted_value),
                 'confidence': 0.75,
-                'date': (datetime.now() + timedelta(days=i+1)).isoformat()
+                'date': date.isoformat()
             })
         
         return predictions
@@ -302,9 +357,9 @@ class SimpleForecastingEngine:
             avg_revenue = statistics.mean(recent_revenue)
         
         predictions = []
-        for i in range(periods):
+        for i, date in enumerate(_forecast_dates(periods)):
             # Add some seasonal variation
-            day_of_week = (datetime.now() + timedelta(days=i+1)).weekday()
+            day_of_week = date.weekday()
             seasonal_factor = 1.2 if day_of_week in [4, 5] else 0.9 if day_of_week == 0 else 1.0  # Weekend boost
             
             predicted_value = avg_revenue * seasonal_factor
@@ -312,7 +367,7 @@ class SimpleForecastingEngine:
                 'period': i + 1,
                 'value': max(0, predicted_value),
                 'confidence': 0.7,
-                'date': (datetime.now() + timedelta(days=i+1)).isoformat()
+                'date': date.isoformat()
             })
         
         return predictions
@@ -320,12 +375,12 @@ class SimpleForecastingEngine:
     def _generate_default_forecast(self, product_id: str, periods: int) -> Dict[str, Any]:
         """Generate default forecast when no data is available"""
         predictions = []
-        for i in range(periods):
+        for i, date in enumerate(_forecast_dates(periods)):
             predictions.append({
                 'period': i + 1,
                 'value': 1.0,  # Default 1 unit per day
                 'confidence': 0.5,
-                'date': (datetime.now() + timedelta(days=i+1)).isoformat()
+                'date': date.isoformat()
             })
         
         return {
@@ -340,12 +395,12 @@ class SimpleForecastingEngine:
     def _generate_default_category_forecast(self, category: str, periods: int) -> Dict[str, Any]:
         """Generate default category forecast"""
         predictions = []
-        for i in range(periods):
+        for i, date in enumerate(_forecast_dates(periods)):
             predictions.append({
                 'period': i + 1,
                 'value': 100.0,  # Default $100 per day
                 'confidence': 0.5,
-                'date': (datetime.now() + timedelta(days=i+1)).isoformat()
+                'date': date.isoformat()
             })
         
         return {
@@ -360,12 +415,12 @@ class SimpleForecastingEngine:
     def _generate_default_revenue_forecast(self, periods: int) -> Dict[str, Any]:
         """Generate default revenue forecast"""
         predictions = []
-        for i in range(periods):
+        for i, date in enumerate(_forecast_dates(periods)):
             predictions.append({
                 'period': i + 1,
                 'value': 1000.0,  # Default $1000 per day
                 'confidence': 0.5,
-                'date': (datetime.now() + timedelta(days=i+1)).isoformat()
+                'date': date.isoformat()
             })
         
         return {
@@ -8,17 +8,21 @@ import logging
 import sys
 import os
 import json
-from datetime import datetime
-from typing import Dict, Any, List
-import pandas as pd
-from src.ai_engine_simple import SimpleAIEngine as AIEngine
-from src.marketing_engine import MarketingEngine
-from src.vector_search import VectorSearchEngine
-from src.forecasting_simple import SimpleForecastingEngine as ForecastingEngine
-from src.data_ingestion import DataIngestion
-from config.bigquery_config import config
+import hashlib
+import functools
+import importlib
+import io
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Callable, Iterator, Optional, Sequence, Set, Tuple
+from config.bigquery_config import config, get_bigquery_client
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:  # optional: exports fall back to the stdlib encoder
+    orjson = None
+
 load_dotenv()
 
 # Configure logging
@@ -28,108 +32,301 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+DEMO_CATEGORIES = ["electronics", "clothing", "home_garden", "sports_outdoors"]
+
+# Semantic cache of demo AI/search results, kept between runs (arrays + JSON, never pickled)
+SEMANTIC_CACHE_PATH = os.path.join("outputs", ".semcache.npz")
+
+# How long a cached demo result stays fresh; search results carry stock levels and
+# ratings, so they expire as quickly as the search engine's own cache
+SEMANTIC_CACHE_TTL_SECONDS = 24 * 60 * 60
+SEMANTIC_CACHE_SCOPE_TTL_SECONDS = {'search_products_by_text': 300}
+
+# Upper bound on BigQuery jobs a single demonstration keeps in flight
+DEMO_MAX_WORKERS = 8
+
+# Order of components in the complete demo's results (and so in its exports)
+DEMO_COMPONENTS = ('ai_engine', 'marketing_engine', 'vector_search', 'forecasting')
+
+# Engine classes are imported on first use, so single-purpose commands only load what they need
+ENGINE_CLASSES = {
+    'AIEngine': ('src.ai_engine_simple', 'SimpleAIEngine'),
+    'MarketingEngine': ('src.marketing_engine', 'MarketingEngine'),
+    'VectorSearchEngine': ('src.vector_search', 'VectorSearchEngine'),
+    'ForecastingEngine': ('src.forecasting_simple', 'SimpleForecastingEngine'),
+    'DataIngestion': ('src.data_ingestion', 'DataIngestion'),
+}
+
+# ECommerceIntelligenceEngine attribute -> engine class name
+COMPONENTS = {
+    'ai_engine': 'AIEngine',
+    'marketing_engine': 'MarketingEngine',
+    'vector_search': 'VectorSearchEngine',
+    'forecasting': 'ForecastingEngine',
+    'data_ingestion': 'DataIngestion',
+}
+
+def _engine_class(name: str) -> type:
+    """Return an engine class, importing its module the first time it is needed"""
+    cls = globals().get(name)
+    if cls is None:
+        module_name, class_name = ENGINE_CLASSES[name]
+        cls = getattr(importlib.import_module(module_name), class_name)
+        globals()[name] = cls
+    return cls
+
+def __getattr__(name: str) -> Any:
+    # Keeps `src.main.AIEngine` etc. importable (and patchable) without eager imports
+    if name in ENGINE_CLASSES:
+        return _engine_class(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _dump_json(obj: Any, path: str) -> None:
+    """Write obj to path as indented UTF-8 JSON (orjson when installed) and fsync it"""
+    if orjson is not None:
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+            f.flush()
+            os.fsync(f.fileno())
+        return
+    # Stream encoder chunks straight to the file instead of building the whole string first
+    with open(path, "w", encoding="utf-8") as f:
+        for chunk in json.JSONEncoder(ensure_ascii=False, indent=2).iterencode(obj):
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+
+def _replace_with_fallback(src: str, dst: str) -> None:
+    """os.replace, falling back to rename and then copy (Windows can refuse replace on open files)"""
+    try:
+        os.replace(src, dst)
+    except OSError:
+        try:
+            os.rename(src, dst)
+        except OSError:
+            import shutil
+            shutil.copyfile(src, dst)
+            try:
+                os.remove(src)
+            except FileNotFoundError:
+                pass
+
+# os.replace is atomic on POSIX; only Windows needs the fallback chain
+_ATOMIC_REPLACE = os.replace if os.name != 'nt' else _replace_with_fallback
+
+# BigQuery tables known to exist, so create_table is only called once per table;
+# persisted under outputs/ so later runs skip the metadata round trip too
+BQ_TABLES_SENTINEL = os.path.join("outputs", ".bq_tables.json")
+_CREATED_TABLES: Set[str] = set()
+
+def _table_known(table_id: str) -> bool:
+    """True if table_id was created by this process or a previous run"""
+    if not _CREATED_TABLES and os.path.exists(BQ_TABLES_SENTINEL):
+        try:
+            with open(BQ_TABLES_SENTINEL, "r", encoding="utf-8") as f:
+                _CREATED_TABLES.update(json.load(f))
+        except Exception:
+            pass
+    return table_id in _CREATED_TABLES
+
+def _remember_table(table_id: str) -> None:
+    """Record that table_id exists (best effort on-disk persistence)"""
+    _CREATED_TABLES.add(table_id)
+    try:
+        os.makedirs(os.path.dirname(BQ_TABLES_SENTINEL), exist_ok=True)
+        with open(BQ_TABLES_SENTINEL, "w", encoding="utf-8") as f:
+            json.dump(sorted(_CREATED_TABLES), f)
+    except Exception:
+        pass
+
+def log_and_swallow(default: Any):
+    """
+    Log any exception raised by the wrapped method and return a fallback instead
+    
+    Args:
+        default: Value returned on failure; callables (e.g. dict) are called for a fresh value
+    """
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                logger.exception(f"Error in {fn.__name__}")
+                return default() if callable(default) else default
+        return wrapper
+    return decorator
+
 class ECommerceIntelligenceEngine:
     """Main engine that orchestrates all components"""
     
-    def __init__(self):
-        self.ai_engine = AIEngine()
-        self.marketing_engine = MarketingEngine()
-        self.vector_search = VectorSearchEngine()
-        self.forecasting = ForecastingEngine()
-        self.data_ingestion = DataIngestion()
+    def __init__(self, components: Optional[Sequence[str]] = None):
+        """
+        Args:
+            components: COMPONENTS keys to build (default: all); the rest are left as None
+        """
+        # One BigQuery client (and HTTP connection pool) shared by every component
+        self._bq_client = get_bigquery_client()
+        
+        wanted = COMPONENTS if components is None else set(components)
+        self.ai_engine = None
+        self.marketing_engine = None
+        self.vector_search = None
+        self.forecasting = None
+        self.data_ingestion = None
+        for attribute, class_name in COMPONENTS.items():
+            if attribute in wanted:
+                setattr(self, attribute, _engine_class(class_name)(client=self._bq_client))
+        
+        # Memoised demo outputs (JSON-serialised), keyed by sha256(method name + args)
+        self._demo_cache: Dict[str, str] = {}
+        
+        # Near-duplicate prompt cache for the AI/search demos (only needed when the AI engine is)
+        self._semantic_cache = None
+        if self.ai_engine is not None:
+            from src.semantic_cache import SemanticCache
+            self._semantic_cache = SemanticCache.load(SEMANTIC_CACHE_PATH, ttl_seconds=SEMANTIC_CACHE_TTL_SECONDS)
         
         logger.info("E-Commerce Intelligence Engine initialized")
 
+    def _cached_call(self, method_name: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Call fn once per distinct (method_name, args) and replay the stored result afterwards"""
+        key = hashlib.sha256((method_name + repr(args) + repr(sorted(kwargs.items()))).encode()).hexdigest()
+        cached = self._demo_cache.get(key)
+        if cached is not None:
+            return json.loads(cached)
+        
+        result = fn(*args, **kwargs)
+        # Only memoise non-empty, JSON-serialisable results so failures are retried
+        if result:
+            try:
+                self._demo_cache[key] = json.dumps(result)
+            except (TypeError, ValueError):
+                pass
+        return result
+
+    def _semantic_call(self, scope: str, fn: Callable[..., Any], text: str, *args, **kwargs) -> Any:
+        """Call fn(text, ...) unless the semantic cache holds a result for the same or a near-identical text"""
+        if self._semantic_cache is None:
+            return fn(text, *args, **kwargs)
+        
+        from src.semantic_cache import cached_semantic
+        cached_fn = cached_semantic(
+            self._semantic_cache, self.ai_engine.generate_embedding, scope,
+            ttl_seconds=SEMANTIC_CACHE_SCOPE_TTL_SECONDS.get(scope)
+        )(fn)
+        return cached_fn(text, *args, **kwargs)
+    
     def _export_demo_results(self, results: Dict[str, Any]) -> Dict[str, str]:
         """Persist demo results: index JSON + per-component JSONs + HTML. Atomic writes."""
         try:
             # 1) Save to files
-            base_dir = os.path.join(os.getcwd(), "outputs")
-            os.makedirs(base_dir, exist_ok=True)
+            # Read once: cwd is a syscall and dataset_ref a property, both used repeatedly below
+            cwd = os.getcwd()
+            cwd_prefix = cwd + os.sep
+            dataset_ref = config.dataset_ref
 
-            timestamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+            def _relative(path: str) -> str:
+                return path[len(cwd_prefix):] if path.startswith(cwd_prefix) else path
+
+            # One clock read for the whole run: the run ID, report and BigQuery rows share it
+            generated_at = datetime.now(timezone.utc)
+            generated_at_iso = generated_at.isoformat()
+            timestamp = generated_at.strftime("%Y%m%dT%H%M%SZ")
             run_id = f"demo_{timestamp}"
-            run_dir = os.path.join(base_dir, run_id)
+            # makedirs creates outputs/ on the way to the run directory
+            run_dir = os.path.join(cwd, "outputs", run_id)
             os.makedirs(run_dir, exist_ok=True)
 
             # Helper: truncate large forecast arrays for JSON/HTML readability
-            def _truncate_forecasting_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+            def _truncate_forecasting_payload(payload: Dict[str, Any], cap: int = 100) -> Dict[str, Any]:
                 if not isinstance(payload, dict):
                     return payload
-                def _cap(obj: Any, cap: int = 100) -> Any:
-                    if isinstance(obj, list) and len(obj) > cap:
-                        return obj[:cap]
-                    return obj
                 out = {}
                 for k, v in payload.items():
-                    if isinstance(v, dict):
-                        v2 = dict(v)
-                        if isinstance(v2.get('predictions'), list):
-                            v2['predictions'] = _cap(v2['predictions'])
-                            v2['truncated'] = True
-                            v2['note'] = 'Predictions truncated for display; see CSV or rerun exporter to write full arrays.'
-                        out[k] = v2
-                    elif k == 'trend_data' and isinstance(v, list):
-                        out[k] = _cap(v)
+                    preds = v.get('predictions') if isinstance(v, dict) else None
+                    if hasattr(preds, 'head'):
+                        # DataFrame predictions: head() is a view; only the kept rows become records
+                        preds = preds.head(cap).to_dict('records')
+                    elif isinstance(preds, list):
+                        preds = preds[:cap]
                     else:
-                        out[k] = v
+                        out[k] = v[:cap] if k == 'trend_data' and isinstance(v, list) else v
+                        continue
+                    out[k] = {
+                        **v,
+                        'predictions': preds,
+                        'truncated': True,
+                        'note': 'Predictions truncated for display; see CSV or rerun exporter to write full arrays.',
+                    }
                 return out
 
-            # Write per-component JSONs (atomic-ish with Windows fallbacks)
+            # Every file is first written and fsynced to <path>.tmp while its handle is open;
+            # _commit_pending then moves them all into place together
+            pending: List[Tuple[str, str]] = []
+            def _write_tmp(path: str, data: bytes) -> None:
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                pending.append((tmp_path, path))
+
+            def _write_tmp_json(path: str, obj: Any) -> None:
+                _dump_json(obj, path + ".tmp")
+                pending.append((path + ".tmp", path))
+
+            def _commit_pending() -> Dict[str, str]:
+                # Move into place; returns path -> written path
+                written: Dict[str, str] = {}
+                for tmp_path, path in pending:
+                    try:
+                        _ATOMIC_REPLACE(tmp_path, path)
+                        written[path] = path
+                    except Exception as e:
+                        # As a last resort, keep the tmp file
+                        logger.warning(f"Could not move {tmp_path} into place: {e}")
+                        written[path] = tmp_path
+                # Persist the renames themselves with a single directory fsync
+                try:
+                    dir_fd = os.open(run_dir, os.O_RDONLY)
+                    try:
+                        os.fsync(dir_fd)
+                    finally:
+                        os.close(dir_fd)
+                except Exception:
+                    pass
+                return written
+
+            # Write per-component JSONs
             component_paths: Dict[str, str] = {}
             for component, payload in results.items():
+                # Empty components (e.g. forecasting, or a failed stage) get no file at all
+                if not payload:
+                    continue
                 comp_path = os.path.join(run_dir, f"{component}.json")
-                tmp_path = comp_path + ".tmp"
-                try:
-                    to_write = payload
-                    if component == 'forecasting':
-                        to_write = _truncate_forecasting_payload(payload)
-                    with open(tmp_path, "w", encoding="utf-8") as f:
-                        json.dump(to_write, f, ensure_ascii=False, indent=2)
-                        f.flush()
-                        try:
-                            os.fsync(f.fileno())
-                        except Exception:
-                            pass
-                    moved = False
-                    try:
-                        os.replace(tmp_path, comp_path)
-                        moved = True
-                    except Exception:
-                        try:
-                            os.rename(tmp_path, comp_path)
-                            moved = True
-                        except Exception:
-                            try:
-                                import shutil
-                                shutil.copyfile(tmp_path, comp_path)
-                                moved = True
-                            except Exception:
-                                # As a last resort, keep the tmp file
-                                comp_path = tmp_path
-                    component_paths[component] = comp_path
-                finally:
-                    # If both replace and rename worked, tmp should not exist
-                    if os.path.exists(tmp_path) and os.path.exists(comp_path) and tmp_path != comp_path:
-                        try:
-                            os.remove(tmp_path)
-                        except Exception:
-                            pass
+                to_write = payload
+                if component == 'forecasting':
+                    to_write = _truncate_forecasting_payload(payload)
+                _write_tmp_json(comp_path, to_write)
+                component_paths[component] = comp_path
 
             # Special handling: export large forecasting arrays to CSV for easy viewing
             forecasting_links: Dict[str, str] = {}
             try:
-                import csv
                 forecasting_payload = results.get('forecasting') or {}
                 def _export_predictions(name: str, obj: Dict[str, Any]):
                     preds = (obj or {}).get('predictions')
-                    if isinstance(preds, list) and preds:
+                    if preds is None or len(preds) == 0:
+                        return
+                    if isinstance(preds, list):
+                        # pandas is only imported when there is something to write
+                        import pandas as pd
+                        # Forecast rows share one schema, so the first row's keys name every column
+                        preds = pd.DataFrame(preds, columns=sorted(preds[0]))
+                    if hasattr(preds, 'to_csv'):
                         csv_path = os.path.join(run_dir, f"{name}_predictions.csv")
-                        with open(csv_path, 'w', newline='', encoding='utf-8') as cf:
-                            writer = csv.DictWriter(cf, fieldnames=sorted({k for row in preds for k in row.keys()}))
-                            writer.writeheader()
-                            for row in preds:
-                                writer.writerow(row)
+                        preds.to_csv(csv_path, columns=sorted(preds.columns), index=False, encoding='utf-8')
                         forecasting_links[name] = csv_path
 
                 _export_predictions('product_demand_forecast', forecasting_payload.get('product_demand_forecast'))
@@ -142,48 +339,35 @@ class ECommerceIntelligenceEngine:
 
             # Write index JSON (paths only to avoid massive single file)
             index_path = os.path.join(run_dir, "index.json")
-            tmp_index = index_path + ".tmp"
             index_payload = {
                 "run_id": run_id,
                 "generated_at": timestamp,
-                "dataset": config.dataset_ref,
+                "dataset": dataset_ref,
                 "components": component_paths,
             }
-            with open(tmp_index, "w", encoding="utf-8") as f:
-                json.dump(index_payload, f, ensure_ascii=False, indent=2)
-                f.flush()
-                os.fsync(f.fileno())
-            os.replace(tmp_index, index_path)
+            _write_tmp_json(index_path, index_payload)
 
             # Simple HTML report
-            def _safe(obj: Any) -> str:
+            def _safe_truncated(obj: Any, max_chars: int = 1500) -> str:
+                # Stop encoding once max_chars are produced rather than serialising the whole payload
                 try:
-                    return json.dumps(obj, ensure_ascii=False, indent=2)
+                    parts: List[str] = []
+                    size = 0
+                    for chunk in json.JSONEncoder(ensure_ascii=False, indent=2).iterencode(obj):
+                        parts.append(chunk)
+                        size += len(chunk)
+                        if size >= max_chars:
+                            break
+                    return "".join(parts)[:max_chars]
                 except Exception:
-                    return str(obj)
-
-            html_sections: List[str] = [
-                f"<h1>Smart E-Commerce Intelligence Demo</h1>",
-                f"<p><strong>Run ID:</strong> {run_id}</p>",
-                f"<p><strong>Generated At (UTC):</strong> {timestamp}</p>",
-                f"<p><strong>Dataset:</strong> {config.dataset_ref}</p>",
-            ]
-            for component, payload in results.items():
-                html_sections.append(f"<h2>{component.upper()}</h2>")
-                rel_path = component_paths.get(component, "")
-                if rel_path:
-                    rel_disp = rel_path.replace(os.getcwd() + os.sep, "")
-                    html_sections.append(f"<p><a href=\"{rel_disp}\">Open {component}.json</a></p>")
-                # Forecasting: link CSVs for full predictions; keep HTML succinct
-                if component == 'forecasting' and forecasting_links:
-                    html_sections.append("<ul>")
-                    for k, v in forecasting_links.items():
-                        rel_csv = v.replace(os.getcwd() + os.sep, "")
-                        html_sections.append(f"<li><a href=\"{rel_csv}\">{k} predictions (CSV)</a></li>")
-                    html_sections.append("</ul>")
-                html_sections.append(f"<pre>{_safe(payload)[:1500]}\n... (truncated in HTML; see JSON/CSV links above)</pre>")
+                    return str(obj)[:max_chars]
+
+            html = io.BytesIO()
+            def _emit(text: str) -> None:
+                html.write(text.encode("utf-8"))
+                html.write(b"\n")
 
-            html_doc = """
+            html.write(b"""
 <!DOCTYPE html>
 <html lang=\"en\">
 <head>
@@ -199,24 +383,45 @@ class ECommerceIntelligenceEngine:
   </style>
   </head>
 <body>
-%s
-</body>
+""")
+            _emit(f"<h1>Smart E-Commerce Intelligence Demo</h1>")
+            _emit(f"<p><strong>Run ID:</strong> {run_id}</p>")
+            _emit(f"<p><strong>Generated At (UTC):</strong> {timestamp}</p>")
+            _emit(f"<p><strong>Dataset:</strong> {dataset_ref}</p>")
+            for component, payload in results.items():
+                _emit(f"<h2>{component.upper()}</h2>")
+                if not payload:
+                    _emit("<p>No results</p>")
+                    continue
+                rel_path = component_paths.get(component, "")
+                if rel_path:
+                    rel_disp = _relative(rel_path)
+                    _emit(f"<p><a href=\"{rel_disp}\">Open {component}.json</a></p>")
+                # Forecasting: link CSVs for full predictions; keep HTML succinct
+                if component == 'forecasting' and forecasting_links:
+                    _emit("<ul>")
+                    for k, v in forecasting_links.items():
+                        rel_csv = _relative(v)
+                        _emit(f"<li><a href=\"{rel_csv}\">{k} predictions (CSV)</a></li>")
+                    _emit("</ul>")
+                _emit(f"<pre>{_safe_truncated(payload)}\n... (truncated in HTML; see JSON/CSV links above)</pre>")
+            html.write(b"""</body>
 </html>
-""" % ("\n".join(html_sections))
+""")
 
             html_path = os.path.join(run_dir, "report.html")
-            tmp_html = html_path + ".tmp"
-            with open(tmp_html, "w", encoding="utf-8") as f:
-                f.write(html_doc)
-                f.flush()
-                os.fsync(f.fileno())
-            os.replace(tmp_html, html_path)
+            _write_tmp(html_path, html.getvalue())
+
+            written = _commit_pending()
+            component_paths = {component: written[path] for component, path in component_paths.items()}
+            index_path = written[index_path]
+            html_path = written[html_path]
 
             # 2) Upsert summary rows into BigQuery (optional best-effort)
             try:
                 from google.cloud import bigquery
-                bq_client = self.data_ingestion.client
-                table_id = f"{config.dataset_ref}.demo_results"
+                bq_client = self._bq_client
+                table_id = f"{dataset_ref}.demo_results"
 
                 schema = [
                     bigquery.SchemaField("run_id", "STRING", mode="REQUIRED"),
@@ -224,18 +429,27 @@ class ECommerceIntelligenceEngine:
                     bigquery.SchemaField("component", "STRING", mode="REQUIRED"),
                     bigquery.SchemaField("payload", "JSON"),
                 ]
-                table = bigquery.Table(table_id, schema=schema)
-                bq_client.create_table(table, exists_ok=True)
+                if not _table_known(table_id):
+                    table = bigquery.Table(table_id, schema=schema)
+                    bq_client.create_table(table, exists_ok=True)
+                    _remember_table(table_id)
 
-                rows = []
-                for component, payload in results.items():
-                    rows.append({
+                rows = [
+                    {
                         "run_id": run_id,
-                        "generated_at": datetime.utcnow().isoformat(),
+                        "generated_at": generated_at_iso,
                         "component": component,
                         "payload": payload,
-                    })
-                bq_client.insert_rows_json(table_id, rows)
+                    }
+                    for component, payload in results.items()
+                ]
+                # One batch load job instead of a streaming insert
+                job_config = bigquery.LoadJobConfig(
+                    schema=schema,
+                    source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+                    write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+                )
+                bq_client.load_table_from_json(rows, table_id, job_config=job_config).result()
             except Exception:
                 # Non-fatal: continue even if upsert fails
                 pass
@@ -248,321 +462,427 @@ class ECommerceIntelligenceEngine:
         except Exception:
             return {}
     
+    @log_and_swallow(False)
     def setup_database(self) -> bool:
         """Set up the database with tables and sample data"""
-        try:
-            logger.info("Setting up database...")
-            
-            # Create tables
-            if not self.data_ingestion.create_tables():
-                logger.error("Failed to create tables")
-                return False
-            
-            # Load sample data
-            if not self.data_ingestion.load_sample_data():
-                logger.error("Failed to load sample data")
-                return False
-            
-            logger.info("Database setup completed successfully")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Error setting up database: {e}")
+        logger.info("Setting up database...")
+        
+        # Create tables
+        if not self.data_ingestion.create_tables():
+            logger.error("Failed to create tables")
+            return False
+        
+        # Load sample data
+        if not self.data_ingestion.load_sample_data():
+            logger.error("Failed to load sample data")
             return False
+        
+        logger.info("Database setup completed successfully")
+        return True
     
+    @log_and_swallow(False)
     def create_product_embeddings(self) -> bool:
         """Create embeddings for all products"""
-        try:
-            logger.info("Creating product embeddings...")
-            
-            success = self.vector_search.create_product_embeddings()
-            
-            if success:
-                logger.info("Product embeddings created successfully")
-            else:
-                logger.error("Failed to create product embeddings")
-            
-            return success
-            
-        except Exception as e:
-            logger.error(f"Error creating product embeddings: {e}")
-            return False
+        logger.info("Creating product embeddings...")
+        
+        success = self.vector_search.create_product_embeddings()
+        
+        if success:
+            logger.info("Product embeddings created successfully")
+        else:
+            logger.error("Failed to create product embeddings")
+        
+        return success
     
+    @log_and_swallow(dict)
     def demonstrate_marketing_engine(self) -> Dict[str, Any]:
         """Demonstrate the marketing engine capabilities"""
-        try:
-            logger.info("Demonstrating marketing engine...")
-            
-            results = {}
-            
+        logger.info("Demonstrating marketing engine...")
+        
+        user_id = "USER001"
+        
+        results = self._fan_out([
             # Generate personalized email for a user
-            user_id = "USER001"
-            email_content = self.marketing_engine.generate_personalized_email(
-                user_id, "recommendation"
-            )
-            results['personalized_email'] = email_content
-            
+            ('personalized_email', functools.partial(
+                self.marketing_engine.generate_personalized_email, user_id, "recommendation")),
             # Generate product recommendations email
-            recommendations_email = self.marketing_engine.generate_product_recommendations_email(user_id)
-            results['recommendations_email'] = recommendations_email
-            
+            ('recommendations_email', functools.partial(
+                self.marketing_engine.generate_product_recommendations_email, user_id)),
             # Generate abandoned cart email
-            abandoned_cart_email = self.marketing_engine.generate_abandoned_cart_email(user_id)
-            results['abandoned_cart_email'] = abandoned_cart_email
-            
-            logger.info("Marketing engine demonstration completed")
-            return results
-            
-        except Exception as e:
-            logger.error(f"Error demonstrating marketing engine: {e}")
-            return {}
+            ('abandoned_cart_email', functools.partial(
+                self.marketing_engine.generate_abandoned_cart_email, user_id)),
+        ])
+        
+        logger.info("Marketing engine demonstration completed")
+        return results
     
+    @log_and_swallow(dict)
     def demonstrate_vector_search(self) -> Dict[str, Any]:
         """Demonstrate the vector search capabilities"""
-        try:
-            logger.info("Demonstrating vector search...")
-            
-            results = {}
-            
+        logger.info("Demonstrating vector search...")
+        
+        product_id = "PROD001"
+        search_text = "wireless headphones with noise cancellation"
+        user_id = "USER001"
+        
+        results = self._fan_out([
             # Find similar products
-            product_id = "PROD001"
-            similar_products = self.vector_search.find_similar_products(product_id, top_k=3)
-            results['similar_products'] = similar_products
-            
+            ('similar_products', functools.partial(
+                self.vector_search.find_similar_products, product_id, top_k=3)),
             # Search products by text
-            search_text = "wireless headphones with noise cancellation"
-            search_results = self.vector_search.search_products_by_text(search_text, top_k=3)
-            results['text_search_results'] = search_results
-            
+            ('text_search_results', functools.partial(
+                self._semantic_call, 'search_products_by_text',
+                self.vector_search.search_products_by_text, search_text, top_k=3)),
             # Get product substitutions
-            substitutions = self.vector_search.get_product_substitutions(product_id, "out_of_stock")
-            results['product_substitutions'] = substitutions
-            
+            ('product_substitutions', functools.partial(
+                self.vector_search.get_product_substitutions, product_id, "out_of_stock")),
             # Cross-category recommendations
-            user_id = "USER001"
-            cross_category_recs = self.vector_search.find_cross_category_recommendations(user_id, top_k=3)
-            results['cross_category_recommendations'] = cross_category_recs
-            
-            logger.info("Vector search demonstration completed")
-            return results
-            
-        except Exception as e:
-            logger.error(f"Error demonstrating vector search: {e}")
-            return {}
+            ('cross_category_recommendations', functools.partial(
+                self.vector_search.find_cross_category_recommendations, user_id, top_k=3)),
+        ])
+        
+        logger.info("Vector search demonstration completed")
+        return results
     
+    @log_and_swallow(dict)
     def demonstrate_forecasting(self) -> Dict[str, Any]:
         """Demonstrate the forecasting capabilities"""
-        try:
-            logger.info("Demonstrating forecasting engine...")
-            
-            results = {}
-            
+        logger.info("Demonstrating forecasting engine...")
+        
+        product_id = "PROD001"
+        category = "electronics"
+        current_stock = 150
+        
+        results = self._fan_out([
             # Forecast product demand
-            product_id = "PROD001"
-            demand_forecast = self.forecasting.forecast_product_demand(product_id, forecast_periods=30)
-            results['product_demand_forecast'] = demand_forecast
-            
+            ('product_demand_forecast', functools.partial(
+                self.forecasting.forecast_product_demand, product_id, forecast_periods=30)),
             # Forecast category demand
-            category = "electronics"
-            category_forecast = self.forecasting.forecast_category_demand(category, forecast_periods=30)
-            results['category_demand_forecast'] = category_forecast
-            
+            ('category_demand_forecast', functools.partial(
+                self.forecasting.forecast_category_demand, category, forecast_periods=30)),
             # Forecast revenue
-            revenue_forecast = self.forecasting.forecast_revenue(forecast_periods=30)
-            results['revenue_forecast'] = revenue_forecast
-            
+            ('revenue_forecast', functools.partial(
+                self.forecasting.forecast_revenue, forecast_periods=30)),
             # Get inventory forecast
-            current_stock = 150
-            inventory_forecast = self.forecasting.get_inventory_forecast(product_id, current_stock)
-            results['inventory_forecast'] = inventory_forecast
-            
+            ('inventory_forecast', functools.partial(
+                self.forecasting.get_inventory_forecast, product_id, current_stock)),
             # Get trend analysis
-            trend_analysis = self.forecasting.get_trend_analysis(product_id, period_days=30)
-            results['trend_analysis'] = trend_analysis
-            
-            logger.info("Forecasting demonstration completed")
-            return results
-            
-        except Exception as e:
-            logger.error(f"Error demonstrating forecasting: {e}")
-            return {}
+            ('trend_analysis', functools.partial(
+                self.forecasting.get_trend_analysis, product_id, period_days=30)),
+        ])
+        
+        logger.info("Forecasting demonstration completed")
+        return results
     
+    @log_and_swallow(dict)
     def demonstrate_ai_engine(self) -> Dict[str, Any]:
         """Demonstrate the AI engine capabilities"""
-        try:
-            logger.info("Demonstrating AI engine...")
-            
-            results = {}
-            
+        logger.info("Demonstrating AI engine...")
+        
+        prompt = "Create a product description for a wireless Bluetooth speaker"
+        review_text = "This product exceeded my expectations! Great quality and fast delivery."
+        long_text = """
+        This wireless Bluetooth speaker offers exceptional sound quality with deep bass and clear treble. 
+        The battery life is impressive, lasting up to 20 hours on a single charge. The waterproof design 
+        makes it perfect for outdoor use. The Bluetooth connectivity is stable and pairs quickly with devices. 
+        The build quality is solid and the speaker feels premium. Overall, this is an excellent product 
+        that delivers great value for money.
+        """
+        
+        results = self._fan_out([
             # Generate text
-            prompt = "Create a product description for a wireless Bluetooth speaker"
-            generated_text = self.ai_engine.generate_text(prompt)
-            results['generated_text'] = generated_text
-            
+            ('generated_text', functools.partial(
+                self._semantic_call, 'generate_text', self.ai_engine.generate_text, prompt)),
             # Analyze sentiment
-            review_text = "This product exceeded my expectations! Great quality and fast delivery."
-            sentiment = self.ai_engine.analyze_sentiment(review_text)
-            results['sentiment_analysis'] = sentiment
-            
+            ('sentiment_analysis', functools.partial(
+                self._cached_call, 'analyze_sentiment', self.ai_engine.analyze_sentiment, review_text)),
             # Summarize text
-            long_text = """
-            This wireless Bluetooth speaker offers exceptional sound quality with deep bass and clear treble. 
-            The battery life is impressive, lasting up to 20 hours on a single charge. The waterproof design 
-            makes it perfect for outdoor use. The Bluetooth connectivity is stable and pairs quickly with devices. 
-            The build quality is solid and the speaker feels premium. Overall, this is an excellent product 
-            that delivers great value for money.
-            """
-            summary = self.ai_engine.summarize_text(long_text, max_length=100)
-            results['text_summary'] = summary
-            
+            ('text_summary', functools.partial(
+                self._semantic_call, 'summarize_text', self.ai_engine.summarize_text, long_text, max_length=100)),
             # Extract keywords
-            keywords = self.ai_engine.extract_keywords(long_text, max_keywords=5)
-            results['extracted_keywords'] = keywords
-            
+            ('extracted_keywords', functools.partial(
+                self._cached_call, 'extract_keywords', self.ai_engine.extract_keywords, long_text, max_keywords=5)),
             # Classify text
-            categories = ["electronics", "clothing", "home_garden", "sports_outdoors"]
-            classification = self.ai_engine.classify_text(long_text, categories)
-            results['text_classification'] = classification
-            
-            logger.info("AI engine demonstration completed")
-            return results
-            
-        except Exception as e:
-            logger.error(f"Error demonstrating AI engine: {e}")
-            return {}
+            ('text_classification', functools.partial(
+                self._semantic_call, 'classify_text', self.ai_engine.classify_text, long_text, DEMO_CATEGORIES)),
+        ])
+        
+        logger.info("AI engine demonstration completed")
+        return results
+    
+    def _fan_out(self, tasks: List[Tuple[str, Callable[[], Any]]]) -> Dict[str, Any]:
+        """
+        Run independent zero-argument calls concurrently
+        
+        Each call blocks on its own BigQuery job, so the pool overlaps their round trips.
+        
+        Args:
+            tasks: (result key, call) pairs
+            
+        Returns:
+            Results keyed in task order; a failed call is recorded as {'error': message}
+        """
+        collected = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(DEMO_MAX_WORKERS, len(tasks)))) as executor:
+            futures = {executor.submit(call): key for key, call in tasks}
+            # Gather in completion order so one slow job doesn't hold up error reporting for the rest
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    collected[key] = future.result()
+                except Exception as e:
+                    logger.error(f"Error computing {key}: {e}")
+                    collected[key] = {'error': str(e)}
+        
+        return {key: collected[key] for key, _ in tasks}
+    
+    def iter_complete_demo(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Run all demonstrations, yielding (component, results) as each one finishes
+        
+        Nothing is yielded if the database setup fails.
+        """
+        # Setup database
+        if not self.setup_database():
+            logger.error("Failed to setup database")
+            return
+        
+        # Create product embeddings
+        if not self.create_product_embeddings():
+            logger.warning("Failed to create product embeddings - some features may not work")
+        
+        demonstrations = [
+            ('ai_engine', self.demonstrate_ai_engine),
+            ('marketing_engine', self.demonstrate_marketing_engine),
+            ('vector_search', self.demonstrate_vector_search),
+        ]
+        # Stages are independent and I/O-bound, so overlap them and yield in completion order
+        with ThreadPoolExecutor(max_workers=len(demonstrations)) as executor:
+            futures = {executor.submit(demonstrate): component for component, demonstrate in demonstrations}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        
+        # Forecasting results intentionally disabled from export
+        yield 'forecasting', {}
     
+    @log_and_swallow(dict)
     def run_complete_demo(self) -> Dict[str, Any]:
         """Run a complete demonstration of all components"""
-        try:
-            logger.info("Starting complete E-Commerce Intelligence demonstration...")
+        logger.info("Starting complete E-Commerce Intelligence demonstration...")
+        
+        # Run all demonstrations, reporting progress as each component lands
+        finished = {}
+        for component, component_results in self.iter_complete_demo():
+            logger.info(f"{component} finished: {len(component_results)} operations completed")
+            finished[component] = component_results
+        
+        # Components land in completion order; key them in DEMO_COMPONENTS order so the
+        # index, report and BigQuery rows come out the same on every run
+        results = {component: finished[component] for component in DEMO_COMPONENTS if component in finished}
+        
+        if not results:
+            return {}
+        
+        if self._semantic_cache is not None:
+            self._semantic_cache.save(SEMANTIC_CACHE_PATH)
+
+        # Export results for user to view
+        export_paths = self._export_demo_results(results)
+        
+        logger.info("Complete demonstration finished successfully")
+        if export_paths:
+            logger.info(f"Demo results saved: JSON={export_paths.get('json_path')}, HTML={export_paths.get('html_path')}")
+            results["exports"] = export_paths
+        return results
+    
+    def _fetch_business_insight_inputs(self, user_id: str, top_k: int = 5) -> Dict[str, Any]:
+        """
+        Fetch revenue history, cross-category recommendations and segment sizes in one query
+        
+        Args:
+            user_id: User to build cross-category recommendations for
+            top_k: Number of recommendations to return
             
-            # Setup database
-            if not self.setup_database():
-                logger.error("Failed to setup database")
-                return {}
+        Returns:
+            Dict with 'revenue', 'recommendations' and 'users_by_segment', or None on failure
+        """
+        try:
+            from src.bq_utils import run_query
             
-            # Create product embeddings
-            if not self.create_product_embeddings():
-                logger.warning("Failed to create product embeddings - some features may not work")
+            query = self._build_business_insights_sql()
+            query_job = run_query(self._bq_client, query, user_id=user_id, top_k=top_k)
+            results = query_job.result()
             
-            # Run all demonstrations
-            results = {
-                'ai_engine': self.demonstrate_ai_engine(),
-                'marketing_engine': self.demonstrate_marketing_engine(),
-                'vector_search': self.demonstrate_vector_search(),
-                # Forecasting results intentionally disabled from export
-                'forecasting': {}
-            }
-
-            # Export results for user to view
-            export_paths = self._export_demo_results(results)
+            for row in results:
+                return {
+                    'revenue': [{'date': r['date'], 'revenue': r['revenue']} for r in row.revenue],
+                    'recommendations': [
+                        {**dict(r), 'similarity_score': 0.7, 'recommendation_type': 'cross_category'}
+                        for r in row.recs
+                    ],
+                    'users_by_segment': {s['user_segment']: s['user_count'] for s in row.segments}
+                }
             
-            logger.info("Complete demonstration finished successfully")
-            if export_paths:
-                logger.info(f"Demo results saved: JSON={export_paths.get('json_path')}, HTML={export_paths.get('html_path')}")
-                results["exports"] = export_paths
-            return results
+            return None
             
         except Exception as e:
-            logger.error(f"Error running complete demo: {e}")
-            return {}
+            logger.warning(f"Combined insights query failed, falling back to per-engine calls: {e}")
+            return None
     
+    def _build_business_insights_sql(self) -> str:
+        """SQL for _fetch_business_insight_inputs (binds @user_id, @top_k)"""
+        return f"""
+        WITH revenue AS (
+            SELECT 
+                DATE(order_date) as date,
+                SUM(total_amount) as revenue
+            FROM `{config.orders_table}`
+            WHERE DATE(order_date) >= DATE_SUB(CURRENT_DATE(), INTERVAL 365 DAY)
+            GROUP BY DATE(order_date)
+        ),
+        user_products AS (
+            SELECT 
+                p.product_id,
+                p.category,
+                COUNT(*) as interaction_count
+            FROM `{config.user_behavior_table}` ub
+            JOIN `{config.products_table}` p ON ub.product_id = p.product_id
+            WHERE ub.user_id = @user_id
+            AND ub.action_type IN ('view', 'add_to_cart', 'purchase')
+            GROUP BY p.product_id, p.category
+            ORDER BY interaction_count DESC
+            LIMIT 10
+        ),
+        recs AS (
+            SELECT 
+                p.product_id,
+                p.name,
+                p.description,
+                p.price,
+                p.category,
+                p.rating,
+                p.image_url,
+                p.stock_quantity
+            FROM `{config.products_table}` p
+            WHERE p.stock_quantity > 0
+            AND NOT EXISTS (
+                SELECT 1 FROM user_products up
+                WHERE up.category = p.category OR up.product_id = p.product_id
+            )
+        ),
+        segments AS (
+            SELECT user_segment, COUNT(*) as user_count
+            FROM `{config.users_table}`
+            GROUP BY user_segment
+        )
+        SELECT
+            ARRAY(SELECT AS STRUCT date, revenue FROM revenue ORDER BY date) AS revenue,
+            ARRAY(SELECT AS STRUCT * FROM recs ORDER BY rating DESC, price ASC LIMIT @top_k) AS recs,
+            ARRAY(SELECT AS STRUCT user_segment, user_count FROM segments ORDER BY user_count DESC) AS segments
+        """
+    
+    @log_and_swallow(dict)
     def generate_business_insights(self) -> Dict[str, Any]:
         """Generate comprehensive business insights"""
-        try:
-            logger.info("Generating business insights...")
-            
-            insights = {
-                'summary': 'E-Commerce Intelligence Insights Report',
-                'generated_at': str(pd.Timestamp.now()),
-                'recommendations': [],
-                'metrics': {},
-                'forecasts': {}
-            }
-            
-            # Get revenue forecast
+        logger.info("Generating business insights...")
+        
+        insights = {
+            'summary': 'E-Commerce Intelligence Insights Report',
+            'generated_at': datetime.now(timezone.utc).isoformat(),
+            'recommendations': [],
+            'metrics': {},
+            'forecasts': {}
+        }
+        
+        user_id = "USER001"
+        
+        # Fetch revenue history, recommendations and segments in a single round trip
+        insight_inputs = self._fetch_business_insight_inputs(user_id, top_k=5)
+        if insight_inputs is not None:
+            revenue_forecast = self.forecasting.forecast_revenue_from_history(
+                insight_inputs['revenue'], forecast_periods=30
+            )
+            recommendations = insight_inputs['recommendations']
+            insights['metrics']['users_by_segment'] = insight_inputs['users_by_segment']
+        else:
             revenue_forecast = self.forecasting.forecast_revenue(forecast_periods=30)
-            if revenue_forecast:
-                insights['forecasts']['revenue'] = revenue_forecast
-            
-            # Get top product recommendations
-            user_id = "USER001"
             recommendations = self.vector_search.find_cross_category_recommendations(user_id, top_k=5)
-            if recommendations:
-                insights['recommendations'].append({
-                    'type': 'product_recommendations',
-                    'data': recommendations
-                })
-            
-            # Generate marketing insights
-            marketing_insights = self.marketing_engine.generate_bulk_marketing_campaign("active", "recommendation")
-            if marketing_insights:
-                insights['recommendations'].append({
-                    'type': 'marketing_campaign',
-                    'data': marketing_insights
-                })
-            
-            logger.info("Business insights generated successfully")
-            return insights
-            
-        except Exception as e:
-            logger.error(f"Error generating business insights: {e}")
-            return {}
+        
+        # Get revenue forecast
+        if revenue_forecast:
+            insights['forecasts']['revenue'] = revenue_forecast
+        
+        # Get top product recommendations
+        if recommendations:
+            insights['recommendations'].append({
+                'type': 'product_recommendations',
+                'data': recommendations
+            })
+        
+        # Generate marketing insights
+        marketing_insights = self.marketing_engine.generate_bulk_marketing_campaign("active", "recommendation")
+        if marketing_insights:
+            insights['recommendations'].append({
+                'type': 'marketing_campaign',
+                'data': marketing_insights
+            })
+        
+        logger.info("Business insights generated successfully")
+        return insights
+
+# CLI command -> (components to build, handler, success message, failure message)
+COMMANDS: Dict[str, Tuple[Optional[Tuple[str, ...]], Callable[[ECommerceIntelligenceEngine], Any], str, str]] = {
+    "setup": (
+        ("data_ingestion",),
+        lambda engine: engine.setup_database(),
+        "Database setup completed successfully",
+        "Database setup failed",
+    ),
+    "embeddings": (
+        ("vector_search",),
+        lambda engine: engine.create_product_embeddings(),
+        "Product embeddings created successfully",
+        "Failed to create product embeddings",
+    ),
+    "demo": (
+        None,
+        lambda engine: engine.run_complete_demo(),
+        "Demo completed successfully\nResults available in the returned dictionary",
+        "Demo failed",
+    ),
+    "insights": (
+        ("forecasting", "vector_search", "marketing_engine"),
+        lambda engine: engine.generate_business_insights(),
+        "Business insights generated successfully\nInsights available in the returned dictionary",
+        "Failed to generate business insights",
+    ),
+}
 
 def main():
     """Main function to run the E-Commerce Intelligence Engine"""
     try:
-        # Initialize the engine
-        engine = ECommerceIntelligenceEngine()
-        
         # Check command line arguments
         if len(sys.argv) > 1:
             command = sys.argv[1].lower()
             
-            if command == "setup":
-                # Just setup the database
-                success = engine.setup_database()
-                if success:
-                    print("Database setup completed successfully")
-                else:
-                    print("Database setup failed")
-                    sys.exit(1)
-            
-            elif command == "embeddings":
-                # Create embeddings
-                success = engine.create_product_embeddings()
-                if success:
-                    print("Product embeddings created successfully")
-                else:
-                    print("Failed to create product embeddings")
-                    sys.exit(1)
-            
-            elif command == "demo":
-                # Run complete demo
-                results = engine.run_complete_demo()
-                if results:
-                    print("Demo completed successfully")
-                    print("Results available in the returned dictionary")
-                else:
-                    print("Demo failed")
-                    sys.exit(1)
-            
-            elif command == "insights":
-                # Generate business insights
-                insights = engine.generate_business_insights()
-                if insights:
-                    print("Business insights generated successfully")
-                    print("Insights available in the returned dictionary")
-                else:
-                    print("Failed to generate business insights")
-                    sys.exit(1)
+            entry = COMMANDS.get(command)
+            if entry is None:
+                print(f"Unknown command: {command}")
+                print(f"Available commands: {', '.join(COMMANDS)}")
+                sys.exit(1)
             
+            components, handler, success_message, failure_message = entry
+            engine = ECommerceIntelligenceEngine(components=components)
+            if handler(engine):
+                print(success_message)
             else:
-                print(f"Unknown command: {command}")
-                print("Available commands: setup, embeddings, demo, insights")
+                print(failure_message)
                 sys.exit(1)
         
         else:
+            # Initialize the engine
+            engine = ECommerceIntelligenceEngine()
+            
             # Default: run complete demo
             print("Running complete E-Commerce Intelligence demonstration...")
             results = engine.run_complete_demo()
@@ -4,23 +4,125 @@ Marketing Engine for Smart E-Commerce Intelligence
 Generates personalized marketing content using BigQuery AI functions.
 """
 
+import hashlib
+import json
 import logging
-from typing import Dict, List, Any, Optional
-from datetime import datetime, timedelta
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Any, Optional
+from datetime import datetime, timedelta, timezone
 from google.cloud import bigquery
 from config.bigquery_config import get_bigquery_client, config
 from config.settings import get_marketing_config
 from .ai_engine_simple import SimpleAIEngine as AIEngine
+from .bq_utils import fetch_rows, run_query
+from .query_cache import QueryCache
 
 logger = logging.getLogger(__name__)
 
+# Generated texts kept per distinct prompt (least recently used evicted first)
+PROMPT_CACHE_SIZE = 4096
+
+# Rows fetched per page when streaming campaign audiences
+ROW_PAGE_SIZE = 500
+
+# Per-user profile and preference lookups: users kept, and how long a cached lookup stays fresh
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL_SECONDS = 300
+
+# Job options shared by every marketing query: cacheable standard SQL, a cost cap
+# and a label attributing the spend to this component
+QUERY_JOB_OPTIONS = {
+    'use_query_cache': True,
+    'use_legacy_sql': False,
+    'priority': bigquery.QueryPriority.INTERACTIVE,
+    'maximum_bytes_billed': 1 << 30,
+    'labels': {'component': 'marketing_engine'}
+}
+
+# Prompt templates, filled with str.format so only the per-call values are substituted
+PERSONALIZED_EMAIL_PROMPT = """
+Create a personalized marketing email for a user with the following information:
+
+User Information:
+- Name: {first_name} {last_name}
+- Total Orders: {total_orders}
+- Average Order Value: ${avg_order_value:.2f}
+- Last Order: {last_order_date}{categories_line}
+
+Email Type: {email_type}
+
+Base Template: {template}
+
+Make the email personal, engaging, and relevant to this specific user's behavior and preferences.
+Include their name and reference their purchase history when appropriate.
+Keep it under 300 words with a clear call-to-action.
+"""
+
+RECOMMENDATIONS_EMAIL_PROMPT = """
+Create a personalized email recommending products to a user with the following preferences:
+
+User Preferences: {preferences}
+
+Recommended Products:
+{products}
+
+Make the email engaging, personal, and include specific reasons why these products would be perfect for this user.
+Keep it under 300 words and include a clear call-to-action.
+"""
+
+ABANDONED_CART_PROMPT = """
+Create an email to recover an abandoned cart with the following items:
+
+Cart Items:
+{items}
+
+Make the email urgent but friendly, highlight the value of the items, and include a special discount if appropriate.
+Keep it under 250 words with a clear call-to-action to complete the purchase.
+"""
+
+SEASONAL_EMAIL_PROMPT = """
+Create a seasonal {season} marketing email for a user with the following seasonal products:
+
+Seasonal Products:
+{products}
+
+Make it festive and seasonal, highlight the limited-time nature of the offers, and create urgency.
+Greet the reader with the placeholder {{name}} so it can be filled in for each recipient.
+Keep it under 300 words with clear seasonal messaging.
+"""
+
+GENERIC_EMAIL_PROMPT = """
+Create a generic marketing email using this template: {template}
+
+Make it engaging and professional, but generic enough to work for any customer.
+Keep it under 250 words with a clear call-to-action.
+"""
+
+_format_product_line = "- {name} (${price:.2f}, Rating: {rating:.1f})".format_map
+_format_cart_item_line = "- {name} (${price:.2f}, Qty: {quantity})".format_map
+
 class MarketingEngine:
     """Marketing engine for generating personalized content"""
     
-    def __init__(self):
-        self.client = get_bigquery_client()
-        self.ai_engine = AIEngine()
+    def __init__(self, client: Optional[bigquery.Client] = None):
+        self.client = client or get_bigquery_client()
+        self.ai_engine = AIEngine(client=self.client)
         self.config = get_marketing_config()
+        # Email templates escaped once for embedding in prompts (JSON string escaping, without the quotes)
+        self._safe_templates = {
+            email_type: json.dumps(template or "", ensure_ascii=False)[1:-1]
+            for email_type, template in self.config.get('email_templates', {}).items()
+        }
+        # Prompt digest -> generated text; guarded by a lock since campaigns generate from a thread pool
+        self._prompt_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._prompt_cache_lock = threading.Lock()
+        # Generic emails depend only on the email type, so each type is generated once
+        self._generic_email_cache: Dict[str, str] = {}
+        # User profiles and preferences change slowly, so repeat lookups skip BigQuery
+        self._user_data_cache = QueryCache(max_size=USER_CACHE_SIZE, ttl_seconds=USER_CACHE_TTL_SECONDS)
+        self._preferences_cache = QueryCache(max_size=USER_CACHE_SIZE, ttl_seconds=USER_CACHE_TTL_SECONDS)
     
     def generate_personalized_email(self, user_id: str, email_type: str = "recommendation") -> str:
         """
@@ -35,17 +137,25 @@ class MarketingEngine:
         """
         try:
             # Get user data
-            user_data = self._get_user_data(user_id)
+            # Welcome emails don't reference purchase history, so skip the orders lookup
+            user_data = self._get_user_data(user_id, need_orders=email_type != "welcome")
             if not user_data:
                 return self._generate_generic_email(email_type)
             
+            return self._generate_email_for_user_data(user_data, email_type)
+            
+        except Exception as e:
+            logger.error(f"Error generating personalized email: {e}")
+            return self._generate_generic_email(email_type)
+    
+    def _generate_email_for_user_data(self, user_data: Dict[str, Any], email_type: str) -> str:
+        """Generate a personalized email from already-fetched user data"""
+        try:
             # Build personalized prompt
             prompt = self._build_email_prompt(user_data, email_type)
             
             # Generate email using AI
-            email_content = self.ai_engine.generate_text(prompt)
-            
-            return email_content
+            return self._generate_text(prompt)
             
         except Exception as e:
             logger.error(f"Error generating personalized email: {e}")
@@ -63,25 +173,26 @@ class MarketingEngine:
             List of personalized emails for the segment
         """
         try:
-            # Get users in segment
-            users = self._get_users_by_segment(user_segment)
+            # Get users in segment together with their personalization data from one query
+            users = list(self._get_segment_user_data(user_segment))
             
-            campaign_emails = []
-            for user in users:
-                email_content = self.generate_personalized_email(
-                    user['user_id'], 
-                    campaign_type
-                )
-                
-                campaign_emails.append({
+            # Build every prompt first, then generate all emails in one batch request
+            prompts = [self._build_campaign_prompt(user, campaign_type) for user in users]
+            contents = self._generate_texts(prompts)
+            
+            # One timestamp for the whole campaign
+            generated_at = datetime.now(timezone.utc).isoformat()
+            
+            return [
+                {
                     'user_id': user['user_id'],
                     'email': user['email'],
                     'content': email_content,
                     'campaign_type': campaign_type,
-                    'generated_at': datetime.now().isoformat()
-                })
-            
-            return campaign_emails
+                    'generated_at': generated_at
+                }
+                for user, email_content in zip(users, contents)
+            ]
             
         except Exception as e:
             logger.error(f"Error generating bulk campaign: {e}")
@@ -98,29 +209,23 @@ class MarketingEngine:
             Email with product recommendations
         """
         try:
-            # Get user's recent behavior and preferences
-            user_preferences = self._get_user_preferences(user_id)
-            
-            # Get recommended products
-            recommended_products = self._get_recommended_products(user_id, limit=5)
+            # Get user's preferences and recommended products with both queries in flight at once
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                preferences_future = executor.submit(self._get_user_preferences, user_id)
+                products_future = executor.submit(self._get_recommended_products, user_id, limit=5)
+                user_preferences = preferences_future.result()
+                recommended_products = products_future.result()
             
             if not recommended_products:
                 return self._generate_generic_email("recommendation")
             
             # Build recommendation prompt
-            prompt = f"""
-            Create a personalized email recommending products to a user with the following preferences:
-            
-            User Preferences: {user_preferences}
+            prompt = RECOMMENDATIONS_EMAIL_PROMPT.format(
+                preferences=user_preferences,
+                products=self._format_products_for_prompt(recommended_products)
+            )
             
-            Recommended Products:
-            {self._format_products_for_prompt(recommended_products)}
-            
-            Make the email engaging, personal, and include specific reasons why these products would be perfect for this user.
-            Keep it under 300 words and include a clear call-to-action.
-            """
-            
-            return self.ai_engine.generate_text(prompt)
+            return self._generate_text(prompt)
             
         except Exception as e:
             logger.error(f"Error generating recommendations email: {e}")
@@ -144,17 +249,9 @@ class MarketingEngine:
                 return self._generate_generic_email("abandoned_cart")
             
             # Build abandoned cart prompt
-            prompt = f"""
-            Create an email to recover an abandoned cart with the following items:
-            
-            Cart Items:
-            {self._format_cart_items_for_prompt(cart_items)}
+            prompt = ABANDONED_CART_PROMPT.format(items=self._format_cart_items_for_prompt(cart_items))
             
-            Make the email urgent but friendly, highlight the value of the items, and include a special discount if appropriate.
-            Keep it under 250 words with a clear call-to-action to complete the purchase.
-            """
-            
-            return self.ai_engine.generate_text(prompt)
+            return self._generate_text(prompt)
             
         except Exception as e:
             logger.error(f"Error generating abandoned cart email: {e}")
@@ -173,64 +270,157 @@ class MarketingEngine:
         """
         try:
             # Get seasonal products
-            seasonal_products = self._get_seasonal_products(season)
+            # Only the top three products go into the prompt
+            seasonal_products = self._get_seasonal_products(season, limit=3)
+            
+            # The prompt only depends on the season and its products, so generate the email once
+            prompt = SEASONAL_EMAIL_PROMPT.format(
+                season=season,
+                products=self._format_products_for_prompt(seasonal_products)
+            )
+            email_content = self._generate_text(prompt)
             
             # Get target users
             users = self._get_users_by_segment(user_segment)
             
-            campaign_emails = []
-            for user in users:
-                prompt = f"""
-                Create a seasonal {season} marketing email for a user with the following seasonal products:
-                
-                Seasonal Products:
-                {self._format_products_for_prompt(seasonal_products[:3])}
-                
-                Make it festive and seasonal, highlight the limited-time nature of the offers, and create urgency.
-                Keep it under 300 words with clear seasonal messaging.
-                """
-                
-                email_content = self.ai_engine.generate_text(prompt)
-                
-                campaign_emails.append({
+            campaign_type = f'seasonal_{season}'
+            generated_at = datetime.now(timezone.utc).isoformat()
+            
+            return [
+                {
                     'user_id': user['user_id'],
                     'email': user['email'],
-                    'content': email_content,
-                    'campaign_type': f'seasonal_{season}',
-                    'generated_at': datetime.now().isoformat()
-                })
-            
-            return campaign_emails
+                    'content': self._render_with_name(email_content, user.get('first_name') or 'Valued Customer'),
+                    'campaign_type': campaign_type,
+                    'generated_at': generated_at
+                }
+                for user in users
+            ]
             
         except Exception as e:
             logger.error(f"Error generating seasonal campaign: {e}")
             raise
     
-    def _get_user_data(self, user_id: str) -> Optional[Dict[str, Any]]:
-        """Get user data for personalization"""
+    def save_campaign(self, campaign_emails: List[Dict[str, Any]]) -> bool:
+        """
+        Append generated campaign emails to the campaigns table with one load job
+        
+        Args:
+            campaign_emails: Entries as returned by generate_bulk_marketing_campaign
+                or generate_seasonal_campaign
+            
+        Returns:
+            True if the entries were stored, False otherwise
+        """
+        if not campaign_emails:
+            return True
+        
         try:
-            query = f"""
-            SELECT 
-                u.user_id,
-                u.email,
-                u.first_name,
-                u.last_name,
-                u.demographics,
-                u.registration_date,
-                COUNT(o.order_id) as total_orders,
-                AVG(o.total_amount) as avg_order_value,
-                MAX(o.order_date) as last_order_date
-            FROM `{config.users_table}` u
-            LEFT JOIN `{config.orders_table}` o ON u.user_id = o.user_id
-            WHERE u.user_id = '{user_id}'
-            GROUP BY u.user_id, u.email, u.first_name, u.last_name, u.demographics, u.registration_date
-            """
+            schema = [
+                bigquery.SchemaField("user_id", "STRING", mode="REQUIRED"),
+                bigquery.SchemaField("email", "STRING"),
+                bigquery.SchemaField("content", "STRING"),
+                bigquery.SchemaField("campaign_type", "STRING"),
+                bigquery.SchemaField("generated_at", "TIMESTAMP")
+            ]
+            self.client.create_table(bigquery.Table(config.campaigns_table, schema=schema), exists_ok=True)
+            
+            job_config = bigquery.LoadJobConfig(
+                schema=schema,
+                source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+                write_disposition=bigquery.WriteDisposition.WRITE_APPEND
+            )
+            job = self.client.load_table_from_json(campaign_emails, config.campaigns_table, job_config=job_config)
+            job.result()
+            
+            logger.info(f"Saved {len(campaign_emails)} campaign emails to {config.campaigns_table}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error saving campaign: {e}")
+            return False
+    
+    def _generate_text(self, prompt: str) -> str:
+        """Generate text for a prompt, replaying the stored result for prompts seen before"""
+        return self._generate_texts([prompt])[0]
+    
+    def _generate_texts(self, prompts: List[str]) -> List[str]:
+        """
+        Generate text for each prompt, replaying stored results for prompts seen before
+        
+        Distinct uncached prompts are generated once each, in a single batch
+        request when there is more than one.
+        
+        Args:
+            prompts: Prompts to generate text for
+            
+        Returns:
+            Generated texts, in the same order as prompts
+        """
+        keys = [hashlib.blake2b(prompt.encode(), digest_size=16).hexdigest() for prompt in prompts]
+        texts: Dict[str, str] = {}
+        with self._prompt_cache_lock:
+            for key in keys:
+                cached = self._prompt_cache.get(key)
+                if cached is not None:
+                    self._prompt_cache.move_to_end(key)
+                    texts[key] = cached
+        
+        misses = {key: prompt for key, prompt in zip(keys, prompts) if key not in texts}
+        if misses:
+            if len(misses) == 1:
+                generated = [self.ai_engine.generate_text(next(iter(misses.values())))]
+            else:
+                generated = self.ai_engine.batch_generate_text(list(misses.values()))
+            
+            with self._prompt_cache_lock:
+                for key, result in zip(misses, generated):
+                    texts[key] = result
+                    # Only keep non-empty results so failures are retried
+                    if result:
+                        self._prompt_cache[key] = result
+                        if len(self._prompt_cache) > PROMPT_CACHE_SIZE:
+                            self._prompt_cache.popitem(last=False)
+        
+        return [texts[key] for key in keys]
+    
+    def _iter_rows(self, query_job: bigquery.QueryJob) -> Iterator[Dict[str, Any]]:
+        """Yield a query's rows as dicts keyed by column name, one page at a time"""
+        for row in query_job.result(page_size=ROW_PAGE_SIZE):
+            yield dict(row.items())
+    
+    def _get_user_data(self, user_id: str, need_orders: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Get user data for personalization
+        
+        Args:
+            user_id: User ID
+            need_orders: Whether to include order aggregates; without them only the users table is read
+            
+        Returns:
+            User data, or None if the user does not exist
+        """
+        cached = self._user_data_cache.get((user_id, need_orders))
+        if cached is not None:
+            return dict(cached)
+        
+        try:
+            if not need_orders:
+                query = self._build_user_profile_sql()
+                
+                query_job = run_query(self.client, query, QUERY_JOB_OPTIONS, user_id=user_id)
+                user_data = next(self._iter_rows(query_job), None)
+                self._user_data_cache.put((user_id, need_orders), user_data)
+                return dict(user_data) if user_data is not None else None
+            
+            # Aggregate the user's orders before joining so the GROUP BY sees at most one user
+            query = self._build_user_data_sql()
             
-            query_job = self.client.query(query)
+            query_job = run_query(self.client, query, QUERY_JOB_OPTIONS, user_id=user_id)
             results = query_job.result()
             
             for row in results:
-                return {
+                user_data = {
                     'user_id': row.user_id,
                     'email': row.email,
                     'first_name': row.first_name,
@@ -241,6 +431,8 @@ class MarketingEngine:
                     'avg_order_value': row.avg_order_value,
                     'last_order_date': row.last_order_date
                 }
+                self._user_data_cache.put((user_id, need_orders), user_data)
+                return dict(user_data)
             
             return None
             
@@ -248,23 +440,42 @@ class MarketingEngine:
             logger.error(f"Error getting user data: {e}")
             return None
     
+    def _get_segment_user_data(self, segment: str) -> Iterator[Dict[str, Any]]:
+        """Get personalization data (as returned by _get_user_data, plus top_categories) for every user in a segment"""
+        try:
+            # One statement returns each user's profile, order aggregates and top viewed categories
+            query = self._build_segment_user_data_sql(segment)
+            
+            # Only bind @segment when the query references it
+            params = {} if segment == "all" else {'segment': segment}
+            query_job = run_query(self.client, query, QUERY_JOB_OPTIONS, **params)
+            
+            for row in query_job.result(page_size=ROW_PAGE_SIZE):
+                yield {
+                    'user_id': row.user_id,
+                    'email': row.email,
+                    'first_name': row.first_name,
+                    'last_name': row.last_name,
+                    'demographics': row.demographics,
+                    'registration_date': row.registration_date,
+                    'total_orders': row.total_orders,
+                    'avg_order_value': row.avg_order_value,
+                    'last_order_date': row.last_order_date,
+                    'top_categories': [dict(category) for category in row.top_categories or []]
+                }
+            
+        except Exception as e:
+            logger.error(f"Error getting segment user data: {e}")
+    
     def _get_user_preferences(self, user_id: str) -> Dict[str, Any]:
         """Get user preferences and behavior patterns"""
+        cached = self._preferences_cache.get(user_id)
+        if cached is not None:
+            return {**cached, 'top_categories': list(cached['top_categories'])}
+        
         try:
-            query = f"""
-            SELECT 
-                p.category,
-                COUNT(*) as view_count,
-                AVG(p.rating) as avg_rating
-            FROM `{config.user_behavior_table}` ub
-            JOIN `{config.products_table}` p ON ub.product_id = p.product_id
-            WHERE ub.user_id = '{user_id}'
-            GROUP BY p.category
-            ORDER BY view_count DESC
-            LIMIT 5
-            """
-            
-            query_job = self.client.query(query)
+            query = self._build_user_preferences_sql()
+            query_job = run_query(self.client, query, QUERY_JOB_OPTIONS, user_id=user_id)
             results = query_job.result()
             
             preferences = {
@@ -280,7 +491,8 @@ class MarketingEngine:
                     'avg_rating': row.avg_rating
                 })
             
-            return preferences
+            self._preferences_cache.put(user_id, preferences)
+            return {**preferences, 'top_categories': list(preferences['top_categories'])}
             
         except Exception as e:
             logger.error(f"Error getting user preferences: {e}")
@@ -289,37 +501,9 @@ class MarketingEngine:
     def _get_recommended_products(self, user_id: str, limit: int = 5) -> List[Dict[str, Any]]:
         """Get recommended products for user"""
         try:
-            query = f"""
-            SELECT 
-                p.product_id,
-                p.name,
-                p.description,
-                p.price,
-                p.category,
-                p.rating,
-                p.image_url
-            FROM `{config.products_table}` p
-            WHERE p.stock_quantity > 0
-            ORDER BY p.rating DESC, p.price ASC
-            LIMIT {limit}
-            """
-            
-            query_job = self.client.query(query)
-            results = query_job.result()
-            
-            products = []
-            for row in results:
-                products.append({
-                    'product_id': row.product_id,
-                    'name': row.name,
-                    'description': row.description,
-                    'price': row.price,
-                    'category': row.category,
-                    'rating': row.rating,
-                    'image_url': row.image_url
-                })
-            
-            return products
+            query = self._build_recommended_products_sql()
+            query_job = run_query(self.client, query, QUERY_JOB_OPTIONS, limit=limit)
+            return fetch_rows(query_job)
             
         except Exception as e:
             logger.error(f"Error getting recommended products: {e}")
@@ -328,22 +512,8 @@ class MarketingEngine:
     def _get_abandoned_cart_items(self, user_id: str) -> List[Dict[str, Any]]:
         """Get abandoned cart items for user"""
         try:
-            query = f"""
-            SELECT 
-                p.product_id,
-                p.name,
-                p.price,
-                p.image_url,
-                c.quantity
-            FROM `{config.user_behavior_table}` c
-            JOIN `{config.products_table}` p ON c.product_id = p.product_id
-            WHERE c.user_id = '{user_id}'
-            AND c.action_type = 'add_to_cart'
-            AND c.timestamp > TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 7 DAY)
-            AND p.stock_quantity > 0
-            """
-            
-            query_job = self.client.query(query)
+            query = self._build_abandoned_cart_sql()
+            query_job = run_query(self.client, query, QUERY_JOB_OPTIONS, user_id=user_id)
             results = query_job.result()
             
             cart_items = []
@@ -362,133 +532,247 @@ class MarketingEngine:
             logger.error(f"Error getting abandoned cart items: {e}")
             return []
     
-    def _get_users_by_segment(self, segment: str) -> List[Dict[str, Any]]:
+    def _get_users_by_segment(self, segment: str) -> Iterator[Dict[str, Any]]:
         """Get users by segment"""
         try:
-            if segment == "all":
-                query = f"""
-                SELECT user_id, email, first_name, last_name
-                FROM `{config.users_table}`
-                LIMIT 100
-                """
-            else:
-                query = f"""
-                SELECT user_id, email, first_name, last_name
-                FROM `{config.users_table}`
-                WHERE user_segment = '{segment}'
-                LIMIT 100
-                """
-            
-            query_job = self.client.query(query)
-            results = query_job.result()
+            query = self._build_users_by_segment_sql(segment)
             
-            users = []
-            for row in results:
-                users.append({
-                    'user_id': row.user_id,
-                    'email': row.email,
-                    'first_name': row.first_name,
-                    'last_name': row.last_name
-                })
-            
-            return users
+            # Only bind @segment when the query references it
+            params = {} if segment == "all" else {'segment': segment}
+            query_job = run_query(self.client, query, QUERY_JOB_OPTIONS, **params)
+            yield from self._iter_rows(query_job)
             
         except Exception as e:
             logger.error(f"Error getting users by segment: {e}")
-            return []
     
-    def _get_seasonal_products(self, season: str) -> List[Dict[str, Any]]:
+    def _get_seasonal_products(self, season: str, limit: int = 10) -> List[Dict[str, Any]]:
         """Get seasonal products"""
         try:
-            query = f"""
-            SELECT 
-                product_id,
-                name,
-                description,
-                price,
-                category,
-                rating
-            FROM `{config.products_table}`
-            WHERE LOWER(description) LIKE '%{season}%'
-            OR LOWER(category) LIKE '%{season}%'
-            AND stock_quantity > 0
-            ORDER BY rating DESC
-            LIMIT 10
-            """
-            
-            query_job = self.client.query(query)
-            results = query_job.result()
-            
-            products = []
-            for row in results:
-                products.append({
-                    'product_id': row.product_id,
-                    'name': row.name,
-                    'description': row.description,
-                    'price': row.price,
-                    'category': row.category,
-                    'rating': row.rating
-                })
+            # Known seasons match the precomputed tags; anything else falls back to a text scan
+            query = self._build_seasonal_products_sql(tagged=season.lower() in self.config['seasonal_tags'])
             
-            return products
+            query_job = run_query(self.client, query, QUERY_JOB_OPTIONS, season=season, limit=limit)
+            return fetch_rows(query_job)
             
         except Exception as e:
             logger.error(f"Error getting seasonal products: {e}")
             return []
     
+    def _build_user_preferences_sql(self) -> str:
+        """SQL for _get_user_preferences (binds @user_id)"""
+        return f"""
+        SELECT 
+            p.category,
+            COUNT(*) as view_count,
+            AVG(p.rating) as avg_rating
+        FROM `{config.user_behavior_table}` ub
+        JOIN `{config.products_table}` p ON ub.product_id = p.product_id
+        WHERE ub.user_id = @user_id
+        GROUP BY p.category
+        ORDER BY view_count DESC
+        LIMIT 5
+        """
+    
+    def _build_recommended_products_sql(self) -> str:
+        """SQL for _get_recommended_products (binds @limit)"""
+        return f"""
+        SELECT 
+            p.product_id,
+            p.name,
+            p.description,
+            p.price,
+            p.category,
+            p.rating,
+            p.image_url
+        FROM `{config.in_stock_products_view}` p
+        ORDER BY p.rating DESC, p.price ASC
+        LIMIT @limit
+        """
+    
+    def _build_abandoned_cart_sql(self) -> str:
+        """SQL for _get_abandoned_cart_items (binds @user_id)"""
+        return f"""
+        SELECT 
+            p.product_id,
+            p.name,
+            p.price,
+            p.image_url,
+            c.quantity
+        FROM `{config.user_behavior_table}` c
+        JOIN `{config.in_stock_products_view}` p ON c.product_id = p.product_id
+        WHERE c.user_id = @user_id
+        AND c.action_type = 'add_to_cart'
+        AND c.timestamp > TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 7 DAY)
+        """
+    
+    def _build_user_profile_sql(self) -> str:
+        """SQL for _get_user_data without order aggregates (binds @user_id)"""
+        return f"""
+        SELECT user_id, email, first_name, last_name, demographics, registration_date
+        FROM `{config.users_table}`
+        WHERE user_id = @user_id
+        """
+    
+    def _build_user_data_sql(self) -> str:
+        """SQL for _get_user_data (binds @user_id)"""
+        return f"""
+        SELECT 
+            u.user_id,
+            u.email,
+            u.first_name,
+            u.last_name,
+            u.demographics,
+            u.registration_date,
+            IFNULL(o.total_orders, 0) as total_orders,
+            o.avg_order_value,
+            o.last_order_date
+        FROM `{config.users_table}` u
+        LEFT JOIN (
+            SELECT 
+                user_id,
+                COUNT(order_id) as total_orders,
+                AVG(total_amount) as avg_order_value,
+                MAX(order_date) as last_order_date
+            FROM `{config.orders_table}`
+            WHERE user_id = @user_id
+            GROUP BY user_id
+        ) o ON u.user_id = o.user_id
+        WHERE u.user_id = @user_id
+        """
+    
+    def _build_segment_user_data_sql(self, segment: str) -> str:
+        """SQL for _get_segment_user_data (binds @segment unless segment is "all")"""
+        segment_filter = "" if segment == "all" else "WHERE user_segment = @segment"
+        return f"""
+        WITH segment_users AS (
+            SELECT user_id, email, first_name, last_name, demographics, registration_date
+            FROM `{config.segment_users_view}`
+            {segment_filter}
+            LIMIT 100
+        ),
+        order_stats AS (
+            SELECT 
+                o.user_id,
+                COUNT(o.order_id) as total_orders,
+                AVG(o.total_amount) as avg_order_value,
+                MAX(o.order_date) as last_order_date
+            FROM `{config.orders_table}` o
+            JOIN segment_users su ON o.user_id = su.user_id
+            GROUP BY o.user_id
+        ),
+        category_views AS (
+            SELECT 
+                ub.user_id,
+                p.category,
+                COUNT(*) as view_count,
+                AVG(p.rating) as avg_rating
+            FROM `{config.user_behavior_table}` ub
+            JOIN segment_users su ON ub.user_id = su.user_id
+            JOIN `{config.products_table}` p ON ub.product_id = p.product_id
+            GROUP BY ub.user_id, p.category
+        ),
+        top_categories AS (
+            SELECT 
+                user_id,
+                ARRAY_AGG(STRUCT(category, view_count, avg_rating) ORDER BY view_count DESC LIMIT 5) as top_categories
+            FROM category_views
+            GROUP BY user_id
+        )
+        SELECT 
+            u.user_id,
+            u.email,
+            u.first_name,
+            u.last_name,
+            u.demographics,
+            u.registration_date,
+            IFNULL(o.total_orders, 0) as total_orders,
+            o.avg_order_value,
+            o.last_order_date,
+            c.top_categories
+        FROM segment_users u
+        LEFT JOIN order_stats o ON u.user_id = o.user_id
+        LEFT JOIN top_categories c ON u.user_id = c.user_id
+        """
+    
+    def _build_users_by_segment_sql(self, segment: str) -> str:
+        """SQL for _get_users_by_segment (binds @segment unless segment is "all")"""
+        segment_filter = "" if segment == "all" else "WHERE user_segment = @segment"
+        return f"""
+        SELECT user_id, email, first_name, last_name
+        FROM `{config.segment_users_view}`
+        {segment_filter}
+        LIMIT 100
+        """
+    
+    def _build_seasonal_products_sql(self, tagged: bool) -> str:
+        """SQL for _get_seasonal_products (binds @season, @limit); tagged matches the precomputed season tags"""
+        if tagged:
+            season_filter = "LOWER(@season) IN UNNEST(seasonal_tags)"
+        else:
+            season_filter = """(LOWER(description) LIKE CONCAT('%', LOWER(@season), '%')
+               OR LOWER(category) LIKE CONCAT('%', LOWER(@season), '%'))"""
+        return f"""
+        SELECT 
+            product_id,
+            name,
+            description,
+            price,
+            category,
+            rating
+        FROM `{config.in_stock_products_view}`
+        WHERE {season_filter}
+        ORDER BY rating DESC
+        LIMIT @limit
+        """
+    
     def _build_email_prompt(self, user_data: Dict[str, Any], email_type: str) -> str:
         """Build personalized email prompt"""
-        template = self.config['email_templates'].get(email_type, "")
-        
-        # Escape special characters in the template
-        safe_template = template.replace("'", "''").replace('"', '""') if template else ""
-        
-        prompt = f"""
-        Create a personalized marketing email for a user with the following information:
-        
-        User Information:
-        - Name: {user_data.get('first_name', 'Valued Customer')} {user_data.get('last_name', '')}
-        - Total Orders: {user_data.get('total_orders', 0)}
-        - Average Order Value: ${user_data.get('avg_order_value', 0):.2f}
-        - Last Order: {user_data.get('last_order_date', 'Never')}
-        
-        Email Type: {email_type}
+        safe_template = self._safe_templates.get(email_type, "")
         
-        Base Template: {safe_template}
+        # Browsing preferences are only present when fetched alongside the user (bulk campaigns)
+        top_categories = ", ".join(c['category'] for c in user_data.get('top_categories') or [])
+        categories_line = f"\n- Top Categories: {top_categories}" if top_categories else ""
         
-        Make the email personal, engaging, and relevant to this specific user's behavior and preferences.
-        Include their name and reference their purchase history when appropriate.
-        Keep it under 300 words with a clear call-to-action.
-        """
-        
-        return prompt
+        return PERSONALIZED_EMAIL_PROMPT.format(
+            first_name=user_data.get('first_name', 'Valued Customer'),
+            last_name=user_data.get('last_name', ''),
+            total_orders=user_data.get('total_orders', 0),
+            avg_order_value=user_data.get('avg_order_value', 0),
+            last_order_date=user_data.get('last_order_date', 'Never'),
+            categories_line=categories_line,
+            email_type=email_type,
+            template=safe_template
+        )
+    
+    def _build_campaign_prompt(self, user_data: Dict[str, Any], email_type: str) -> str:
+        """Build a user's campaign prompt, falling back to the generic prompt if personalization fails"""
+        try:
+            return self._build_email_prompt(user_data, email_type)
+        except Exception as e:
+            logger.error(f"Error building prompt for user {user_data.get('user_id')}: {e}")
+            return self._build_generic_email_prompt(email_type)
+    
+    def _build_generic_email_prompt(self, email_type: str) -> str:
+        """Build generic email prompt"""
+        return GENERIC_EMAIL_PROMPT.format(template=self._safe_templates.get(email_type, ""))
     
     def _generate_generic_email(self, email_type: str) -> str:
         """Generate generic email when personalization fails"""
-        template = self.config['email_templates'].get(email_type, "")
-        
-        # Escape special characters in the template
-        safe_template = template.replace("'", "''").replace('"', '""') if template else ""
-        
-        prompt = f"""
-        Create a generic marketing email using this template: {safe_template}
-        
-        Make it engaging and professional, but generic enough to work for any customer.
-        Keep it under 250 words with a clear call-to-action.
-        """
-        
-        return self.ai_engine.generate_text(prompt)
+        email = self._generic_email_cache.get(email_type)
+        if email is None:
+            email = self._generate_text(self._build_generic_email_prompt(email_type))
+            if email:
+                self._generic_email_cache[email_type] = email
+        return email
+    
+    def _render_with_name(self, body: str, first_name: str) -> str:
+        """Fill the {name} placeholder of a shared email body for one recipient"""
+        return body.replace("{name}", first_name)
     
     def _format_products_for_prompt(self, products: List[Dict[str, Any]]) -> str:
         """Format products for AI prompt"""
-        formatted = []
-        for product in products:
-            formatted.append(f"- {product['name']} (${product['price']:.2f}, Rating: {product['rating']:.1f})")
-        return "\n".join(formatted)
+        return "\n".join(map(_format_product_line, products))
     
     def _format_cart_items_for_prompt(self, cart_items: List[Dict[str, Any]]) -> str:
         """Format cart items for AI prompt"""
-        formatted = []
-        for item in cart_items:
-            formatted.append(f"- {item['name']} (${item['price']:.2f}, Qty: {item['quantity']})")
-        return "\n".join(formatted)
+        return "\n".join(map(_format_cart_item_line, cart_items))
@@ -0,0 +1,114 @@
+"""
+Query Cache for Smart E-Commerce Intelligence
+
+Keeps results of small per-key BigQuery lookups in process so repeated
+lookups of the same key skip the query entirely.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+DEFAULT_MAX_SIZE = 2048
+DEFAULT_TTL_SECONDS = 300
+PROTECTED_FRACTION = 0.8
+
+class QueryCache:
+    """
+    Thread-safe segmented LRU (SLRU) cache with per-entry expiry
+    
+    New entries land in a probationary segment; a second hit promotes them to the
+    protected segment, so one-off keys cannot flush the frequently used ones.
+    """
+    
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._protected_size = max(1, int(max_size * PROTECTED_FRACTION))
+        # key -> (expires_at, value), least recently used first
+        self._probation: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._protected: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+    
+    def __len__(self) -> int:
+        return len(self._probation) + len(self._protected)
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value for key, or None if it is missing or expired"""
+        now = time.monotonic()
+        with self._lock:
+            if key in self._protected:
+                expires_at, value = self._protected[key]
+                if expires_at > now:
+                    self._protected.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._protected[key]
+            elif key in self._probation:
+                expires_at, value = self._probation.pop(key)
+                if expires_at > now:
+                    self._promote(key, (expires_at, value))
+                    self._hits += 1
+                    return value
+            
+            self._misses += 1
+            return None
+    
+    def put(self, key: Hashable, value: Any):
+        """Store a value (None is never cached, so failed lookups are retried)"""
+        if value is None:
+            return
+        
+        entry = (time.monotonic() + self.ttl_seconds, value)
+        with self._lock:
+            if key in self._protected:
+                self._protected[key] = entry
+                self._protected.move_to_end(key)
+                return
+            
+            self._probation.pop(key, None)
+            self._probation[key] = entry
+            self._evict()
+    
+    def invalidate(self, key: Hashable):
+        """Drop key from the cache"""
+        with self._lock:
+            self._probation.pop(key, None)
+            self._protected.pop(key, None)
+    
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._probation.clear()
+            self._protected.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': len(self),
+                'max_size': self.max_size,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'evictions': self._evictions
+            }
+    
+    def _promote(self, key: Hashable, entry: tuple):
+        """Move an entry into the protected segment, demoting its LRU entry if full"""
+        self._protected[key] = entry
+        if len(self._protected) > self._protected_size:
+            demoted_key, demoted_entry = self._protected.popitem(last=False)
+            self._probation[demoted_key] = demoted_entry
+            self._evict()
+    
+    def _evict(self):
+        """Evict least recently used probationary entries until within max_size"""
+        while len(self) > self.max_size and self._probation:
+            self._probation.popitem(last=False)
+            self._evictions += 1
@@ -0,0 +1,80 @@
+"""
+Reranking for Smart E-Commerce Intelligence
+
+Exact cosine top-k of a query vector against a float32 matrix, compiled with
+numba when it is installed.
+"""
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # optional: top-k falls back to a NumPy matrix product and partition
+    numba = None
+
+def _cosine_topk_numpy(query: np.ndarray, matrix: np.ndarray, k: int) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    scores = np.divide(matrix @ query, norms, out=np.full(len(matrix), -np.inf, dtype=np.float32), where=norms > 0)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind='stable')]
+
+if numba is not None:
+    # contract/reassoc only: full fastmath would assume no infinities and break the -inf sentinels
+    @numba.njit(parallel=True, fastmath={'contract', 'reassoc'}, cache=True)
+    def _cosine_topk_numba(query, matrix, k):
+        n, d = matrix.shape
+        query_norm = np.sqrt(np.dot(query, query))
+        
+        # Score every row in parallel: one fused dot/norm pass over contiguous memory
+        scores = np.empty(n, dtype=np.float32)
+        for i in numba.prange(n):
+            dot = np.float32(0.0)
+            norm = np.float32(0.0)
+            for j in range(d):
+                dot += matrix[i, j] * query[j]
+                norm += matrix[i, j] * matrix[i, j]
+            denominator = np.sqrt(norm) * query_norm
+            scores[i] = dot / denominator if denominator > 0 else -np.inf
+        
+        # Insertion sort into a k-slot buffer, best first
+        best = np.full(k, -1, dtype=np.int64)
+        best_scores = np.full(k, -np.inf, dtype=np.float32)
+        filled = 0
+        for i in range(n):
+            score = scores[i]
+            if filled == k and score <= best_scores[k - 1]:
+                continue
+            slot = filled if filled < k else k - 1
+            while slot > 0 and best_scores[slot - 1] < score:
+                best_scores[slot] = best_scores[slot - 1]
+                best[slot] = best[slot - 1]
+                slot -= 1
+            best_scores[slot] = score
+            best[slot] = i
+            if filled < k:
+                filled += 1
+        return best
+else:
+    _cosine_topk_numba = None
+
+def cosine_topk(query: np.ndarray, matrix: np.ndarray, k: int) -> np.ndarray:
+    """
+    Rows of matrix most cosine-similar to query
+    
+    Args:
+        query: Query vector of shape (d,)
+        matrix: Candidate vectors of shape (N, d)
+        k: Number of rows to return
+        
+    Returns:
+        Row indices of the k best matches, best first (fewer if N < k)
+    """
+    k = min(k, len(matrix))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    
+    query = np.ascontiguousarray(query, dtype=np.float32)
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    if _cosine_topk_numba is not None:
+        return _cosine_topk_numba(query, matrix, k).astype(np.intp)
+    return _cosine_topk_numpy(query, matrix, k)
@@ -0,0 +1,241 @@
+"""
+Semantic Cache for Smart E-Commerce Intelligence
+
+Caches results of text-driven calls keyed by the text's embedding, so exact
+repeats and near-duplicate inputs are served without hitting the backend.
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .embedding_cache import quantise_int8
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CAPACITY = 1024
+DEFAULT_THRESHOLD = 0.95
+
+# Cached rows widened to float32 at a time during a near-hit scan
+SCORE_BLOCK_ROWS = 1024
+
+class SemanticCache:
+    """Thread-safe LRU cache with exact-key hits, cosine-similarity near hits and optional expiry"""
+    
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, threshold: float = DEFAULT_THRESHOLD,
+                 ttl_seconds: Optional[float] = None):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        # (scope, key) -> (slot in self._vectors, value), least recently used first
+        self._entries: "OrderedDict[Tuple[str, Any], Tuple[int, Any]]" = OrderedDict()
+        # Unit vectors per slot as int8 codes times a per-slot scale (a quarter of the float32 size)
+        self._vectors: Optional[np.ndarray] = None
+        self._scales = np.zeros(capacity, dtype=np.float32)
+        self._slot_entries: List[Optional[Tuple[str, Any]]] = [None] * capacity
+        # Scope id per slot (-1 = empty) so near-hit lookups can mask other scopes in one step
+        self._scope_ids: Dict[str, int] = {}
+        self._slot_scopes = np.full(capacity, -1, dtype=np.int32)
+        # Wall-clock expiry per slot (inf = never), so entries persisted by save() age correctly
+        self._slot_expiry = np.full(capacity, np.inf)
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    @staticmethod
+    def _normalise(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+    
+    @staticmethod
+    def _embedding_key(unit: np.ndarray) -> bytes:
+        """Default exact-match key: the int8-quantised unit vector"""
+        return np.rint(unit * 127).astype(np.int8).tobytes()
+    
+    def get(self, embedding: List[float], key: Any = None, scope: str = '') -> Optional[Any]:
+        """
+        Look up a cached value
+        
+        Args:
+            embedding: Embedding of the input text
+            key: Exact-match key (defaults to the quantised embedding)
+            scope: Only entries stored under the same scope can match
+        
+        Returns:
+            The cached value, or None on a miss
+        """
+        unit = self._normalise(embedding)
+        entry_id = (scope, key if key is not None else self._embedding_key(unit))
+        
+        now = time.time()
+        
+        with self._lock:
+            if not self._entries:
+                return None
+            
+            if entry_id not in self._entries or self._slot_expiry[self._entries[entry_id][0]] <= now:
+                # Matrix-vector product against every cached embedding, widening
+                # the int8 codes a block at a time and applying the scales after
+                similarities = np.empty(self.capacity, dtype=np.float32)
+                for start in range(0, self.capacity, SCORE_BLOCK_ROWS):
+                    block = self._vectors[start:start + SCORE_BLOCK_ROWS]
+                    np.matmul(block.astype(np.float32), unit, out=similarities[start:start + len(block)])
+                similarities *= self._scales
+                similarities[self._slot_scopes != self._scope_ids.get(scope, -2)] = -np.inf
+                similarities[self._slot_expiry <= now] = -np.inf
+                
+                slot = int(np.argmax(similarities))
+                if similarities[slot] < self.threshold:
+                    return None
+                entry_id = self._slot_entries[slot]
+            
+            self._entries.move_to_end(entry_id)
+            return self._entries[entry_id][1]
+    
+    def put(self, embedding: List[float], value: Any, key: Any = None, scope: str = '',
+            ttl_seconds: Optional[float] = None):
+        """Store a value, evicting the least recently used entry when full (ttl_seconds overrides the cache's)"""
+        unit = self._normalise(embedding)
+        entry_id = (scope, key if key is not None else self._embedding_key(unit))
+        
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.capacity, unit.shape[0]), dtype=np.int8)
+            
+            if entry_id in self._entries:
+                slot = self._entries.pop(entry_id)[0]
+            elif len(self._entries) >= self.capacity:
+                _, (slot, _) = self._entries.popitem(last=False)
+            else:
+                slot = len(self._entries)
+            
+            self._vectors[slot], self._scales[slot] = quantise_int8(unit)
+            self._slot_scopes[slot] = self._scope_ids.setdefault(scope, len(self._scope_ids))
+            ttl_seconds = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+            self._slot_expiry[slot] = time.time() + ttl_seconds if ttl_seconds is not None else np.inf
+            self._slot_entries[slot] = entry_id
+            self._entries[entry_id] = (slot, value)
+    
+    def save(self, path: str):
+        """
+        Write the cache to path as an .npz of arrays plus JSON entries (best effort)
+        
+        Nothing is pickled, so loading a shared or tampered file cannot run code.
+        Entries whose key or value is not JSON-serialisable are left out.
+        """
+        try:
+            with self._lock:
+                slots, entries = [], []
+                for (scope, key), (slot, value) in self._entries.items():
+                    try:
+                        entries.append(json.dumps([scope, _encode_key(key), value]))
+                    except (TypeError, ValueError):
+                        continue
+                    slots.append(slot)
+                arrays = {'entries': np.array(entries, dtype=np.str_)}
+                if self._vectors is not None:
+                    arrays.update(
+                        vectors=self._vectors[slots],
+                        scales=self._scales[slots],
+                        expiry=self._slot_expiry[slots]
+                    )
+            
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Could not save semantic cache to {path}: {e}")
+    
+    @classmethod
+    def load(cls, path: str, capacity: int = DEFAULT_CAPACITY, threshold: float = DEFAULT_THRESHOLD,
+             ttl_seconds: Optional[float] = None) -> "SemanticCache":
+        """Load a cache written by save() from path, or return an empty one"""
+        cache = cls(capacity=capacity, threshold=threshold, ttl_seconds=ttl_seconds)
+        try:
+            if not os.path.exists(path):
+                return cache
+            with np.load(path, allow_pickle=False) as data:
+                # Least recently used first, so keep the most recent entries that fit
+                entries = [json.loads(entry) for entry in data['entries']][-capacity:]
+                if not entries:
+                    return cache
+                keep = slice(len(data['entries']) - len(entries), None)
+                vectors = data['vectors'][keep]
+                scales = data['scales'][keep]
+                expiry = data['expiry'][keep]
+            
+            cache._vectors = np.zeros((capacity, vectors.shape[1]), dtype=np.int8)
+            cache._vectors[:len(entries)] = vectors
+            cache._scales[:len(entries)] = scales
+            cache._slot_expiry[:len(entries)] = expiry
+            for slot, (scope, key, value) in enumerate(entries):
+                entry_id = (scope, _decode_key(key))
+                cache._slot_scopes[slot] = cache._scope_ids.setdefault(scope, len(cache._scope_ids))
+                cache._slot_entries[slot] = entry_id
+                cache._entries[entry_id] = (slot, value)
+            return cache
+        except Exception as e:
+            logger.warning(f"Could not load semantic cache from {path}: {e}")
+            return cls(capacity=capacity, threshold=threshold, ttl_seconds=ttl_seconds)
+
+def _encode_key(key: Any) -> Any:
+    """JSON form of an exact-match key (str, or bytes as {'hex': ...})"""
+    if isinstance(key, bytes):
+        return {'hex': key.hex()}
+    if isinstance(key, str):
+        return key
+    raise TypeError(f"Unsupported semantic cache key type: {type(key).__name__}")
+
+def _decode_key(key: Any) -> Any:
+    """Inverse of _encode_key"""
+    return bytes.fromhex(key['hex']) if isinstance(key, dict) else key
+
+def cached_semantic(cache: SemanticCache, embed: Callable[[str], List[float]], scope: str,
+                    ttl_seconds: Optional[float] = None):
+    """
+    Decorate fn(text, *args, **kwargs) so results are served from a SemanticCache
+    
+    The exact key is the MD5 of the text; near hits need the same scope and arguments.
+    Cache failures never affect the call itself.
+    
+    Args:
+        cache: Cache to read from and write to
+        embed: Function producing the embedding for a text
+        scope: Name separating this function's entries from others in the cache
+        ttl_seconds: How long results stay fresh (defaults to the cache's ttl_seconds)
+    """
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(fn)
+        def wrapper(text: str, *args, **kwargs):
+            try:
+                call_scope = f"{scope}:{args!r}:{sorted(kwargs.items())!r}"
+                key = hashlib.md5(str(text).encode()).hexdigest()
+                embedding = embed(text)
+                cached = cache.get(embedding, key=key, scope=call_scope)
+                if cached is not None:
+                    return cached
+            except Exception as e:
+                logger.debug(f"Semantic cache lookup skipped for {scope}: {e}")
+                return fn(text, *args, **kwargs)
+            
+            result = fn(text, *args, **kwargs)
+            if result:
+                try:
+                    cache.put(embedding, result, key=key, scope=call_scope, ttl_seconds=ttl_seconds)
+                except Exception as e:
+                    logger.debug(f"Semantic cache store skipped for {scope}: {e}")
+            return result
+        return wrapper
+    return decorator
@@ -5,22 +5,135 @@ Handles semantic product similarity search using BigQuery Vector Search.
 """
 
 import logging
+import json
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional, Tuple
-from datetime import datetime
+from datetime import datetime, timezone
+import numpy as np
+from google.api_core.exceptions import NotFound
 from google.cloud import bigquery
 from config.bigquery_config import get_bigquery_client, config
 from config.settings import get_recommendation_config
 from .ai_engine_simple import SimpleAIEngine as AIEngine
+from .bq_utils import fetch_rows, run_query
+from .query_cache import QueryCache
+from .rerank import cosine_topk
+from .semantic_cache import SemanticCache
+
+try:
+    import pyarrow
+except ImportError:  # optional: reads fall back to REST row iteration
+    pyarrow = None
+
+try:
+    import simsimd
+except ImportError:  # optional: batched cosine falls back to a BLAS matrix product
+    simsimd = None
 
 logger = logging.getLogger(__name__)
 
+# Per-product content fingerprint; changes whenever any embedded field changes
+PRODUCT_FINGERPRINT_SQL = """FARM_FINGERPRINT(CONCAT(
+    p.product_id, '|', IFNULL(p.name, ''), '|', IFNULL(p.description, ''), '|',
+    IFNULL(p.category, ''), '|', IFNULL(p.brand, '')
+))"""
+
+# Products per embedding request (Vertex AI embedding batch limit)
+EMBEDDING_BATCH_SIZE = 250
+
+# Maximum embedding batches in flight at once
+EMBEDDING_CONCURRENCY = 16
+
+# Embedding uploads: rows per load job, longest a partial load may wait, and load attempts
+EMBEDDING_LOAD_ROWS = 10000
+EMBEDDING_LOAD_TIMEOUT_SECONDS = 30
+EMBEDDING_LOAD_RETRIES = 3
+
+# In-memory IVF index: below ANN_MIN_PRODUCTS a full int8 scan is cheaper than probing
+ANN_MIN_PRODUCTS = 1000
+ANN_NPROBE = 8
+ANN_KMEANS_ITERATIONS = 10
+ANN_TRAINING_POINTS_PER_LIST = 64
+
+# Rows of int8 codes widened to float32 at a time when scoring (keeps the temporary cache-resident)
+QUANTISED_SCORE_BLOCK_ROWS = 1024
+
+# Start address alignment of in-memory embedding matrices (one AVX-512 register / cache line)
+EMBEDDING_ALIGNMENT_BYTES = 64
+
+# VECTOR_SEARCH over-fetch factor so out-of-stock neighbours can be dropped
+VECTOR_SEARCH_OVERFETCH = 3
+
+# BigQuery IVF vector index bounds on num_lists, and the share of lists probed per search
+VECTOR_INDEX_MIN_LISTS = 16
+VECTOR_INDEX_MAX_LISTS = 5000
+VECTOR_SEARCH_FRACTION_LISTS = 0.1
+
+# Text search result cache: LRU capacity, cosine threshold for reusing a near-duplicate
+# query, and how long results stay fresh (stock levels change)
+SEARCH_CACHE_SIZE = 10000
+SEARCH_CACHE_SIMILARITY = 0.97
+SEARCH_CACHE_TTL_SECONDS = 300
+
+# Columns of a product result row, in output order
+PRODUCT_COLUMNS = ['product_id', 'name', 'description', 'price', 'category', 'rating', 'image_url', 'stock_quantity']
+
+# Per-product lookup caches (embeddings, prices, details): capacity and freshness
+PRODUCT_CACHE_SIZE = 2048
+PRODUCT_CACHE_TTL_SECONDS = 300
+
+def _aligned_empty(shape: Tuple[int, ...], dtype: Any, alignment: int = EMBEDDING_ALIGNMENT_BYTES) -> np.ndarray:
+    """Uninitialised C-contiguous array whose data starts on an alignment-byte boundary"""
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    buffer = np.empty(nbytes + alignment, dtype=np.uint8)
+    start = -buffer.ctypes.data % alignment
+    return buffer[start:start + nbytes].view(dtype).reshape(shape)
+
+def _cosine_similarities(queries: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    """
+    Cosine similarity of every query row against every vector row
+    
+    Uses simsimd's SIMD cdist kernel when installed; otherwise both sides are
+    expected to be L2-normalised and the result is a single matrix product.
+    """
+    if simsimd is not None:
+        return 1.0 - np.asarray(simsimd.cdist(queries, vectors, metric='cosine'), dtype=np.float32)
+    return queries @ vectors.T
+
 class VectorSearchEngine:
     """Vector search engine for semantic product similarity"""
     
-    def __init__(self):
-        self.client = get_bigquery_client()
-        self.ai_engine = AIEngine()
+    def __init__(self, client: Optional[bigquery.Client] = None):
+        self.client = client or get_bigquery_client()
+        self.ai_engine = AIEngine(client=self.client)
         self.config = get_recommendation_config()
+        # In-process int8 copy of the embeddings table, populated by quantise_embeddings()
+        self._quantised: Optional[Dict[str, Any]] = None
+        self._search_cache = SemanticCache(
+            capacity=SEARCH_CACHE_SIZE,
+            threshold=SEARCH_CACHE_SIMILARITY,
+            ttl_seconds=SEARCH_CACHE_TTL_SECONDS
+        )
+        self._embedding_cache = QueryCache(max_size=PRODUCT_CACHE_SIZE, ttl_seconds=PRODUCT_CACHE_TTL_SECONDS)
+        self._price_cache = QueryCache(max_size=PRODUCT_CACHE_SIZE, ttl_seconds=PRODUCT_CACHE_TTL_SECONDS)
+        self._details_cache = QueryCache(max_size=PRODUCT_CACHE_SIZE, ttl_seconds=PRODUCT_CACHE_TTL_SECONDS)
+    
+    def get_cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get hit/miss statistics of the per-product lookup caches
+        
+        Returns:
+            Stats per cache (embeddings, prices, details)
+        """
+        return {
+            'embeddings': self._embedding_cache.stats(),
+            'prices': self._price_cache.stats(),
+            'details': self._details_cache.stats()
+        }
     
     def create_product_embeddings(self) -> bool:
         """
@@ -30,63 +143,180 @@ class VectorSearchEngine:
             True if successful, False otherwise
         """
         try:
-            # Check if embeddings table already has data
-            if self._embeddings_table_has_data():
-                logger.info("Product embeddings table already has data, skipping embedding creation")
+            # Create embeddings table if it doesn't exist
+            self._create_embeddings_table()
+            
+            # Skip entirely if neither the catalogue nor the embedding model changed
+            catalogue_fingerprint = self._get_catalogue_fingerprint()
+            if self._embeddings_table_has_data() and catalogue_fingerprint is not None \
+                    and catalogue_fingerprint == self._get_stored_catalogue_fingerprint():
+                logger.info("Product catalogue unchanged since last embedding run, skipping embedding creation")
+                self._ensure_quantised_index(catalogue_fingerprint)
                 return True
             
-            # First, get all product descriptions
-            query = f"""
-            SELECT 
-                product_id,
-                name,
-                description,
-                category,
-                brand
-            FROM `{config.products_table}`
-            WHERE description IS NOT NULL
-            """
+            # Only fetch products that are new or whose content changed
+            query = self._build_changed_products_sql()
             
+            # The whole changed catalogue can be large, so read it through the Storage Read API
             query_job = self.client.query(query)
-            products = query_job.result()
+            products = fetch_rows(query_job, [
+                'product_id', 'name', 'description', 'category', 'brand', 'content_fingerprint', 'has_embedding'
+            ])
             
-            # Create embeddings table if it doesn't exist
-            self._create_embeddings_table()
-            
-            # Process products in batches
-            batch_size = 100
-            product_batch = []
+            # Stale embeddings of changed products are only dropped once their replacement is loaded
+            stale_ids = {product['product_id'] for product in products if product['has_embedding']}
+            run_started = datetime.now(timezone.utc).isoformat()
             
+            product_inputs = []
             for product in products:
                 # Combine product information for embedding
-                text_for_embedding = f"{product.name} {product.description} {product.category} {product.brand}"
+                text_for_embedding = f"{product['name']} {product['description']} {product['category']} {product['brand']}"
                 
-                product_batch.append({
-                    'product_id': product.product_id,
+                product_inputs.append({
+                    'product_id': product['product_id'],
                     'text_for_embedding': text_for_embedding,
-                    'name': product.name,
-                    'description': product.description,
-                    'category': product.category,
-                    'brand': product.brand
+                    'name': product['name'],
+                    'description': product['description'],
+                    'category': product['category'],
+                    'brand': product['brand'],
+                    'content_fingerprint': product['content_fingerprint']
                 })
-                
-                if len(product_batch) >= batch_size:
-                    self._process_embedding_batch(product_batch)
-                    product_batch = []
             
-            # Process remaining products
-            if product_batch:
-                self._process_embedding_batch(product_batch)
+            # Embed batches concurrently, bounded by EMBEDDING_CONCURRENCY, while a single
+            # consumer loads finished rows in the background
+            batches = [
+                product_inputs[i:i + EMBEDDING_BATCH_SIZE]
+                for i in range(0, len(product_inputs), EMBEDDING_BATCH_SIZE)
+            ]
+            upload_queue = queue.Queue(maxsize=EMBEDDING_CONCURRENCY * 2)
+            embedded_ids = []
+            with ThreadPoolExecutor(max_workers=1) as uploader:
+                upload = uploader.submit(self._consume_embedding_rows, upload_queue)
+                try:
+                    if batches:
+                        with ThreadPoolExecutor(max_workers=min(EMBEDDING_CONCURRENCY, len(batches))) as executor:
+                            for rows in executor.map(self._process_embedding_batch, batches):
+                                embedded_ids.extend(row['product_id'] for row in rows)
+                                upload_queue.put(rows)
+                finally:
+                    # Sentinel: flush what is pending and stop
+                    upload_queue.put(None)
+                loaded = upload.result()
+            
+            logger.info(f"Embedded {len(products)} new or changed products ({loaded} rows loaded)")
+            
+            replaced_ids = [pid for pid in embedded_ids if pid in stale_ids]
+            if replaced_ids:
+                self._delete_product_embeddings(replaced_ids, created_before=run_started)
             
             # Create vector index (only if it doesn't exist)
             self._create_vector_index()
             
+            # A product that failed to embed must be retried, so only record the
+            # fingerprint once every product has a row
+            if loaded < len(products):
+                logger.warning(
+                    f"{len(products) - loaded} products failed to embed; "
+                    f"they will be retried on the next run"
+                )
+            elif catalogue_fingerprint is not None:
+                self._store_catalogue_fingerprint(catalogue_fingerprint)
+            
+            # Build (or map) the int8 + IVF index used by find_similar_products
+            self._ensure_quantised_index(catalogue_fingerprint)
+            
             return True
             
         except Exception as e:
             logger.error(f"Error creating product embeddings: {e}")
             return False
     
+    def quantise_embeddings(self) -> bool:
+        """
+        Load all product embeddings and keep an int8-quantised copy in memory
+        
+        Each dimension is mapped affinely onto [-128, 127] using its min/max over
+        the catalogue; the per-dimension scale and offset are kept to score queries.
+        
+        Returns:
+            True if the quantised index was built, False otherwise
+        """
+        try:
+            product_ids, matrix = self._read_embedding_matrix()
+            if matrix is None:
+                logger.warning("No embeddings to quantise")
+                return False
+            
+            offset = matrix.min(axis=0)
+            scale = (matrix.max(axis=0) - offset) / 255.0
+            scale[scale == 0] = 1.0
+            
+            codes = _aligned_empty(matrix.shape, np.int8)
+            codes[...] = np.rint((matrix - offset) / scale) - 128
+            
+            # Norms of the dequantised vectors, so cosine scores stay consistent
+            dequantised = (codes.astype(np.float32) + 128) * scale + offset
+            norms = np.linalg.norm(dequantised, axis=1)
+            
+            self._quantised = {
+                'product_ids': product_ids,
+                'positions': {pid: i for i, pid in enumerate(product_ids)},
+                'codes': codes,
+                'scale': scale,
+                'offset': offset,
+                'norms': norms,
+                'inv_norms': self._inverse_norms(norms),
+                'ivf': self._build_ivf_lists(matrix),
+            }
+            
+            logger.info(f"Quantised {len(product_ids)} embeddings to int8 ({codes.nbytes} bytes)")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error quantising embeddings: {e}")
+            self._quantised = None
+            return False
+    
+    def _read_embedding_matrix(self) -> Tuple[List[str], Optional[np.ndarray]]:
+        """
+        Read every stored embedding into one contiguous, aligned (N, d) float32 matrix
+        
+        With pyarrow installed the table is scanned through the BigQuery Storage Read
+        API (no query job) and the embedding column is reshaped straight from its Arrow
+        values buffer; otherwise rows are streamed and copied in one by one.
+        
+        Returns:
+            Product IDs in row order, and the matrix (None if there are no embeddings)
+        """
+        table_id = f"{config.dataset_ref}.product_embeddings"
+        
+        if pyarrow is not None:
+            table = self.client.list_rows(
+                table_id,
+                selected_fields=[
+                    bigquery.SchemaField("product_id", "STRING"),
+                    bigquery.SchemaField("embedding", "FLOAT64", mode="REPEATED")
+                ]
+            ).to_arrow(create_bqstorage_client=True)
+            if table.num_rows == 0:
+                return [], None
+            
+            values = table.column('embedding').combine_chunks().flatten().to_numpy()
+            matrix = _aligned_empty((table.num_rows, len(values) // table.num_rows), np.float32)
+            matrix[...] = values.reshape(matrix.shape)
+            return table.column('product_id').to_pylist(), matrix
+        
+        results = self.client.query(f"SELECT product_id, embedding FROM `{table_id}`").result()
+        product_ids = []
+        matrix = None
+        for i, row in enumerate(results):
+            if matrix is None:
+                matrix = _aligned_empty((results.total_rows, len(row.embedding)), np.float32)
+            matrix[i] = row.embedding
+            product_ids.append(row.product_id)
+        
+        return product_ids, matrix
+    
     def find_similar_products(self, product_id: str, top_k: int = 5) -> List[Dict[str, Any]]:
         """
         Find similar products using vector search
@@ -99,54 +329,29 @@ class VectorSearchEngine:
             List of similar products with similarity scores
         """
         try:
+            if self._quantised and product_id in self._quantised['positions']:
+                return self._find_similar_quantised(product_id, top_k)
+            
             # Get the embedding for the target product
             target_embedding = self._get_product_embedding(product_id)
             if not target_embedding:
                 return []
             
-            # Use simple cosine similarity calculation instead of VECTOR_SEARCH
-            query = f"""
-            SELECT 
-                p.product_id,
-                p.name,
-                p.description,
-                p.price,
-                p.category,
-                p.rating,
-                p.image_url,
-                p.stock_quantity,
-                -- Calculate cosine similarity manually
-                (SELECT 
-                    SUM(e1.embedding[i] * e2.embedding[i]) / 
-                    (SQRT(SUM(e1.embedding[i] * e1.embedding[i])) * SQRT(SUM(e2.embedding[i] * e2.embedding[i])))
-                FROM UNNEST(e1.embedding) AS e1_vals WITH OFFSET i
-                JOIN UNNEST(e2.embedding) AS e2_vals WITH OFFSET i USING (i)
-                ) AS similarity_score
-            FROM `{config.dataset_ref}.product_embeddings` e1
-            JOIN `{config.dataset_ref}.product_embeddings` e2 ON e1.product_id = '{product_id}'
-            JOIN `{config.products_table}` p ON e1.product_id = p.product_id
-            WHERE e1.product_id != '{product_id}'
-            AND p.stock_quantity > 0
-            ORDER BY similarity_score DESC
-            LIMIT {top_k}
-            """
+            # Products embedded after the in-memory index was built are still scored in process
+            if self._quantised:
+                return self._find_similar_quantised(product_id, top_k, target_embedding)
             
-            query_job = self.client.query(query)
-            results = query_job.result()
+            # Nearest neighbours through the IVF vector index, joined to live product data
+            query = self._build_similar_products_sql()
             
-            similar_products = []
-            for row in results:
-                similar_products.append({
-                    'product_id': row.product_id,
-                    'name': row.name,
-                    'description': row.description,
-                    'price': row.price,
-                    'category': row.category,
-                    'rating': row.rating,
-                    'image_url': row.image_url,
-                    'stock_quantity': row.stock_quantity,
-                    'similarity_score': row.similarity_score or 0.5  # Default similarity if calculation fails
-                })
+            query_job = run_query(
+                self.client, query,
+                query_embedding=[float(value) for value in target_embedding],
+                candidates=top_k * VECTOR_SEARCH_OVERFETCH + 1,
+                product_id=product_id,
+                top_k=top_k
+            )
+            similar_products = fetch_rows(query_job, PRODUCT_COLUMNS + ['similarity_score'])
             
             return similar_products
             
@@ -172,52 +377,25 @@ class VectorSearchEngine:
             if not search_embedding:
                 return self._get_text_search_fallback(search_text, top_k)
             
-            # Use simple text search with keyword matching as fallback
-            query = f"""
-            SELECT 
-                p.product_id,
-                p.name,
-                p.description,
-                p.price,
-                p.category,
-                p.rating,
-                p.image_url,
-                p.stock_quantity,
-                0.8 as relevance_score
-            FROM `{config.products_table}` p
-            WHERE p.stock_quantity > 0
-            AND (
-                LOWER(p.name) LIKE LOWER('%{search_text}%')
-                OR LOWER(p.description) LIKE LOWER('%{search_text}%')
-                OR LOWER(p.category) LIKE LOWER('%{search_text}%')
-                OR LOWER(p.brand) LIKE LOWER('%{search_text}%')
-            )
-            ORDER BY p.rating DESC, p.price ASC
-            LIMIT {top_k}
-            """
+            # Reuse results of this or a near-identical query if they cover top_k
+            cached = self._search_cache.get(search_embedding)
+            if cached is not None and cached[0] >= top_k:
+                return [dict(product) for product in cached[1][:top_k]]
             
-            query_job = self.client.query(query)
-            results = query_job.result()
+            # Tokenised keyword match, served by the products search index
+            query = self._build_text_search_sql()
+            query_job = run_query(self.client, query, search_text=search_text, top_k=top_k)
+            products = fetch_rows(query_job, PRODUCT_COLUMNS + ['relevance_score'])
             
-            products = []
-            for row in results:
-                products.append({
-                    'product_id': row.product_id,
-                    'name': row.name,
-                    'description': row.description,
-                    'price': row.price,
-                    'category': row.category,
-                    'rating': row.rating,
-                    'image_url': row.image_url,
-                    'stock_quantity': row.stock_quantity,
-                    'relevance_score': row.relevance_score
-                })
+            if products:
+                self._search_cache.put(search_embedding, (top_k, [dict(product) for product in products]))
             
             return products
             
         except Exception as e:
             logger.error(f"Error searching products by text: {e}")
-            return self._get_text_search_fallback(search_text, top_k)
+            # The keyword fallback runs the same SEARCH, so go straight to popular products
+            return self._get_popular_products_recommendations(top_k)
     
     def get_product_substitutions(self, product_id: str, reason: str = "out_of_stock") -> List[Dict[str, Any]]:
         """
@@ -234,6 +412,12 @@ class VectorSearchEngine:
             # Get similar products
             similar_products = self.find_similar_products(product_id, top_k=10)
             
+            # Details of the original and every candidate in one lookup
+            details = self._bulk_get_product_details(
+                [product_id] + [p['product_id'] for p in similar_products]
+            )
+            original_product = details.get(product_id)
+            
             # Filter based on reason
             if reason == "out_of_stock":
                 # Prefer products with good stock levels
@@ -243,7 +427,7 @@ class VectorSearchEngine:
                 ]
             elif reason == "price":
                 # Prefer products with similar or lower price
-                original_price = self._get_product_price(product_id)
+                original_price = original_product['price'] if original_product else None
                 if original_price:
                     substitutions = [
                         p for p in similar_products 
@@ -258,7 +442,7 @@ class VectorSearchEngine:
             for sub in substitutions:
                 sub['substitution_reason'] = reason
                 sub['explanation'] = self._generate_substitution_explanation(
-                    product_id, sub['product_id'], reason
+                    original_product, details.get(sub['product_id']), reason
                 )
             
             return substitutions[:5]  # Return top 5 substitutions
@@ -288,42 +472,15 @@ class VectorSearchEngine:
             user_categories = list(set([p['category'] for p in user_products]))
             
             # Find products from different categories
-            query = f"""
-            SELECT 
-                p.product_id,
-                p.name,
-                p.description,
-                p.price,
-                p.category,
-                p.rating,
-                p.image_url,
-                p.stock_quantity,
-                0.7 as similarity_score
-            FROM `{config.products_table}` p
-            WHERE p.stock_quantity > 0
-            AND p.category NOT IN ({','.join([f"'{cat}'" for cat in user_categories])})
-            AND p.product_id NOT IN ({','.join([f"'{p['product_id']}'" for p in user_products])})
-            ORDER BY p.rating DESC, p.price ASC
-            LIMIT {top_k}
-            """
+            query = self._build_cross_category_sql()
             
-            query_job = self.client.query(query)
-            results = query_job.result()
-            
-            recommendations = []
-            for row in results:
-                recommendations.append({
-                    'product_id': row.product_id,
-                    'name': row.name,
-                    'description': row.description,
-                    'price': row.price,
-                    'category': row.category,
-                    'rating': row.rating,
-                    'image_url': row.image_url,
-                    'stock_quantity': row.stock_quantity,
-                    'similarity_score': row.similarity_score,
-                    'recommendation_type': 'cross_category'
-                })
+            query_job = run_query(
+                self.client, query,
+                categories=[cat for cat in user_categories if cat is not None],
+                product_ids=[p['product_id'] for p in user_products],
+                top_k=top_k
+            )
+            recommendations = fetch_rows(query_job, PRODUCT_COLUMNS + ['similarity_score', 'recommendation_type'])
             
             return recommendations
             
@@ -331,39 +488,522 @@ class VectorSearchEngine:
             logger.error(f"Error finding cross-category recommendations: {e}")
             return self._get_popular_products_recommendations(top_k)
     
+    def _build_text_search_sql(self) -> str:
+        """SQL for search_products_by_text (binds @search_text, @top_k)"""
+        return f"""
+        SELECT 
+            p.product_id,
+            p.name,
+            p.description,
+            p.price,
+            p.category,
+            p.rating,
+            p.image_url,
+            p.stock_quantity,
+            0.8 as relevance_score
+        FROM `{config.products_table}` p
+        WHERE p.stock_quantity > 0
+        AND SEARCH(p, @search_text)
+        ORDER BY p.rating DESC, p.price ASC
+        LIMIT @top_k
+        """
+    
+    def _build_changed_products_sql(self) -> str:
+        """SQL for create_product_embeddings: products new or changed since they were embedded"""
+        return f"""
+        SELECT 
+            p.product_id,
+            p.name,
+            p.description,
+            p.category,
+            p.brand,
+            {PRODUCT_FINGERPRINT_SQL} AS content_fingerprint,
+            e.product_id IS NOT NULL AS has_embedding
+        FROM `{config.products_table}` p
+        LEFT JOIN `{config.dataset_ref}.product_embeddings` e ON e.product_id = p.product_id
+        WHERE p.description IS NOT NULL
+        AND (
+            e.product_id IS NULL
+            OR e.content_fingerprint IS NULL
+            OR e.content_fingerprint != {PRODUCT_FINGERPRINT_SQL}
+        )
+        """
+    
+    def _build_similar_products_sql(self) -> str:
+        """SQL for find_similar_products (binds @query_embedding, @candidates, @product_id, @top_k)"""
+        return f"""
+        SELECT 
+            p.product_id,
+            p.name,
+            p.description,
+            p.price,
+            p.category,
+            p.rating,
+            p.image_url,
+            p.stock_quantity,
+            1 - vs.distance AS similarity_score
+        FROM VECTOR_SEARCH(
+            TABLE `{config.dataset_ref}.product_embeddings`,
+            'embedding',
+            (SELECT @query_embedding AS embedding),
+            top_k => @candidates,
+            distance_type => 'COSINE',
+            options => '{json.dumps({"fraction_lists_to_search": VECTOR_SEARCH_FRACTION_LISTS})}'
+        ) vs
+        JOIN `{config.products_table}` p ON vs.base.product_id = p.product_id
+        WHERE p.product_id != @product_id
+        AND p.stock_quantity > 0
+        ORDER BY vs.distance
+        LIMIT @top_k
+        """
+    
+    def _build_cross_category_sql(self) -> str:
+        """SQL for find_cross_category_recommendations (binds @categories, @product_ids, @top_k)"""
+        return f"""
+        SELECT 
+            p.product_id,
+            p.name,
+            p.description,
+            p.price,
+            p.category,
+            p.rating,
+            p.image_url,
+            p.stock_quantity,
+            0.7 as similarity_score,
+            'cross_category' as recommendation_type
+        FROM `{config.products_table}` p
+        WHERE p.stock_quantity > 0
+        AND p.category NOT IN UNNEST(@categories)
+        AND p.product_id NOT IN UNNEST(@product_ids)
+        ORDER BY p.rating DESC, p.price ASC
+        LIMIT @top_k
+        """
+    
+    def _build_in_stock_candidates_sql(self) -> str:
+        """SQL for _find_similar_quantised (binds @product_ids)"""
+        return f"""
+        SELECT 
+            product_id, name, description, price, category,
+            rating, image_url, stock_quantity
+        FROM `{config.products_table}`
+        WHERE product_id IN UNNEST(@product_ids)
+        AND stock_quantity > 0
+        """
+    
+    def _build_catalogue_fingerprint_sql(self) -> str:
+        """SQL for _get_catalogue_fingerprint"""
+        return f"""
+        SELECT FARM_FINGERPRINT(STRING_AGG(
+            CAST({PRODUCT_FINGERPRINT_SQL} AS STRING), ',' ORDER BY p.product_id
+        )) AS fingerprint
+        FROM `{config.products_table}` p
+        WHERE p.description IS NOT NULL
+        """
+    
+    def _build_delete_embeddings_sql(self) -> str:
+        """SQL for _delete_product_embeddings (binds @product_ids, @created_before)"""
+        return f"""
+        DELETE FROM `{config.dataset_ref}.product_embeddings`
+        WHERE product_id IN UNNEST(@product_ids)
+        AND (created_at IS NULL OR created_at < TIMESTAMP(@created_before))
+        """
+    
+    def _build_vector_index_exists_sql(self) -> str:
+        """SQL for _vector_index_exists"""
+        return f"""
+        SELECT COUNT(*) as count
+        FROM `{config.dataset_ref}.INFORMATION_SCHEMA.VECTOR_INDEXES`
+        WHERE table_name = 'product_embeddings'
+        AND index_name = 'product_embeddings_index'
+        """
+    
+    def _build_product_embedding_sql(self) -> str:
+        """SQL for _get_product_embedding (binds @product_id)"""
+        return f"""
+        SELECT embedding
+        FROM `{config.dataset_ref}.product_embeddings`
+        WHERE product_id = @product_id
+        """
+    
+    def _build_product_price_sql(self) -> str:
+        """SQL for _get_product_price (binds @product_id)"""
+        return f"""
+        SELECT price
+        FROM `{config.products_table}`
+        WHERE product_id = @product_id
+        """
+    
+    def _build_user_preferred_products_sql(self) -> str:
+        """SQL for _get_user_preferred_products (binds @user_id)"""
+        return f"""
+        SELECT 
+            p.product_id,
+            p.name,
+            p.category,
+            COUNT(*) as interaction_count
+        FROM `{config.user_behavior_table}` ub
+        JOIN `{config.products_table}` p ON ub.product_id = p.product_id
+        WHERE ub.user_id = @user_id
+        AND ub.action_type IN ('view', 'add_to_cart', 'purchase')
+        GROUP BY p.product_id, p.name, p.category
+        ORDER BY interaction_count DESC
+        LIMIT 10
+        """
+    
+    def _build_product_details_sql(self) -> str:
+        """SQL for _get_product_details (binds @product_id)"""
+        return f"""
+        SELECT product_id, name, price, category
+        FROM `{config.products_table}`
+        WHERE product_id = @product_id
+        """
+    
+    def _build_bulk_product_details_sql(self) -> str:
+        """SQL for _bulk_get_product_details (binds @product_ids)"""
+        return f"""
+        SELECT product_id, name, price, category
+        FROM `{config.products_table}`
+        WHERE product_id IN UNNEST(@product_ids)
+        """
+    
+    def _build_category_fallback_sql(self) -> str:
+        """SQL for _get_fallback_recommendations (binds @category, @product_id, @top_k)"""
+        return f"""
+        SELECT 
+            p.product_id,
+            p.name,
+            p.description,
+            p.price,
+            p.category,
+            p.rating,
+            p.image_url,
+            p.stock_quantity,
+            0.6 as similarity_score  -- default similarity for fallback
+        FROM `{config.products_table}` p
+        WHERE p.category = @category
+        AND p.product_id != @product_id
+        AND p.stock_quantity > 0
+        ORDER BY p.rating DESC, p.price ASC
+        LIMIT @top_k
+        """
+    
+    def _build_text_search_fallback_sql(self) -> str:
+        """SQL for _get_text_search_fallback (binds @search_text, @top_k)"""
+        return f"""
+        SELECT 
+            p.product_id,
+            p.name,
+            p.description,
+            p.price,
+            p.category,
+            p.rating,
+            p.image_url,
+            p.stock_quantity,
+            0.5 as relevance_score  -- default relevance for fallback
+        FROM `{config.products_table}` p
+        WHERE p.stock_quantity > 0
+        AND SEARCH(p, @search_text)
+        ORDER BY p.rating DESC, p.price ASC
+        LIMIT @top_k
+        """
+    
+    def _build_popular_products_sql(self) -> str:
+        """SQL for _get_popular_products_recommendations (binds @top_k)"""
+        return f"""
+        SELECT 
+            p.product_id,
+            p.name,
+            p.description,
+            p.price,
+            p.category,
+            p.rating,
+            p.image_url,
+            p.stock_quantity,
+            0.5 as similarity_score,  -- default similarity for popular products
+            'popular' as recommendation_type
+        FROM `{config.products_table}` p
+        WHERE p.stock_quantity > 0
+        ORDER BY p.rating DESC, p.price ASC
+        LIMIT @top_k
+        """
+    
+    def _build_ivf_lists(self, vectors: np.ndarray) -> Optional[Dict[str, Any]]:
+        """Partition embeddings into ~sqrt(N) cosine k-means lists (None for small catalogues)"""
+        n = len(vectors)
+        if n < ANN_MIN_PRODUCTS:
+            return None
+        
+        num_lists = int(np.ceil(np.sqrt(n)))
+        unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        
+        rng = np.random.default_rng(0)
+        training = unit[rng.choice(n, min(n, num_lists * ANN_TRAINING_POINTS_PER_LIST), replace=False)]
+        centroids = training[rng.choice(len(training), num_lists, replace=False)].copy()
+        
+        for _ in range(ANN_KMEANS_ITERATIONS):
+            assignment = np.argmax(_cosine_similarities(training, centroids), axis=1)
+            for c in range(num_lists):
+                members = training[assignment == c]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[c] = centroid / max(np.linalg.norm(centroid), 1e-12)
+        
+        assignment = np.argmax(_cosine_similarities(unit, centroids), axis=1)
+        return {
+            'centroids': centroids,
+            'assignment': assignment,
+            'lists': [np.flatnonzero(assignment == c) for c in range(num_lists)],
+        }
+    
+    def _ensure_quantised_index(self, catalogue_fingerprint: Optional[str]):
+        """Memory-map the on-disk int8 index if it matches the catalogue, else rebuild and persist it"""
+        if catalogue_fingerprint and self._load_quantised_index(catalogue_fingerprint):
+            return
+        
+        if self.quantise_embeddings() and catalogue_fingerprint:
+            self._save_quantised_index(catalogue_fingerprint)
+    
+    def _save_quantised_index(self, catalogue_fingerprint: str):
+        """Write the int8 index to config.embedding_cache_dir (meta.json last marks it complete)"""
+        try:
+            index = self._quantised
+            cache_dir = config.embedding_cache_dir
+            os.makedirs(cache_dir, exist_ok=True)
+            
+            meta_path = os.path.join(cache_dir, 'meta.json')
+            try:
+                os.remove(meta_path)
+            except FileNotFoundError:
+                pass
+            
+            # Codes go to a flat file for np.memmap; every other array shares one .npz write
+            np.ascontiguousarray(index['codes']).tofile(os.path.join(cache_dir, 'codes.int8'))
+            
+            arrays = {
+                'product_ids': np.asarray(index['product_ids']),
+                'scale': index['scale'],
+                'offset': index['offset'],
+                'norms': index['norms'],
+            }
+            ivf = index['ivf']
+            if ivf is not None:
+                arrays['centroids'] = ivf['centroids']
+                arrays['assignment'] = ivf['assignment']
+            np.savez(os.path.join(cache_dir, 'index.npz'), **arrays)
+            
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'fingerprint': catalogue_fingerprint,
+                    'shape': list(index['codes'].shape),
+                    'ivf': ivf is not None
+                }, f)
+            
+        except Exception as e:
+            logger.warning(f"Could not persist quantised embedding index: {e}")
+    
+    def _load_quantised_index(self, catalogue_fingerprint: str) -> bool:
+        """Memory-map a persisted int8 index built for this catalogue fingerprint"""
+        try:
+            cache_dir = config.embedding_cache_dir
+            meta_path = os.path.join(cache_dir, 'meta.json')
+            if not os.path.exists(meta_path):
+                return False
+            
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('fingerprint') != catalogue_fingerprint:
+                return False
+            
+            # Codes stay on disk; the OS pages in only the rows a query touches
+            codes = np.memmap(os.path.join(cache_dir, 'codes.int8'), dtype=np.int8, mode='r',
+                              shape=tuple(meta['shape']))
+            with np.load(os.path.join(cache_dir, 'index.npz')) as arrays:
+                sidecars = {name: arrays[name] for name in arrays.files}
+            product_ids = sidecars['product_ids'].tolist()
+            
+            ivf = None
+            if meta.get('ivf'):
+                assignment = sidecars['assignment']
+                centroids = sidecars['centroids']
+                ivf = {
+                    'centroids': centroids,
+                    'assignment': assignment,
+                    'lists': [np.flatnonzero(assignment == c) for c in range(len(centroids))],
+                }
+            
+            self._quantised = {
+                'product_ids': product_ids,
+                'positions': {pid: i for i, pid in enumerate(product_ids)},
+                'codes': codes,
+                'scale': sidecars['scale'],
+                'offset': sidecars['offset'],
+                'norms': sidecars['norms'],
+                'inv_norms': self._inverse_norms(sidecars['norms']),
+                'ivf': ivf,
+            }
+            
+            logger.info(f"Memory-mapped quantised index for {len(product_ids)} products from {cache_dir}")
+            return True
+            
+        except Exception as e:
+            logger.warning(f"Could not load quantised embedding index, rebuilding: {e}")
+            return False
+    
+    @staticmethod
+    def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the k highest scores, best first: O(N) partition plus a sort of only k entries"""
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.intp)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
+    
+    @staticmethod
+    def _inverse_norms(norms: np.ndarray) -> np.ndarray:
+        """Reciprocal vector norms (0 for zero vectors), so cosine scoring needs no per-query division"""
+        return np.divide(1.0, norms, out=np.zeros(len(norms), dtype=np.float32), where=norms > 0)
+    
+    def _candidate_rows(self, query_embedding: np.ndarray) -> Optional[np.ndarray]:
+        """Rows in the ANN_NPROBE IVF lists closest to the query (None means scan everything)"""
+        ivf = self._quantised.get('ivf')
+        if ivf is None:
+            return None
+        
+        probes = cosine_topk(query_embedding, ivf['centroids'], ANN_NPROBE)
+        return np.concatenate([ivf['lists'][c] for c in probes])
+    
+    def _quantised_scores(self, query_embedding: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Cosine similarity of a float query against the quantised embeddings (optionally a subset)"""
+        index = self._quantised
+        codes = index['codes'] if rows is None else index['codes'][rows]
+        inv_norms = index['inv_norms'] if rows is None else index['inv_norms'][rows]
+        
+        # Normalise the query once; the stored side is covered by the precomputed inverse norms
+        query_norm = np.linalg.norm(query_embedding)
+        if query_norm == 0:
+            return np.zeros(len(codes), dtype=np.float32)
+        query_embedding = query_embedding / query_norm
+        
+        # x ~= (code + 128) * scale + offset, so fold scale into the query and
+        # score the raw int8 codes with a matrix-vector product
+        weights = (query_embedding * index['scale']).astype(np.float32)
+        bias = 128.0 * weights.sum() + query_embedding @ index['offset']
+        
+        # Widen the codes block by block: only int8 bytes stream from memory (or the
+        # memory-mapped file) instead of a full float32 copy of the matrix per query
+        dots = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), QUANTISED_SCORE_BLOCK_ROWS):
+            block = codes[start:start + QUANTISED_SCORE_BLOCK_ROWS]
+            np.matmul(block.astype(np.float32), weights, out=dots[start:start + len(block)])
+        dots += bias
+        dots *= inv_norms
+        return dots
+    
+    def _find_similar_quantised(self, product_id: str, top_k: int,
+                                target_embedding: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+        """
+        find_similar_products against the in-memory int8 index
+        
+        Args:
+            product_id: ID of the product to find similar products for
+            top_k: Number of similar products to return
+            target_embedding: Embedding of a product that is not in the index yet
+                (defaults to the product's indexed vector)
+        
+        Returns:
+            List of similar products with similarity scores
+        """
+        index = self._quantised
+        position = index['positions'].get(product_id, -1)
+        if target_embedding is not None:
+            target = np.asarray(target_embedding, dtype=np.float32)
+        else:
+            target = (index['codes'][position].astype(np.float32) + 128) * index['scale'] + index['offset']
+        
+        rows = self._candidate_rows(target)
+        if rows is None:
+            rows = np.arange(len(index['product_ids']))
+        rows = rows[rows != position]
+        scores = self._quantised_scores(target, rows)
+        
+        # Over-fetch candidates so out-of-stock products can be dropped
+        best = self._top_k_indices(scores, top_k * VECTOR_SEARCH_OVERFETCH)
+        if len(best) == 0:
+            return []
+        candidate_scores = {index['product_ids'][rows[i]]: float(scores[i]) for i in best}
+        
+        # Product data for the candidates only, in one parameterized lookup
+        query = self._build_in_stock_candidates_sql()
+        
+        in_stock = {row.product_id: row for row in run_query(self.client, query, product_ids=list(candidate_scores)).result()}
+        
+        # Candidates are already ranked, so keep that order and stop at top_k
+        similar_products = []
+        for pid, score in candidate_scores.items():
+            row = in_stock.get(pid)
+            if row is None:
+                continue
+            similar_products.append({
+                'product_id': row.product_id,
+                'name': row.name,
+                'description': row.description,
+                'price': row.price,
+                'category': row.category,
+                'rating': row.rating,
+                'image_url': row.image_url,
+                'stock_quantity': row.stock_quantity,
+                'similarity_score': score
+            })
+            if len(similar_products) == top_k:
+                break
+        
+        return similar_products
+    
+    def _embeddings_schema(self) -> List[bigquery.SchemaField]:
+        """Schema of the product embeddings table"""
+        return [
+            bigquery.SchemaField("product_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("embedding", "FLOAT64", mode="REPEATED"),
+            bigquery.SchemaField("name", "STRING"),
+            bigquery.SchemaField("description", "STRING"),
+            bigquery.SchemaField("category", "STRING"),
+            bigquery.SchemaField("brand", "STRING"),
+            bigquery.SchemaField("content_fingerprint", "INT64"),
+            bigquery.SchemaField("created_at", "TIMESTAMP")
+        ]
+    
     def _create_embeddings_table(self):
         """Create the product embeddings table"""
         try:
-            schema = [
-                bigquery.SchemaField("product_id", "STRING", mode="REQUIRED"),
-                bigquery.SchemaField("embedding", "FLOAT64", mode="REPEATED"),
-                bigquery.SchemaField("name", "STRING"),
-                bigquery.SchemaField("description", "STRING"),
-                bigquery.SchemaField("category", "STRING"),
-                bigquery.SchemaField("brand", "STRING"),
-                bigquery.SchemaField("created_at", "TIMESTAMP")
-            ]
-            
             table_id = f"{config.dataset_ref}.product_embeddings"
-            table = bigquery.Table(table_id, schema=schema)
+            table = bigquery.Table(table_id, schema=self._embeddings_schema())
+            
+            table = self.client.create_table(table, exists_ok=True)
+            
+            # Tables created before fingerprinting lack the column; add it in place
+            if "content_fingerprint" not in {field.name for field in table.schema}:
+                table.schema = list(table.schema) + [bigquery.SchemaField("content_fingerprint", "INT64")]
+                self.client.update_table(table, ["schema"])
             
-            self.client.create_table(table, exists_ok=True)
             logger.info(f"Created embeddings table: {table_id}")
             
         except Exception as e:
             logger.error(f"Error creating embeddings table: {e}")
             raise
     
-    def _process_embedding_batch(self, product_batch: List[Dict[str, Any]]):
-        """Process a batch of products to generate embeddings"""
+    def _process_embedding_batch(self, product_batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Generate embeddings for a batch of products and build their table rows"""
         try:
             # Generate embeddings for the batch
             texts = [p['text_for_embedding'] for p in product_batch]
             embeddings = self.ai_engine.batch_generate_embeddings(texts)
             
-            # Prepare rows for insertion
+            # Prepare rows for insertion; every row of the batch shares one timestamp
+            created_at = datetime.now(timezone.utc).isoformat()
             rows_to_insert = []
             for i, product in enumerate(product_batch):
+                # The product is being (re-)embedded, so any cached embedding is stale
+                self._embedding_cache.invalidate(product['product_id'])
                 if embeddings[i]:
                     rows_to_insert.append({
                         'product_id': product['product_id'],
@@ -372,22 +1012,163 @@ class VectorSearchEngine:
                         'description': product['description'],
                         'category': product['category'],
                         'brand': product['brand'],
-                        'created_at': datetime.now().isoformat()
+                        'content_fingerprint': product['content_fingerprint'],
+                        'created_at': created_at
                     })
             
-            # Insert into embeddings table
-            table_id = f"{config.dataset_ref}.product_embeddings"
-            errors = self.client.insert_rows_json(table_id, rows_to_insert)
-            
-            if errors:
-                logger.error(f"Error inserting embeddings: {errors}")
-            else:
-                logger.info(f"Successfully processed {len(rows_to_insert)} product embeddings")
+            return rows_to_insert
                 
         except Exception as e:
             logger.error(f"Error processing embedding batch: {e}")
             raise
     
+    def _consume_embedding_rows(self, upload_queue: "queue.Queue") -> int:
+        """
+        Drain embedding row batches from upload_queue into load jobs until a None sentinel
+        
+        Rows are flushed once EMBEDDING_LOAD_ROWS accumulate, EMBEDDING_LOAD_TIMEOUT_SECONDS
+        pass, or the sentinel arrives. After a failed load the queue is still drained (so
+        producers never block) and the error is raised at the end.
+        
+        Args:
+            upload_queue: Queue of row lists, terminated by None
+            
+        Returns:
+            Number of rows loaded
+        """
+        pending = []
+        loaded = 0
+        error = None
+        deadline = time.monotonic() + EMBEDDING_LOAD_TIMEOUT_SECONDS
+        
+        while True:
+            try:
+                rows = upload_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                rows = []
+            finished = rows is None
+            pending.extend(rows or [])
+            
+            if finished or len(pending) >= EMBEDDING_LOAD_ROWS or time.monotonic() >= deadline:
+                if pending and error is None:
+                    try:
+                        self._load_embedding_rows(pending)
+                        loaded += len(pending)
+                    except Exception as e:
+                        error = e
+                pending = []
+                deadline = time.monotonic() + EMBEDDING_LOAD_TIMEOUT_SECONDS
+            
+            if finished:
+                break
+        
+        if error is not None:
+            raise error
+        return loaded
+    
+    def _load_embedding_rows(self, rows: List[Dict[str, Any]]):
+        """Append embedding rows to the embeddings table with one batch load job (retried with backoff)"""
+        table_id = f"{config.dataset_ref}.product_embeddings"
+        job_config = bigquery.LoadJobConfig(
+            schema=self._embeddings_schema(),
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND
+        )
+        
+        for attempt in range(EMBEDDING_LOAD_RETRIES):
+            try:
+                # Load jobs are atomic, so a failed attempt left nothing behind to duplicate
+                load_job = self.client.load_table_from_json(rows, table_id, job_config=job_config)
+                load_job.result()
+                
+                logger.info(f"Successfully loaded {len(rows)} product embeddings")
+                return
+                
+            except Exception as e:
+                if attempt == EMBEDDING_LOAD_RETRIES - 1:
+                    logger.error(f"Error loading embeddings: {e}")
+                    raise
+                logger.warning(f"Embedding load attempt {attempt + 1} failed, retrying: {e}")
+                time.sleep(2 ** attempt)
+    
+    def _get_catalogue_fingerprint(self) -> Optional[str]:
+        """Fingerprint the embeddable product catalogue together with the embedding model"""
+        try:
+            query = self._build_catalogue_fingerprint_sql()
+            
+            query_job = self.client.query(query)
+            results = query_job.result()
+            
+            for row in results:
+                if row.fingerprint is None:
+                    return None
+                return f"{config.embedding_model}:{row.fingerprint}"
+            
+            return None
+            
+        except Exception as e:
+            logger.error(f"Error computing catalogue fingerprint: {e}")
+            return None
+    
+    def _get_stored_catalogue_fingerprint(self) -> Optional[str]:
+        """Get the catalogue fingerprint recorded by the last successful embedding run"""
+        try:
+            query = f"""
+            SELECT fingerprint
+            FROM `{config.dataset_ref}.product_embeddings_meta`
+            ORDER BY updated_at DESC
+            LIMIT 1
+            """
+            
+            query_job = self.client.query(query)
+            results = query_job.result()
+            
+            for row in results:
+                return row.fingerprint
+            
+            return None
+            
+        except Exception as e:
+            # Missing meta table simply means no run has been recorded yet
+            logger.info(f"No stored catalogue fingerprint: {e}")
+            return None
+    
+    def _store_catalogue_fingerprint(self, fingerprint: str):
+        """Record the catalogue fingerprint of a successful embedding run"""
+        try:
+            table_id = f"{config.dataset_ref}.product_embeddings_meta"
+            schema = [
+                bigquery.SchemaField("fingerprint", "STRING", mode="REQUIRED"),
+                bigquery.SchemaField("updated_at", "TIMESTAMP", mode="REQUIRED")
+            ]
+            self.client.create_table(bigquery.Table(table_id, schema=schema), exists_ok=True)
+            
+            query = f"""
+            DELETE FROM `{table_id}` WHERE TRUE;
+            INSERT INTO `{table_id}` (fingerprint, updated_at)
+            VALUES (@fingerprint, CURRENT_TIMESTAMP());
+            """
+            
+            query_job = run_query(self.client, query, fingerprint=fingerprint)
+            query_job.result()
+            
+        except Exception as e:
+            logger.error(f"Error storing catalogue fingerprint: {e}")
+    
+    def _delete_product_embeddings(self, product_ids: List[str], created_before: str):
+        """Delete embeddings of the given products created before created_before (ISO timestamp)"""
+        for pid in product_ids:
+            self._embedding_cache.invalidate(pid)
+        
+        try:
+            query = self._build_delete_embeddings_sql()
+            
+            query_job = run_query(self.client, query, product_ids=list(product_ids), created_before=created_before)
+            query_job.result()
+            
+        except Exception as e:
+            # Rows still in the streaming buffer cannot be deleted yet
+            logger.warning(f"Could not delete stale product embeddings: {e}")
+    
     def _create_vector_index(self):
         """Create vector index for fast similarity search"""
         try:
@@ -396,12 +1177,18 @@ class VectorSearchEngine:
                 logger.info("Vector index already exists, skipping creation")
                 return
             
+            # Size the IVF partitioning to the table: ~sqrt(rows) lists balances probe cost and recall
+            table_id = f"{config.dataset_ref}.product_embeddings"
+            num_rows = self.client.get_table(table_id).num_rows or 0
+            num_lists = min(VECTOR_INDEX_MAX_LISTS, max(VECTOR_INDEX_MIN_LISTS, int(np.ceil(np.sqrt(num_rows)))))
+            
             query = f"""
             CREATE VECTOR INDEX product_embeddings_index
-            ON `{config.dataset_ref}.product_embeddings`(embedding)
+            ON `{table_id}`(embedding)
             OPTIONS (
                 index_type = 'IVF',
-                distance_type = 'COSINE'
+                distance_type = 'COSINE',
+                ivf_options = '{{"num_lists": {num_lists}}}'
             )
             """
             
@@ -418,12 +1205,7 @@ class VectorSearchEngine:
     def _vector_index_exists(self) -> bool:
         """Check if the vector index already exists"""
         try:
-            query = f"""
-            SELECT COUNT(*) as count
-            FROM `{config.dataset_ref}.INFORMATION_SCHEMA.VECTOR_INDEXES`
-            WHERE table_name = 'product_embeddings'
-            AND index_name = 'product_embeddings_index'
-            """
+            query = self._build_vector_index_exists_sql()
             
             query_job = self.client.query(query)
             results = query_job.result()
@@ -439,17 +1221,18 @@ class VectorSearchEngine:
     
     def _get_product_embedding(self, product_id: str) -> Optional[List[float]]:
         """Get embedding for a specific product"""
+        cached = self._embedding_cache.get(product_id)
+        if cached is not None:
+            return cached
+        
         try:
-            query = f"""
-            SELECT embedding
-            FROM `{config.dataset_ref}.product_embeddings`
-            WHERE product_id = '{product_id}'
-            """
+            query = self._build_product_embedding_sql()
             
-            query_job = self.client.query(query)
+            query_job = run_query(self.client, query, product_id=product_id)
             results = query_job.result()
             
             for row in results:
+                self._embedding_cache.put(product_id, row.embedding)
                 return row.embedding
             
             return None
@@ -460,17 +1243,18 @@ class VectorSearchEngine:
     
     def _get_product_price(self, product_id: str) -> Optional[float]:
         """Get price for a specific product"""
+        cached = self._price_cache.get(product_id)
+        if cached is not None:
+            return cached
+        
         try:
-            query = f"""
-            SELECT price
-            FROM `{config.products_table}`
-            WHERE product_id = '{product_id}'
-            """
+            query = self._build_product_price_sql()
             
-            query_job = self.client.query(query)
+            query_job = run_query(self.client, query, product_id=product_id)
             results = query_job.result()
             
             for row in results:
+                self._price_cache.put(product_id, row.price)
                 return row.price
             
             return None
@@ -482,59 +1266,27 @@ class VectorSearchEngine:
     def _get_user_preferred_products(self, user_id: str) -> List[Dict[str, Any]]:
         """Get user's preferred products based on behavior"""
         try:
-            query = f"""
-            SELECT 
-                p.product_id,
-                p.name,
-                p.category,
-                COUNT(*) as interaction_count
-            FROM `{config.user_behavior_table}` ub
-            JOIN `{config.products_table}` p ON ub.product_id = p.product_id
-            WHERE ub.user_id = '{user_id}'
-            AND ub.action_type IN ('view', 'add_to_cart', 'purchase')
-            GROUP BY p.product_id, p.name, p.category
-            ORDER BY interaction_count DESC
-            LIMIT 10
-            """
+            query = self._build_user_preferred_products_sql()
             
-            query_job = self.client.query(query)
-            results = query_job.result()
-            
-            products = []
-            for row in results:
-                products.append({
-                    'product_id': row.product_id,
-                    'name': row.name,
-                    'category': row.category,
-                    'interaction_count': row.interaction_count
-                })
-            
-            return products
+            query_job = run_query(self.client, query, user_id=user_id)
+            return fetch_rows(query_job, ['product_id', 'name', 'category', 'interaction_count'])
             
         except Exception as e:
             logger.error(f"Error getting user preferred products: {e}")
             return []
     
-    def _calculate_average_embedding(self, embeddings: List[List[float]]) -> str:
-        """Calculate average embedding (simplified approach)"""
+    def _calculate_average_embedding(self, embeddings: List[List[float]]) -> List[float]:
+        """Calculate the mean (centroid) of a set of embeddings"""
         if not embeddings:
-            return "[]"
-        
-        # Simple average of embeddings
-        avg_embedding = []
-        for i in range(len(embeddings[0])):
-            avg_val = sum(emb[i] for emb in embeddings) / len(embeddings)
-            avg_embedding.append(avg_val)
+            return []
         
-        return str(avg_embedding)
+        # Vectorised reduction over the (N, d) matrix; a list binds directly as an ARRAY<FLOAT64>
+        return np.asarray(embeddings, dtype=np.float32).mean(axis=0).tolist()
     
-    def _generate_substitution_explanation(self, original_id: str, substitution_id: str, reason: str) -> str:
-        """Generate explanation for product substitution"""
+    def _generate_substitution_explanation(self, original_product: Optional[Dict[str, Any]],
+                                           substitution_product: Optional[Dict[str, Any]], reason: str) -> str:
+        """Generate explanation for product substitution from preloaded product details"""
         try:
-            # Get product details
-            original_product = self._get_product_details(original_id)
-            substitution_product = self._get_product_details(substitution_id)
-            
             if not original_product or not substitution_product:
                 return "Similar product recommendation"
             
@@ -555,23 +1307,25 @@ class VectorSearchEngine:
     
     def _get_product_details(self, product_id: str) -> Optional[Dict[str, Any]]:
         """Get basic product details"""
+        cached = self._details_cache.get(product_id)
+        if cached is not None:
+            return dict(cached)
+        
         try:
-            query = f"""
-            SELECT product_id, name, price, category
-            FROM `{config.products_table}`
-            WHERE product_id = '{product_id}'
-            """
+            query = self._build_product_details_sql()
             
-            query_job = self.client.query(query)
+            query_job = run_query(self.client, query, product_id=product_id)
             results = query_job.result()
             
             for row in results:
-                return {
+                details = {
                     'product_id': row.product_id,
                     'name': row.name,
                     'price': row.price,
                     'category': row.category
                 }
+                self._details_cache.put(product_id, details)
+                return dict(details)
             
             return None
             
@@ -579,6 +1333,38 @@ class VectorSearchEngine:
             logger.error(f"Error getting product details: {e}")
             return None
     
+    def _bulk_get_product_details(self, product_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Get basic product details for many products with one query (cached ones are not refetched)"""
+        details = {}
+        missing = []
+        for pid in dict.fromkeys(product_ids):
+            cached = self._details_cache.get(pid)
+            if cached is not None:
+                details[pid] = dict(cached)
+            else:
+                missing.append(pid)
+        
+        if not missing:
+            return details
+        
+        try:
+            query = self._build_bulk_product_details_sql()
+            
+            for row in run_query(self.client, query, product_ids=missing).result():
+                product = {
+                    'product_id': row.product_id,
+                    'name': row.name,
+                    'price': row.price,
+                    'category': row.category
+                }
+                self._details_cache.put(row.product_id, product)
+                details[row.product_id] = dict(product)
+            
+        except Exception as e:
+            logger.error(f"Error getting product details: {e}")
+        
+        return details
+    
     def _get_fallback_recommendations(self, product_id: str, top_k: int) -> List[Dict[str, Any]]:
         """Get fallback recommendations based on category when vector search fails"""
         try:
@@ -588,40 +1374,15 @@ class VectorSearchEngine:
                 return self._get_popular_products_recommendations(top_k)
             
             # Find products in the same category
-            query = f"""
-            SELECT 
-                p.product_id,
-                p.name,
-                p.description,
-                p.price,
-                p.category,
-                p.rating,
-                p.image_url,
-                p.stock_quantity
-            FROM `{config.products_table}` p
-            WHERE p.category = '{product_details['category']}'
-            AND p.product_id != '{product_id}'
-            AND p.stock_quantity > 0
-            ORDER BY p.rating DESC, p.price ASC
-            LIMIT {top_k}
-            """
-            
-            query_job = self.client.query(query)
-            results = query_job.result()
+            query = self._build_category_fallback_sql()
             
-            recommendations = []
-            for row in results:
-                recommendations.append({
-                    'product_id': row.product_id,
-                    'name': row.name,
-                    'description': row.description,
-                    'price': row.price,
-                    'category': row.category,
-                    'rating': row.rating,
-                    'image_url': row.image_url,
-                    'stock_quantity': row.stock_quantity,
-                    'similarity_score': 0.6  # Default similarity for fallback
-                })
+            query_job = run_query(
+                self.client, query,
+                category=product_details['category'],
+                product_id=product_id,
+                top_k=top_k
+            )
+            recommendations = fetch_rows(query_job, PRODUCT_COLUMNS + ['similarity_score'])
             
             return recommendations
             
@@ -632,44 +1393,11 @@ class VectorSearchEngine:
     def _get_text_search_fallback(self, search_text: str, top_k: int) -> List[Dict[str, Any]]:
         """Get fallback search results when vector search fails"""
         try:
-            # Simple keyword search
-            query = f"""
-            SELECT 
-                p.product_id,
-                p.name,
-                p.description,
-                p.price,
-                p.category,
-                p.rating,
-                p.image_url,
-                p.stock_quantity
-            FROM `{config.products_table}` p
-            WHERE p.stock_quantity > 0
-            AND (
-                LOWER(p.name) LIKE LOWER('%{search_text}%')
-                OR LOWER(p.description) LIKE LOWER('%{search_text}%')
-                OR LOWER(p.category) LIKE LOWER('%{search_text}%')
-            )
-            ORDER BY p.rating DESC, p.price ASC
-            LIMIT {top_k}
-            """
+            # Keyword search through the products search index
+            query = self._build_text_search_fallback_sql()
             
-            query_job = self.client.query(query)
-            results = query_job.result()
-            
-            products = []
-            for row in results:
-                products.append({
-                    'product_id': row.product_id,
-                    'name': row.name,
-                    'description': row.description,
-                    'price': row.price,
-                    'category': row.category,
-                    'rating': row.rating,
-                    'image_url': row.image_url,
-                    'stock_quantity': row.stock_quantity,
-                    'relevance_score': 0.5  # Default relevance for fallback
-                })
+            query_job = run_query(self.client, query, search_text=search_text, top_k=top_k)
+            products = fetch_rows(query_job, PRODUCT_COLUMNS + ['relevance_score'])
             
             return products
             
@@ -680,39 +1408,10 @@ class VectorSearchEngine:
     def _get_popular_products_recommendations(self, top_k: int) -> List[Dict[str, Any]]:
         """Get popular products as a general fallback"""
         try:
-            query = f"""
-            SELECT 
-                p.product_id,
-                p.name,
-                p.description,
-                p.price,
-                p.category,
-                p.rating,
-                p.image_url,
-                p.stock_quantity
-            FROM `{config.products_table}` p
-            WHERE p.stock_quantity > 0
-            ORDER BY p.rating DESC, p.price ASC
-            LIMIT {top_k}
-            """
+            query = self._build_popular_products_sql()
             
-            query_job = self.client.query(query)
-            results = query_job.result()
-            
-            products = []
-            for row in results:
-                products.append({
-                    'product_id': row.product_id,
-                    'name': row.name,
-                    'description': row.description,
-                    'price': row.price,
-                    'category': row.category,
-                    'rating': row.rating,
-                    'image_url': row.image_url,
-                    'stock_quantity': row.stock_quantity,
-                    'similarity_score': 0.5,  # Default similarity for popular products
-                    'recommendation_type': 'popular'
-                })
+            query_job = run_query(self.client, query, top_k=top_k)
+            products = fetch_rows(query_job, PRODUCT_COLUMNS + ['similarity_score', 'recommendation_type'])
             
             return products
             
@@ -723,16 +1422,13 @@ class VectorSearchEngine:
     def _embeddings_table_has_data(self) -> bool:
         """Check if the embeddings table already has data"""
         try:
-            table_id = f"{config.dataset_ref}.product_embeddings"
-            query = f"SELECT COUNT(*) as count FROM `{table_id}` LIMIT 1"
-            query_job = self.client.query(query)
-            results = query_job.result()
-            
-            for row in results:
-                return row.count > 0
+            # Table metadata is a single API call; rows are only ever added by load jobs,
+            # so num_rows is exact (no streaming buffer to miss)
+            table = self.client.get_table(f"{config.dataset_ref}.product_embeddings")
+            return (table.num_rows or 0) > 0
             
+        except NotFound:
             return False
-            
         except Exception as e:
             logger.error(f"Error checking if embeddings table has data: {e}")
             return False
@@ -8,23 +8,35 @@ import unittest
 from unittest.mock import Mock, patch, MagicMock
 import sys
 import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
 
 # Add src to path for imports
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-from src.ai_engine import AIEngine
-from src.marketing_engine import MarketingEngine
-from src.vector_search import VectorSearchEngine
-from src.forecasting import ForecastingEngine
-from src.data_ingestion import DataIngestion
+# Engine modules are imported inside the tests that use them, so selecting a
+# subset of tests (pytest -k) only pays for the imports those tests need
 
 class TestAIEngine(unittest.TestCase):
     """Test cases for AI Engine"""
     
     def setUp(self):
         """Set up test fixtures"""
+        from src.ai_engine import AIEngine
+        from src.embedding_cache import EmbeddingCache
+        
+        # Each test gets its own embedding store so nothing persists between runs
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        self.store_path = os.path.join(self.cache_dir, 'embeddings.sqlite')
+        self.embedding_store = EmbeddingCache(self.store_path)
+        self.addCleanup(self.embedding_store.close)
+        
         with patch('src.ai_engine.get_bigquery_client'):
-            self.ai_engine = AIEngine()
+            self.ai_engine = AIEngine(embedding_store=self.embedding_store)
     
     def test_generate_text(self):
         """Test text generation"""
@@ -36,6 +48,24 @@ class TestAIEngine(unittest.TestCase):
             result = self.ai_engine.generate_text("Test prompt")
             self.assertEqual(result, "Test generated text")
     
+    def test_generate_text_binds_prompt(self):
+        """Test that different prompts share one SQL text and differ only in parameters"""
+        with patch.object(self.ai_engine.client, 'query') as mock_query:
+            mock_result = Mock()
+            mock_result.result.return_value = [Mock(generated_text="Test generated text")]
+            mock_query.return_value = mock_result
+            
+            self.ai_engine.generate_text("First prompt")
+            self.ai_engine.generate_text("Second prompt with 'quotes'")
+            
+            first, second = mock_query.call_args_list
+            self.assertEqual(first.args[0], second.args[0])
+            self.assertNotIn('First prompt', first.args[0])
+            first_params = first.kwargs['job_config'].query_parameters
+            second_params = second.kwargs['job_config'].query_parameters
+            self.assertEqual([p.value for p in first_params], ["First prompt"])
+            self.assertEqual([p.value for p in second_params], ["Second prompt with 'quotes'"])
+    
     def test_generate_embedding(self):
         """Test embedding generation"""
         with patch.object(self.ai_engine.client, 'query') as mock_query:
@@ -45,6 +75,78 @@ class TestAIEngine(unittest.TestCase):
             
             result = self.ai_engine.generate_embedding("Test text")
             self.assertEqual(result, [0.1, 0.2, 0.3])
+            
+            # A repeated text is served from the cache
+            result = self.ai_engine.generate_embedding("Test text")
+            self.assertEqual(result, [0.1, 0.2, 0.3])
+            self.assertEqual(mock_query.call_count, 1)
+    
+    def test_generate_embedding_binds_text_and_retries_misses(self):
+        """Test that the text is bound as a parameter and an empty result is not cached"""
+        with patch.object(self.ai_engine.client, 'query') as mock_query:
+            mock_result = Mock()
+            mock_result.result.side_effect = [[], [Mock(embedding=[0.1, 0.2, 0.3])]]
+            mock_query.return_value = mock_result
+            
+            with self.assertRaises(ValueError):
+                self.ai_engine.generate_embedding("It's new")
+            
+            result = self.ai_engine.generate_embedding("It's new")
+            self.assertEqual(result, [0.1, 0.2, 0.3])
+            self.assertEqual(mock_query.call_count, 2)
+            self.assertNotIn("It's new", mock_query.call_args.args[0])
+            params = mock_query.call_args.kwargs['job_config'].query_parameters
+            self.assertEqual([p.value for p in params], ["It's new"])
+    
+    def test_generate_embedding_persists_across_instances(self):
+        """Test that a new engine reuses embeddings stored by a previous one"""
+        with patch.object(self.ai_engine.client, 'query') as mock_query:
+            mock_result = Mock()
+            mock_result.result.return_value = [Mock(embedding=[0.5, 0.25, -1.0])]
+            mock_query.return_value = mock_result
+            
+            self.ai_engine.generate_embedding("Persistent text")
+            self.assertEqual(mock_query.call_count, 1)
+        
+        from src.ai_engine import AIEngine
+        from src.embedding_cache import EmbeddingCache
+        
+        reopened_store = EmbeddingCache(self.store_path)
+        self.addCleanup(reopened_store.close)
+        with patch('src.ai_engine.get_bigquery_client'):
+            other_engine = AIEngine(embedding_store=reopened_store)
+        
+        with patch.object(other_engine.client, 'query') as mock_query:
+            result = other_engine.generate_embedding("Persistent text")
+            mock_query.assert_not_called()
+            # Stored vectors are int8-quantised, so they come back within one quantisation step
+            np.testing.assert_allclose(result, [0.5, 0.25, -1.0], atol=1 / 127)
+    
+    def test_embedding_quantisation_round_trip(self):
+        """Test that int8 quantisation preserves an embedding's direction"""
+        from src.embedding_cache import quantise_int8, dequantise_int8
+        
+        vector = np.random.default_rng(7).standard_normal(768).astype(np.float32)
+        
+        codes, scale = quantise_int8(vector)
+        self.assertEqual(codes.dtype, np.int8)
+        restored = dequantise_int8(codes, scale)
+        
+        cosine = vector @ restored / (np.linalg.norm(vector) * np.linalg.norm(restored))
+        self.assertGreater(cosine, 0.999)
+    
+    def test_batch_generate_embeddings(self):
+        """Test batch embedding generation issues a single query"""
+        with patch.object(self.ai_engine.client, 'query') as mock_query:
+            mock_result = Mock()
+            mock_result.result.return_value = [Mock(idx=i, embedding=[float(i), 0.5]) for i in range(10)]
+            mock_query.return_value = mock_result
+            
+            texts = [f"Product text {i}" for i in range(10)]
+            result = self.ai_engine.batch_generate_embeddings(texts)
+            self.assertEqual(mock_query.call_count, 1)
+            self.assertEqual(len(result), 10)
+            self.assertEqual(result[3], [3.0, 0.5])
     
     def test_analyze_sentiment(self):
         """Test sentiment analysis"""
@@ -54,12 +156,29 @@ class TestAIEngine(unittest.TestCase):
             result = self.ai_engine.analyze_sentiment("Great product!")
             self.assertIn('sentiment', result)
             self.assertIn('confidence', result)
+    
+    def test_analyze_sentiment_batch(self):
+        """Test batch sentiment analysis issues a single query"""
+        with patch.object(self.ai_engine.client, 'query') as mock_query:
+            mock_result = Mock()
+            mock_result.result.return_value = [
+                Mock(idx=i, generated_text='{"sentiment": "positive", "confidence": 0.8}') for i in range(5)
+            ]
+            mock_query.return_value = mock_result
+            
+            results = self.ai_engine.analyze_sentiment_batch([f"Great product {i}!" for i in range(5)])
+            self.assertEqual(mock_query.call_count, 1)
+            self.assertEqual(len(results), 5)
+            for result in results:
+                self.assertEqual(result['sentiment'], 'positive')
 
 class TestMarketingEngine(unittest.TestCase):
     """Test cases for Marketing Engine"""
     
     def setUp(self):
         """Set up test fixtures"""
+        from src.marketing_engine import MarketingEngine
+        
         with patch('src.marketing_engine.get_bigquery_client'):
             with patch('src.marketing_engine.AIEngine'):
                 self.marketing_engine = MarketingEngine()
@@ -95,12 +214,32 @@ class TestMarketingEngine(unittest.TestCase):
                     
                     result = self.marketing_engine.generate_product_recommendations_email("USER001")
                     self.assertEqual(result, "Recommendations email")
+    
+    def test_get_user_data_is_cached(self):
+        """Test that repeated emails for a user look the user up in BigQuery only once"""
+        with patch.object(self.marketing_engine.client, 'query') as mock_query:
+            mock_result = Mock()
+            mock_result.result.return_value = [Mock(
+                user_id='USER001', email='john.doe@example.com', first_name='John', last_name='Doe',
+                demographics='male_25_34', registration_date=None, total_orders=5,
+                avg_order_value=100.0, last_order_date=None
+            )]
+            mock_query.return_value = mock_result
+            
+            with patch.object(self.marketing_engine.ai_engine, 'generate_text') as mock_generate:
+                mock_generate.return_value = "Personalized email content"
+                
+                self.marketing_engine.generate_personalized_email("USER001", "recommendation")
+                self.marketing_engine.generate_personalized_email("USER001", "discount")
+                self.assertEqual(mock_query.call_count, 1)
 
 class TestVectorSearchEngine(unittest.TestCase):
     """Test cases for Vector Search Engine"""
     
     def setUp(self):
         """Set up test fixtures"""
+        from src.vector_search import VectorSearchEngine
+        
         with patch('src.vector_search.get_bigquery_client'):
             with patch('src.vector_search.AIEngine'):
                 self.vector_search = VectorSearchEngine()
@@ -143,12 +282,137 @@ class TestVectorSearchEngine(unittest.TestCase):
                 
                 result = self.vector_search.search_products_by_text("wireless headphones", top_k=5)
                 self.assertEqual(result, [])
+    
+    def test_search_products_by_text_reuses_near_duplicate_query(self):
+        """Test that a near-identical search is served from the semantic cache"""
+        with patch.object(self.vector_search.ai_engine, 'generate_embedding') as mock_embedding:
+            mock_embedding.side_effect = [[0.1, 0.2, 0.3], [0.1, 0.2, 0.31]]
+            
+            with patch.object(self.vector_search.client, 'query') as mock_query:
+                mock_result = Mock()
+                mock_result.result.return_value = [
+                    Mock(
+                        product_id='PROD001',
+                        name='Wireless Headphones',
+                        description='Test description',
+                        price=89.99,
+                        category='electronics',
+                        rating=4.5,
+                        image_url='test.jpg',
+                        stock_quantity=150,
+                        relevance_score=0.8
+                    )
+                ]
+                mock_query.return_value = mock_result
+                
+                first = self.vector_search.search_products_by_text("wireless headphones", top_k=5)
+                second = self.vector_search.search_products_by_text("wireless headphone", top_k=5)
+                self.assertEqual(mock_query.call_count, 1)
+                self.assertEqual(second, first)
+    
+    def test_create_product_embeddings_retries_failed_products(self):
+        """Test that a product that fails to embed keeps its old row and is retried"""
+        vs = self.vector_search
+        products = [
+            {'product_id': pid, 'name': 'Product', 'description': 'Test description', 'category': 'electronics',
+             'brand': 'Brand', 'content_fingerprint': 1, 'has_embedding': True}
+            for pid in ('PROD001', 'PROD002')
+        ]
+        
+        with patch.multiple(vs, _create_embeddings_table=Mock(), _embeddings_table_has_data=Mock(return_value=True),
+                            _get_catalogue_fingerprint=Mock(return_value='model:1'),
+                            _get_stored_catalogue_fingerprint=Mock(return_value=None),
+                            _load_embedding_rows=Mock(),
+                            _create_vector_index=Mock(), _ensure_quantised_index=Mock(),
+                            _store_catalogue_fingerprint=Mock(), _delete_product_embeddings=Mock()):
+            with patch('src.vector_search.fetch_rows', return_value=products):
+                with patch.object(vs.ai_engine, 'batch_generate_embeddings', return_value=[[0.1, 0.2], None]):
+                    self.assertTrue(vs.create_product_embeddings())
+            
+            # Only the re-embedded product loses its stale row, and the run is not recorded
+            self.assertEqual(vs._delete_product_embeddings.call_args[0][0], ['PROD001'])
+            vs._store_catalogue_fingerprint.assert_not_called()
+
+class TestRerank(unittest.TestCase):
+    """Test cases for cosine top-k reranking"""
+    
+    def test_cosine_topk_matches_argsort(self):
+        """Test that the top-k rows agree with a full argsort of cosine similarities"""
+        from src.rerank import cosine_topk
+        
+        rng = np.random.default_rng(42)
+        matrix = rng.standard_normal((1000, 64)).astype(np.float32)
+        query = rng.standard_normal(64).astype(np.float32)
+        
+        similarities = (matrix @ query) / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query))
+        expected = np.argsort(-similarities)[:10]
+        
+        result = cosine_topk(query, matrix, 10)
+        self.assertEqual(list(result), list(expected))
+    
+    def test_cosine_topk_caps_k(self):
+        """Test that k larger than the matrix returns every row"""
+        from src.rerank import cosine_topk
+        
+        matrix = np.eye(3, dtype=np.float32)
+        result = cosine_topk(np.array([0.0, 1.0, 0.0], dtype=np.float32), matrix, 10)
+        self.assertEqual(len(result), 3)
+        self.assertEqual(result[0], 1)
+    
+    def test_cosine_topk_numba_matches_numpy(self):
+        """Test that the compiled kernel agrees with the NumPy fallback, zero-norm rows included"""
+        from src import rerank
+        if rerank._cosine_topk_numba is None:
+            self.skipTest("numba is not installed")
+        
+        rng = np.random.default_rng(7)
+        matrix = rng.standard_normal((500, 32)).astype(np.float32)
+        matrix[::50] = 0.0
+        query = rng.standard_normal(32).astype(np.float32)
+        
+        for k in (1, 10, 100):
+            expected = rerank._cosine_topk_numpy(query, matrix, k)
+            self.assertEqual(list(rerank._cosine_topk_numba(query, matrix, k)), list(expected))
+        
+        # Zero rows score -inf, so a full ranking puts exactly those last
+        result = rerank._cosine_topk_numba(query, matrix, len(matrix))
+        self.assertEqual(sorted(result[-10:]), list(range(0, 500, 50)))
+
+class TestSemanticCache(unittest.TestCase):
+    """Test cases for the persisted semantic cache"""
+    
+    def setUp(self):
+        """Set up a scratch directory for cache files"""
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        self.path = os.path.join(self.cache_dir, 'semcache.npz')
+    
+    def test_save_load_round_trip(self):
+        """Test that entries survive save/load without pickle, keeping their expiry"""
+        from src.semantic_cache import SemanticCache
+        
+        cache = SemanticCache(capacity=4)
+        cache.put([1.0, 0.0, 0.0], {'answer': [1, 2]}, key='exact', scope='ai')
+        cache.put([0.0, 1.0, 0.0], ['stale'], scope='search', ttl_seconds=-1)
+        cache.save(self.path)
+        
+        loaded = SemanticCache.load(self.path, capacity=4)
+        self.assertEqual(len(loaded), 2)
+        self.assertEqual(loaded.get([1.0, 0.0, 0.0], key='exact', scope='ai'), {'answer': [1, 2]})
+        # A near-identical embedding still hits, and expired entries stay expired
+        self.assertEqual(loaded.get([1.0, 0.01, 0.0], scope='ai'), {'answer': [1, 2]})
+        self.assertIsNone(loaded.get([0.0, 1.0, 0.0], scope='search'))
+        
+        with np.load(self.path, allow_pickle=False) as data:
+            self.assertEqual(data['vectors'].dtype, np.int8)
 
 class TestForecastingEngine(unittest.TestCase):
     """Test cases for Forecasting Engine"""
     
     def setUp(self):
         """Set up test fixtures"""
+        from src.forecasting import ForecastingEngine
+        
         with patch('src.forecasting.get_bigquery_client'):
             self.forecasting = ForecastingEngine()
     
@@ -177,31 +441,82 @@ class TestForecastingEngine(unittest.TestCase):
             result = self.forecasting.forecast_revenue(forecast_periods=30)
             self.assertIn('identifier', result)
             self.assertEqual(result['identifier'], 'revenue')
+    
+    def test_forecast_product_demand_is_cacheable(self):
+        """Test that repeated forecasts send identical, parameterized SQL with the query cache on"""
+        with patch.object(self.forecasting.client, 'query') as mock_query:
+            mock_result = Mock()
+            mock_result.result.return_value = [
+                Mock(forecast_result='{"predictions": [{"value": 10}]}')
+            ]
+            mock_query.return_value = mock_result
+            
+            self.forecasting.forecast_product_demand("PROD001", forecast_periods=30)
+            self.forecasting.forecast_product_demand("PROD002", forecast_periods=30)
+            
+            first, second = mock_query.call_args_list
+            # The product is bound, not interpolated, so the SQL text is stable
+            self.assertEqual(first.args[0], second.args[0])
+            self.assertNotIn('PROD001', first.args[0])
+            job_config = second.kwargs['job_config']
+            self.assertTrue(job_config.use_query_cache)
+            params = {p.name: p.value for p in job_config.query_parameters}
+            self.assertEqual(params, {'product_id': 'PROD002', 'periods': 30})
 
 class TestDataIngestion(unittest.TestCase):
     """Test cases for Data Ingestion"""
     
     def setUp(self):
         """Set up test fixtures"""
+        from src.data_ingestion import DataIngestion
+        
         with patch('src.data_ingestion.get_bigquery_client'):
             with patch('src.data_ingestion.create_dataset_if_not_exists'):
                 self.data_ingestion = DataIngestion()
     
     def test_create_tables(self):
-        """Test table creation"""
-        with patch.object(self.data_ingestion.client, 'create_table') as mock_create:
-            mock_create.return_value = None
-            
-            result = self.data_ingestion.create_tables()
-            self.assertTrue(result)
+        """Test table creation runs every DDL statement in one script"""
+        with patch.object(self.data_ingestion.client, 'query') as mock_query:
+            with patch.object(self.data_ingestion.client, 'create_table') as mock_create:
+                result = self.data_ingestion.create_tables()
+                self.assertTrue(result)
+                
+                mock_query.assert_called_once()
+                mock_create.assert_not_called()
+                script = mock_query.call_args.args[0]
+                self.assertEqual(script.count('CREATE TABLE IF NOT EXISTS'), 7)
+                self.assertIn('CREATE SEARCH INDEX IF NOT EXISTS', script)
     
     def test_load_sample_data(self):
         """Test sample data loading"""
-        with patch.object(self.data_ingestion.client, 'insert_rows_json') as mock_insert:
-            mock_insert.return_value = None
-            
-            result = self.data_ingestion.load_sample_data()
-            self.assertTrue(result)
+        from google.cloud import bigquery
+        
+        # LoadJobConfig rejects a Mock schema, so hand it a real one
+        self.data_ingestion.client.get_table.return_value.schema = [
+            bigquery.SchemaField('id', 'STRING')
+        ]
+        
+        with patch.object(self.data_ingestion, '_table_has_data', return_value=False):
+            with patch.object(self.data_ingestion.client, 'load_table_from_json') as mock_load:
+                with patch.object(self.data_ingestion.client, 'insert_rows_json') as mock_insert:
+                    result = self.data_ingestion.load_sample_data()
+                    self.assertTrue(result)
+                    
+                    # One batch load job per table (order_items included), no streaming inserts
+                    self.assertEqual(mock_load.call_count, 6)
+                    mock_insert.assert_not_called()
+    
+    def test_load_sample_data_streaming(self):
+        """Test sample data loading through the streaming API"""
+        with patch.object(self.data_ingestion, '_table_has_data', return_value=False):
+            with patch.object(self.data_ingestion.client, 'load_table_from_json') as mock_load:
+                with patch.object(self.data_ingestion.client, 'insert_rows_json') as mock_insert:
+                    mock_insert.return_value = []
+                    
+                    result = self.data_ingestion.load_sample_data(streaming=True)
+                    self.assertTrue(result)
+                    self.assertEqual(mock_insert.call_count, 6)
+                    mock_load.assert_not_called()
 
 class TestIntegration(unittest.TestCase):
     """Integration tests for the complete system"""
@@ -237,31 +552,21 @@ class TestIntegration(unittest.TestCase):
     
     def test_demonstrate_ai_engine(self):
         """Test AI engine demonstration"""
-        with patch.object(self.engine.ai_engine, 'generate_text') as mock_generate:
-            mock_generate.return_value = "Generated text"
-            
+        def slow_generate(*args, **kwargs):
+            # Finish after the other calls so results arrive out of submission order
+            time.sleep(0.05)
+            return "Generated text"
+        
+        with patch.object(self.engine.ai_engine, 'generate_text', side_effect=slow_generate):
             result = self.engine.demonstrate_ai_engine()
-            self.assertIn('generated_text', result)
-
-def run_tests():
-    """Run all tests"""
-    # Create test suite
-    test_suite = unittest.TestSuite()
-    
-    # Add test cases
-    test_suite.addTest(unittest.makeSuite(TestAIEngine))
-    test_suite.addTest(unittest.makeSuite(TestMarketingEngine))
-    test_suite.addTest(unittest.makeSuite(TestVectorSearchEngine))
-    test_suite.addTest(unittest.makeSuite(TestForecastingEngine))
-    test_suite.addTest(unittest.makeSuite(TestDataIngestion))
-    test_suite.addTest(unittest.makeSuite(TestIntegration))
-    
-    # Run tests
-    runner = unittest.TextTestRunner(verbosity=2)
-    result = runner.run(test_suite)
-    
-    return result.wasSuccessful()
+            
+            # Every result is collected, keyed in the demo's own order regardless of completion order
+            self.assertEqual(list(result), [
+                'generated_text', 'sentiment_analysis', 'text_summary',
+                'extracted_keywords', 'text_classification'
+            ])
+            self.assertEqual(result['generated_text'], "Generated text")
 
 if __name__ == '__main__':
-    success = run_tests()
-    sys.exit(0 if success else 1)
+    import pytest
+    sys.exit(pytest.main([__file__]))
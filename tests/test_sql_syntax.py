@@ -0,0 +1,130 @@
+"""
+SQL Syntax Tests for Smart E-Commerce Intelligence Engine
+
+Submits the SQL built by each engine to BigQuery as a dry run, so the server
+parses and validates it without scanning data or using slots.
+These need credentials and network access, so they only run when
+BIGQUERY_LIVE_TESTS=1 is set.
+"""
+
+import unittest
+import os
+import sys
+
+# Add src to path for imports
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+LIVE = os.getenv('BIGQUERY_LIVE_TESTS') == '1'
+
+@unittest.skipUnless(LIVE, "set BIGQUERY_LIVE_TESTS=1 to dry-run against BigQuery")
+class TestSQLSyntax(unittest.TestCase):
+    """Dry-run every engine query builder against BigQuery"""
+    
+    @classmethod
+    def setUpClass(cls):
+        """Build the engines once, sharing one client"""
+        from config.bigquery_config import get_bigquery_client
+        from src.ai_engine import AIEngine
+        from src.marketing_engine import MarketingEngine
+        from src.vector_search import VectorSearchEngine
+        from src.forecasting import ForecastingEngine
+        from src.forecasting_simple import SimpleForecastingEngine
+        from src.main import ECommerceIntelligenceEngine
+        
+        cls.client = get_bigquery_client()
+        cls.ai_engine = AIEngine(client=cls.client)
+        cls.marketing_engine = MarketingEngine(client=cls.client)
+        cls.vector_search = VectorSearchEngine(client=cls.client)
+        cls.forecasting = ForecastingEngine(client=cls.client)
+        cls.simple_forecasting = SimpleForecastingEngine(client=cls.client)
+        cls.main_engine = ECommerceIntelligenceEngine(components=())
+    
+    def assertValidSQL(self, sql, **params):
+        """Dry-run sql with the given parameter values, bound as the engines bind them"""
+        from src.bq_utils import query_job_config
+        
+        job_config = query_job_config(params, dry_run=True, use_query_cache=False)
+        # Invalid SQL raises BadRequest here; a valid dry run completes immediately
+        query_job = self.client.query(sql, job_config=job_config)
+        self.assertEqual(query_job.state, 'DONE')
+    
+    def test_ai_engine_sql(self):
+        """Test AI engine query builders"""
+        model = self.ai_engine.embedding_config['model']
+        self.assertValidSQL(self.ai_engine._build_generate_text_sql(256), prompt="Hello")
+        self.assertValidSQL(self.ai_engine._build_batch_generate_text_sql(256), prompts=["Hello"])
+        self.assertValidSQL(self.ai_engine._build_embedding_sql(model), text="Hello")
+        self.assertValidSQL(self.ai_engine._build_batch_embedding_sql(model), texts=["Hello"])
+    
+    def test_marketing_engine_sql(self):
+        """Test marketing engine query builders"""
+        engine = self.marketing_engine
+        self.assertValidSQL(engine._build_user_profile_sql(), user_id="USER001")
+        self.assertValidSQL(engine._build_user_data_sql(), user_id="USER001")
+        self.assertValidSQL(engine._build_segment_user_data_sql("all"))
+        self.assertValidSQL(engine._build_segment_user_data_sql("premium"), segment="premium")
+        self.assertValidSQL(engine._build_users_by_segment_sql("all"))
+        self.assertValidSQL(engine._build_users_by_segment_sql("premium"), segment="premium")
+        self.assertValidSQL(engine._build_seasonal_products_sql(tagged=True), season="summer", limit=10)
+        self.assertValidSQL(engine._build_seasonal_products_sql(tagged=False), season="back to school", limit=10)
+        self.assertValidSQL(engine._build_user_preferences_sql(), user_id="USER001")
+        self.assertValidSQL(engine._build_recommended_products_sql(), limit=5)
+        self.assertValidSQL(engine._build_abandoned_cart_sql(), user_id="USER001")
+    
+    def test_vector_search_sql(self):
+        """Test vector search query builders"""
+        engine = self.vector_search
+        self.assertValidSQL(engine._build_changed_products_sql())
+        self.assertValidSQL(engine._build_catalogue_fingerprint_sql())
+        self.assertValidSQL(engine._build_vector_index_exists_sql())
+        self.assertValidSQL(
+            engine._build_similar_products_sql(),
+            query_embedding=[0.1, 0.2, 0.3], candidates=16, product_id="PROD001", top_k=5
+        )
+        self.assertValidSQL(
+            engine._build_cross_category_sql(),
+            categories=["electronics"], product_ids=["PROD001"], top_k=5
+        )
+        self.assertValidSQL(engine._build_in_stock_candidates_sql(), product_ids=["PROD001"])
+        self.assertValidSQL(
+            engine._build_delete_embeddings_sql(),
+            product_ids=["PROD001"], created_before="2024-01-01T00:00:00+00:00"
+        )
+        self.assertValidSQL(engine._build_product_embedding_sql(), product_id="PROD001")
+        self.assertValidSQL(engine._build_product_price_sql(), product_id="PROD001")
+        self.assertValidSQL(engine._build_product_details_sql(), product_id="PROD001")
+        self.assertValidSQL(engine._build_bulk_product_details_sql(), product_ids=["PROD001"])
+        self.assertValidSQL(engine._build_user_preferred_products_sql(), user_id="USER001")
+        self.assertValidSQL(
+            engine._build_category_fallback_sql(), category="electronics", product_id="PROD001", top_k=5
+        )
+        self.assertValidSQL(engine._build_text_search_sql(), search_text="headphones", top_k=3)
+        self.assertValidSQL(engine._build_text_search_fallback_sql(), search_text="headphones", top_k=3)
+        self.assertValidSQL(engine._build_popular_products_sql(), top_k=5)
+    
+    def test_forecasting_sql(self):
+        """Test forecasting query builders"""
+        self.assertValidSQL(self.forecasting._build_product_demand_sql(), product_id="PROD001", periods=30)
+        self.assertValidSQL(self.forecasting._build_category_demand_sql(), category="electronics", periods=30)
+        self.assertValidSQL(self.forecasting._build_revenue_sql(), periods=30)
+        self.assertValidSQL(
+            self.forecasting._build_seasonal_demand_sql(),
+            product_id="PROD001", start_date="2023-06-01", end_date="2023-08-31"
+        )
+        self.assertValidSQL(self.forecasting._build_trend_analysis_sql(), product_id="PROD001", period_days=30)
+    
+    def test_simple_forecasting_sql(self):
+        """Test simple forecasting query builders"""
+        engine = self.simple_forecasting
+        self.assertValidSQL(engine._build_products_demand_sql(), product_ids=["PROD001", "PROD002"])
+        self.assertValidSQL(engine._build_category_demand_sql(), category="electronics")
+        self.assertValidSQL(engine._build_revenue_sql())
+        self.assertValidSQL(engine._build_trend_analysis_sql(), product_id="PROD001", period_days=30)
+    
+    def test_business_insights_sql(self):
+        """Test the combined business insights query"""
+        self.assertValidSQL(self.main_engine._build_business_insights_sql(), user_id="USER001", top_k=5)
+
+if __name__ == '__main__':
+    import pytest
+    sys.exit(pytest.main([__file__]))